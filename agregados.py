@@ -0,0 +1,253 @@
+"""Agregados incrementales de registros de clientes.
+
+Mantiene sumas acumuladas de registros, clientes, tickets y soles por tienda,
+vendedor, fecha y rango horario. Agregar o quitar un registro solo toca sus
+propias claves, así que las estadísticas no vuelven a recorrer el historial.
+El rollup diario (tienda × fecha × rango horario × vendedor) responde las
+consultas por periodo.
+"""
+from rollup import Rollup
+
+# Sube cuando cambia lo que guarda Agregados: invalida las copias en disco
+VERSION_AGREGADOS = 2
+
+# Posiciones dentro de cada acumulado (SOLES se guarda en céntimos)
+REGISTROS, CLIENTES, TICKETS, SOLES = range(4)
+
+
+def _sumar(tabla, clave, valores, signo, copiar=False):
+    acumulado = tabla.get(clave)
+    if acumulado is None:
+        acumulado = tabla[clave] = [0, 0, 0, 0]
+    elif copiar:
+        # El acumulado puede estar compartido con otra copia: no se toca en sitio
+        acumulado = tabla[clave] = list(acumulado)
+    acumulado[REGISTROS] += signo
+    for i, valor in enumerate(valores, start=1):
+        acumulado[i] += signo * valor
+    # Una clave sin registros desaparece, igual que al recalcular desde cero
+    if acumulado[REGISTROS] <= 0:
+        del tabla[clave]
+
+
+def _fusionar(destino, origen, copiar=False):
+    for clave, acumulado in origen.items():
+        actual = destino.get(clave)
+        if actual is None:
+            destino[clave] = list(acumulado)
+        elif copiar:
+            # El acumulado puede estar compartido con otra copia: se reemplaza
+            destino[clave] = [a + b for a, b in zip(actual, acumulado)]
+        else:
+            for i, valor in enumerate(acumulado):
+                actual[i] += valor
+
+
+def _maximo(tabla, posicion=CLIENTES):
+    """(clave, valor) con mayor valor en la posición indicada, o None"""
+    if not tabla:
+        return None
+    clave = max(tabla, key=lambda k: tabla[k][posicion])
+    return clave, tabla[clave][posicion]
+
+
+def _valores(registro):
+    # Los soles se acumulan en céntimos enteros: quitar un registro no deja residuos de coma flotante
+    return (registro.get('count', 0), registro.get('tickets', 0), round((registro.get('soles', 0) or 0) * 100))
+
+
+def a_soles(centimos):
+    return centimos / 100
+
+
+def calcular_porcentaje(tickets, clientes):
+    try:
+        if clientes == 0:
+            return 0
+        return int((tickets / clientes) * 100)
+    except Exception:
+        return 0
+
+
+def stats_vacias(general=False):
+    stats = {
+        'total_clients': 0,
+        'total_records': 0,
+        'total_tickets': 0,
+        'total_soles': 0,
+        'top_seller': {'name': 'N/A', 'count': 0},
+        'avg_per_day': 0,
+        'avg_tickets_per_day': 0,
+        'avg_soles_per_day': 0,
+        'porcentaje_general': 0,
+        'ticket_promedio': 0,
+    }
+    if general:
+        stats['top_tienda'] = {'name': 'N/A', 'count': 0}
+    else:
+        stats['mejor_dia'] = {'fecha': 'N/A', 'clientes': 0}
+        stats['horario_pico'] = {'horario': 'N/A', 'clientes': 0}
+    return stats
+
+
+def _stats_base(acumulado, top_seller):
+    total_records, total_clients, total_tickets, total_centimos = acumulado
+    total_soles = a_soles(total_centimos)
+    nombre, cantidad = top_seller or ('N/A', 0)
+    return {
+        'total_clients': total_clients,
+        'total_records': total_records,
+        'total_tickets': total_tickets,
+        'total_soles': total_soles,
+        'top_seller': {'name': nombre, 'count': cantidad},
+        'avg_per_day': round(total_clients / total_records if total_records > 0 else 0, 1),
+        'avg_tickets_per_day': round(total_tickets / total_records if total_records > 0 else 0, 1),
+        'avg_soles_per_day': round(total_soles / total_records if total_records > 0 else 0, 1),
+        'porcentaje_general': calcular_porcentaje(total_tickets, total_clients),
+        'ticket_promedio': round(total_soles / total_tickets if total_tickets > 0 else 0, 1),
+    }
+
+
+class Agregados:
+    """Sumas acumuladas por tienda, vendedor, fecha y horario"""
+
+    def __init__(self, registros=()):
+        self.total = [0, 0, 0, 0]
+        self.por_seller = {}
+        self.por_tienda = {}
+        self.por_tienda_seller = {}
+        self.por_tienda_fecha = {}
+        self.por_tienda_horario = {}
+        self.diario = Rollup()
+        for registro in registros:
+            self.agregar(registro)
+
+    def _aplicar(self, registro, signo, copiar=False):
+        valores = _valores(registro)
+        # Los registros antiguos sin tienda se agrupan bajo None
+        tienda = registro.get('tienda')
+        self.total[REGISTROS] += signo
+        for i, valor in enumerate(valores, start=1):
+            self.total[i] += signo * valor
+        _sumar(self.por_seller, registro.get('seller', 'Desconocido'), valores, signo, copiar)
+        _sumar(self.por_tienda, tienda, valores, signo, copiar)
+        for tabla, clave in (
+            (self.por_tienda_seller, registro.get('seller', 'Desconocido')),
+            (self.por_tienda_fecha, registro.get('date', '')),
+            (self.por_tienda_horario, registro.get('rango_horario', '')),
+        ):
+            subtabla = tabla.get(tienda, {})
+            if copiar:
+                subtabla = dict(subtabla)
+            tabla[tienda] = subtabla
+            _sumar(subtabla, clave, valores, signo, copiar)
+            if not subtabla:
+                del tabla[tienda]
+        if copiar:
+            self.diario = self.diario.con_registro(registro, valores, signo)
+        else:
+            self.diario.agregar(registro, valores, signo)
+
+    def agregar(self, registro):
+        self._aplicar(registro, 1)
+
+    def quitar(self, registro):
+        self._aplicar(registro, -1)
+
+    def _copia_superficial(self):
+        copia = Agregados()
+        copia.total = list(self.total)
+        for nombre in ('por_seller', 'por_tienda', 'por_tienda_seller', 'por_tienda_fecha', 'por_tienda_horario'):
+            setattr(copia, nombre, dict(getattr(self, nombre)))
+        copia.diario = self.diario
+        return copia
+
+    def con_registro(self, registro):
+        """Copia con el registro sumado; comparte con esta todo lo que no cambia"""
+        copia = self._copia_superficial()
+        copia._aplicar(registro, 1, copiar=True)
+        return copia
+
+    def sin_registro(self, registro):
+        """Copia con el registro restado; esta instancia no se modifica"""
+        copia = self._copia_superficial()
+        copia._aplicar(registro, -1, copiar=True)
+        return copia
+
+    def sin_registros(self, registros):
+        """Copia con varios registros restados (una sola copia superficial)"""
+        copia = self._copia_superficial()
+        for registro in registros:
+            copia._aplicar(registro, -1, copiar=True)
+        return copia
+
+    def fusionar(self, otro):
+        """Sumar en esta instancia los acumulados de otra (p. ej. de otro segmento)"""
+        for i, valor in enumerate(otro.total):
+            self.total[i] += valor
+        _fusionar(self.por_seller, otro.por_seller)
+        _fusionar(self.por_tienda, otro.por_tienda)
+        for nombre in ('por_tienda_seller', 'por_tienda_fecha', 'por_tienda_horario'):
+            destino = getattr(self, nombre)
+            for tienda, subtabla in getattr(otro, nombre).items():
+                _fusionar(destino.setdefault(tienda, {}), subtabla)
+        self.diario.fusionar(otro.diario)
+        return self
+
+    def con_agregados(self, otro):
+        """Copia con otros agregados sumados (un lote); esta instancia no se modifica"""
+        copia = self._copia_superficial()
+        copia.total = [a + b for a, b in zip(self.total, otro.total)]
+        _fusionar(copia.por_seller, otro.por_seller, copiar=True)
+        _fusionar(copia.por_tienda, otro.por_tienda, copiar=True)
+        for nombre in ('por_tienda_seller', 'por_tienda_fecha', 'por_tienda_horario'):
+            destino = getattr(copia, nombre)
+            for tienda, subtabla in getattr(otro, nombre).items():
+                destino[tienda] = dict(destino.get(tienda, {}))
+                _fusionar(destino[tienda], subtabla, copiar=True)
+        copia.diario = self.diario.con_rollup(otro.diario)
+        return copia
+
+    def totales_vendedor(self, tienda, desde=None, hasta=None):
+        """{vendedor: [registros, clientes, tickets, céntimos]} de una tienda (en el periodo)"""
+        if desde is None and hasta is None:
+            return self.por_tienda_seller.get(tienda, {})
+        return self.diario.resumen(tienda, desde, hasta)['por_vendedor']
+
+    def stats_tienda(self, tienda, desde=None, hasta=None):
+        """Mismo resultado que recorrer los registros de la tienda (entre desde y hasta)"""
+        if desde is None and hasta is None:
+            acumulado = self.por_tienda.get(tienda)
+            por_seller = self.por_tienda_seller.get(tienda, {})
+            por_fecha = self.por_tienda_fecha.get(tienda, {})
+            por_horario = self.por_tienda_horario.get(tienda, {})
+        else:
+            resumen = self.diario.resumen(tienda, desde, hasta)
+            acumulado = resumen['total'] if resumen['total'][REGISTROS] else None
+            por_seller, por_fecha, por_horario = (resumen['por_vendedor'], resumen['por_fecha'],
+                                                  resumen['por_horario'])
+        if not acumulado:
+            return stats_vacias()
+        stats = _stats_base(acumulado, _maximo(por_seller))
+        mejor_dia = _maximo(por_fecha) or ('N/A', 0)
+        horario_pico = _maximo(por_horario) or ('N/A', 0)
+        stats['mejor_dia'] = {'fecha': mejor_dia[0], 'clientes': mejor_dia[1]}
+        stats['horario_pico'] = {'horario': horario_pico[0], 'clientes': horario_pico[1]}
+        return stats
+
+    def mapa_calor(self, tienda, desde=None, hasta=None):
+        """Clientes por día de la semana (filas, lunes primero) y rango horario (columnas)"""
+        return self.diario.mapa_calor(tienda, desde, hasta)
+
+    def stats_general(self):
+        """Estadísticas de todas las tiendas"""
+        if self.total[REGISTROS] <= 0:
+            return stats_vacias(general=True)
+        stats = _stats_base(self.total, _maximo(self.por_seller))
+        tiendas = {}
+        for tienda, acumulado in self.por_tienda.items():
+            nombre = 'Desconocido' if tienda is None else tienda
+            tiendas[nombre] = tiendas.get(nombre, 0) + acumulado[CLIENTES]
+        top_tienda = max(tiendas, key=tiendas.get)
+        stats['top_tienda'] = {'name': top_tienda, 'count': tiendas[top_tienda]}
+        return stats
@@ -0,0 +1,1313 @@
+"""Capa de almacenamiento de registros de clientes.
+
+No depende de Streamlit: la usan app.py y cualquier proceso sin interfaz.
+El backend se elige con la variable de entorno VIALE_ALMACENAMIENTO:
+"jsonl" (por defecto), "json", "sqlite", "segmentos" o "binario".
+"""
+import gzip
+import io
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date
+
+import formato_binario
+from agregados import VERSION_AGREGADOS, Agregados
+from columnar import TablaColumnar, construir_agregados
+from modelo import CAMPOS, nuevo_id
+
+try:
+    import fcntl
+except ImportError:
+    # Sin flock (Windows) solo se coordinan los hilos del proceso
+    fcntl = None
+
+DIRECTORIO_DATOS = os.environ.get("VIALE_DIRECTORIO_DATOS", "./datos_persistentes")
+BACKEND_POR_DEFECTO = os.environ.get("VIALE_ALMACENAMIENTO", "jsonl").lower()
+# El journal se compacta en segundo plano cuando las lápidas superan este mínimo
+# y esta proporción de los registros vivos
+MINIMO_LAPIDAS = 100
+PROPORCION_LAPIDAS = 0.2
+# Backend segmentado: meses que siguen abiertos (el actual y los anteriores)
+MESES_ABIERTOS = int(os.environ.get("VIALE_MESES_ABIERTOS", "2"))
+# Así empieza una lápida del journal (se detecta sin decodificar JSON)
+PREFIJO_LAPIDA = '{"eliminado"'
+# Primera línea del delta del backend binario: a qué archivo base corresponde
+PREFIJO_GENERACION = '{"generacion"'
+# Journal: se guarda una instantánea (tabla + agregados) cada vez que quedan
+# más de estos bytes sin cubrir; al arrancar solo se reproduce lo posterior
+INTERVALO_INSTANTANEA = int(os.environ.get("VIALE_INTERVALO_INSTANTANEA", str(4 * 1024 * 1024)))
+# Backend binario: el delta se vuelca al archivo base al pasar este tamaño
+MAXIMO_DELTA = int(os.environ.get("VIALE_MAXIMO_DELTA", str(8 * 1024 * 1024)))
+
+
+
+def obtener_directorio_datos(directorio=None):
+    """Obtener (y crear si falta) el directorio de datos persistentes"""
+    directorio_datos = directorio or DIRECTORIO_DATOS
+    if not os.path.exists(directorio_datos):
+        os.makedirs(directorio_datos, exist_ok=True)
+    return directorio_datos
+
+
+def escribir_atomico(ruta_archivo, escribir, modo='w'):
+    """Escribir en un temporal del mismo directorio y reemplazar de forma atómica"""
+    fd, ruta_temporal = tempfile.mkstemp(dir=os.path.dirname(ruta_archivo) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, modo, **({} if 'b' in modo else {'encoding': 'utf-8'})) as f:
+            escribir(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(ruta_temporal, ruta_archivo)
+    except Exception:
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+        raise
+
+
+def serializar_linea(registro):
+    return json.dumps(registro, ensure_ascii=False, default=str) + '\n'
+
+
+def anexar_linea(ruta_archivo, linea):
+    with open(ruta_archivo, 'a', encoding='utf-8') as f:
+        f.write(linea)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# Estado compartido por todas las sesiones para una versión del almacén.
+# Nunca se modifica: cada escritura publica una instantánea nueva. Los
+# registros son una TablaColumnar (secuencia de dicts de solo lectura); en el
+# backend segmentado solo contiene la ventana activa, pero los agregados
+# siempre cubren toda la historia.
+Instantanea = namedtuple('Instantanea', ['version', 'registros', 'agregados'])
+
+
+class AlmacenBase:
+    """Operaciones comunes e instantánea compartida por el proceso.
+
+    Las subclases implementan iterar, _guardar, _agregar y _eliminar. La
+    instantánea se invalida por la firma de los archivos de datos (inodo,
+    mtime, tamaño): solo se vuelve a leer el almacén cuando esa firma cambia.
+    Todas las escrituras pasan por el mismo cerrojo, así que hay un único
+    escritor por proceso y las lecturas no necesitan bloquear. Entre procesos
+    (la app y el servidor de ingesta) las escrituras y las compactaciones se
+    coordinan con flock sobre el archivo ruta + '.lock'.
+    """
+    nombre = ''
+    nombre_archivo = ''
+    consulta_por_tienda = False
+    # ¿Tras _guardar el almacén contiene exactamente la lista guardada?
+    _guardado_es_exacto = False
+    # ¿Hace falta el archivo .lock para coordinar escritores de varios procesos?
+    bloqueo_entre_procesos = True
+
+    def __init__(self, directorio=None):
+        self.directorio = obtener_directorio_datos(directorio)
+        self.ruta = os.path.join(self.directorio, self.nombre_archivo)
+        self.avisos = []
+        self._cerrojo = threading.RLock()
+        # Archivo .lock abierto mientras este proceso tiene el bloqueo exclusivo
+        self._bloqueo = None
+        self._firma_cache = None
+        self._instantanea = Instantanea(0, TablaColumnar(), Agregados())
+
+    @property
+    def version(self):
+        return self._instantanea.version
+
+    @property
+    def publicada(self):
+        """Última instantánea publicada, sin comprobar si el almacén cambió"""
+        return self._instantanea
+
+    def existe(self):
+        return os.path.exists(self.ruta)
+
+    @contextmanager
+    def _exclusivo(self):
+        """Cerrojo del proceso más el bloqueo del archivo .lock frente a otros procesos.
+        Es reentrante: flock sobre un segundo descriptor del mismo proceso se bloquearía"""
+        with self._cerrojo:
+            if self._bloqueo is not None or fcntl is None or not self.bloqueo_entre_procesos:
+                yield
+                return
+            with open(self.ruta + '.lock', 'a') as bloqueo:
+                fcntl.flock(bloqueo, fcntl.LOCK_EX)
+                self._bloqueo = bloqueo
+                try:
+                    yield
+                finally:
+                    self._bloqueo = None
+                    fcntl.flock(bloqueo, fcntl.LOCK_UN)
+
+    def migrar(self):
+        """Importar datos de un formato anterior; devuelve cuántos registros migró"""
+        return 0
+
+    def asignar_ids(self):
+        """Dar un id estable a los registros antiguos que no lo tienen; devuelve cuántos"""
+        with self._exclusivo():
+            if not self.instantanea().registros.filas_sin_id():
+                return 0
+            tabla = self.tabla_completa()
+            faltantes = tabla.filas_sin_id()
+            self.guardar(TablaColumnar.desde_registros(
+                r if 'id' in r else dict(r, id=nuevo_id()) for r in tabla
+            ))
+            return faltantes
+
+    def compactar(self):
+        """Reescribir el almacén sin entradas muertas; devuelve cuántas quitó"""
+        return 0
+
+    def archivos_datos(self):
+        return [self.ruta]
+
+    def firma(self):
+        """(inodo, mtime, tamaño) de cada archivo de datos; None si no existe"""
+        firma = []
+        for ruta in self.archivos_datos():
+            try:
+                estado = os.stat(ruta)
+            except FileNotFoundError:
+                firma.append(None)
+            else:
+                firma.append((estado.st_ino, estado.st_mtime_ns, estado.st_size))
+        return tuple(firma)
+
+    def instantanea(self):
+        """Instantánea vigente; solo se lee el almacén si su firma cambió"""
+        with self._cerrojo:
+            firma = self.firma()
+            if firma != self._firma_cache:
+                tabla = self._leer_tabla(firma)
+                self._publicar(tabla, construir_agregados(tabla), firma)
+            return self._instantanea
+
+    def _leer_tabla(self, firma=None):
+        """Todo el almacén como TablaColumnar (lectura completa); firma es la
+        que se publicará con la tabla"""
+        return TablaColumnar.desde_registros(self.iterar())
+
+    def cargar_cacheado(self):
+        """(versión, registros); la tabla se comparte entre sesiones y es de solo lectura"""
+        instantanea = self.instantanea()
+        return instantanea.version, instantanea.registros
+
+    def _publicar(self, registros, agregados, firma=None):
+        self._firma_cache = self.firma() if firma is None else firma
+        self._instantanea = Instantanea(self._instantanea.version + 1, registros, agregados)
+
+    def _escritura_exacta(self, firma_antes, firma_despues, registro):
+        """¿La escritura de registro explica todo el cambio de firma?"""
+        return False
+
+    def guardar(self, registros):
+        with self._exclusivo():
+            self._guardar(registros)
+            if self._guardado_es_exacto:
+                if not isinstance(registros, TablaColumnar):
+                    registros = TablaColumnar.desde_registros(registros)
+                self._publicar(registros, construir_agregados(registros))
+
+    def agregar(self, registro):
+        """Agregar un registro; devuelve la versión vigente tras escribir"""
+        with self._exclusivo():
+            firma_antes = self.firma()
+            self._agregar(registro)
+            # Solo se parcha la instantánea si estaba al día y nadie más escribió
+            if firma_antes == self._firma_cache and self._escritura_exacta(firma_antes, self.firma(), registro):
+                previa = self._instantanea
+                self._publicar(previa.registros.con_registro(registro), previa.agregados.con_registro(registro))
+            return self.version
+
+    def agregar_lote(self, registros):
+        """Agregar muchos registros en una sola escritura; devuelve la versión vigente"""
+        if not registros:
+            return self.version
+        with self._exclusivo():
+            firma_antes = self.firma()
+            escrito = self._agregar_lote(registros)
+            if firma_antes == self._firma_cache and self._escritura_exacta_lote(firma_antes, self.firma(), escrito):
+                previa = self._instantanea
+                self._publicar(previa.registros.con_registros(registros),
+                               previa.agregados.con_agregados(Agregados(registros)))
+            return self.version
+
+    def _agregar_lote(self, registros):
+        for registro in registros:
+            self._agregar(registro)
+
+    def _escritura_exacta_lote(self, firma_antes, firma_despues, escrito):
+        return False
+
+    def eliminar(self, clave, fecha=None):
+        """Eliminar por id; devuelve el registro eliminado o None.
+
+        fecha es una pista opcional (la del registro) para los backends que
+        particionan por fecha; los demás la ignoran.
+        """
+        with self._exclusivo():
+            eliminado, restantes = self._eliminar(clave, fecha)
+            if eliminado is not None and restantes is not None:
+                # _eliminar parte de la instantánea vigente, así que sus agregados son los previos
+                self._publicar(restantes, self._instantanea.agregados.sin_registro(eliminado))
+            return eliminado
+
+    def cargar(self):
+        return list(self.iterar())
+
+    def tabla_completa(self):
+        """Toda la historia como TablaColumnar (exportación, limpieza)"""
+        return self.instantanea().registros
+
+    def pagina_tienda(self, tienda, desde=None, hasta=None, vendedor=None, inicio=0, cantidad=50):
+        """(total, [(clave, registro)]) de una página del historial; la clave sirve para eliminar"""
+        return self.instantanea().registros.pagina_historial(tienda, desde, hasta, vendedor, inicio, cantidad)
+
+
+class AlmacenJSON(AlmacenBase):
+    """Archivo JSON único con la lista completa (formato original)"""
+    nombre = 'json'
+    nombre_archivo = 'registros_clientes_viale.json'
+    # Reescribir el archivo deja exactamente la lista guardada
+    _guardado_es_exacto = True
+
+    def iterar(self):
+        self.avisos = []
+        if not self.existe():
+            return iter([])
+        with open(self.ruta, 'r', encoding='utf-8') as f:
+            registros = json.load(f)
+        if not isinstance(registros, list):
+            raise ValueError("Formato de archivo inválido")
+        return iter(registros)
+
+    def _guardar(self, registros):
+        escribir_atomico(self.ruta, lambda f: json.dump(list(registros), f, ensure_ascii=False, indent=2, default=str))
+
+    def _agregar(self, registro):
+        self.guardar(self.instantanea().registros.con_registro(registro))
+
+    def _agregar_lote(self, registros):
+        self.guardar(self.instantanea().registros.con_registros(registros))
+
+    def _eliminar(self, clave, fecha=None):
+        """(eliminado, restantes); la clave es el id del registro"""
+        tabla = self.instantanea().registros
+        fila = tabla.posicion_id(clave)
+        if fila is None:
+            return None, None
+        eliminado = tabla[fila]
+        restantes = tabla.sin_fila(fila)
+        self._guardar(restantes)
+        return eliminado, restantes
+
+
+class AlmacenJournal(AlmacenJSON):
+    """Journal JSON Lines append-only: agregar solo anexa una línea.
+
+    Eliminar también anexa: una lápida {"eliminado": id} que oculta el registro
+    al reproducir el journal. Cuando se acumulan lápidas, un hilo en segundo
+    plano compacta el archivo reescribiéndolo solo con los registros vivos.
+
+    Para arrancar rápido, cada INTERVALO_INSTANTANEA bytes se guarda en
+    segundo plano la instantánea materializada (tabla en formato binario y
+    agregados) junto con la firma del journal que cubre. Al arrancar se carga
+    esa instantánea y solo se reproduce la cola del journal posterior.
+    """
+    nombre = 'jsonl'
+    nombre_archivo = 'registros_clientes_viale.jsonl'
+
+    def __init__(self, directorio=None):
+        super().__init__(directorio)
+        self.lapidas = 0
+        self._compactando = False
+        self.ruta_instantanea = self.ruta + '.instantanea'
+        # Firma cubierta por la última instantánea guardada o cargada
+        self._firma_guardada = None
+        self._guardando_instantanea = False
+
+    def migrar(self):
+        """Convertir el JSON único al journal (una sola vez); el original queda como .migrado"""
+        origen = AlmacenJSON(self.directorio)
+        # La app y el servicio de ingesta migran al arrancar: solo uno lo hace
+        with self._exclusivo():
+            if not origen.existe() or self.existe():
+                return 0
+            registros = origen.cargar()
+            self.guardar(registros)
+            os.replace(origen.ruta, origen.ruta + '.migrado')
+            return len(registros)
+
+    def _lineas(self, hasta=None):
+        """Líneas del journal; con hasta, solo las completas dentro de los primeros hasta bytes"""
+        leidos = 0
+        with open(self.ruta, 'rb') as f:
+            for linea in f:
+                leidos += len(linea)
+                if hasta is not None and leidos > hasta:
+                    return
+                yield linea.decode('utf-8', errors='replace')
+
+    def _leer_lapidas(self, hasta=None):
+        # Primera pasada sin decodificar JSON: solo las líneas que empiezan como lápida
+        eliminados = set()
+        for linea in self._lineas(hasta):
+            if linea.startswith(PREFIJO_LAPIDA):
+                try:
+                    eliminados.add(json.loads(linea)['eliminado'])
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    pass
+        return eliminados
+
+    def iterar(self, hasta=None):
+        """Reproducir el journal línea por línea; ignora líneas dañadas y eliminadas.
+        Con hasta solo se leen los primeros hasta bytes"""
+        self.avisos = []
+        if not self.existe():
+            self.lapidas = 0
+            return
+        eliminados = self._leer_lapidas(hasta)
+        lapidas = 0
+        for numero, linea in enumerate(self._lineas(hasta), start=1):
+            if linea.startswith(PREFIJO_LAPIDA):
+                lapidas += 1
+                continue
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError:
+                self.avisos.append(f"Línea {numero} del journal dañada, se omite")
+                continue
+            if eliminados and registro.get('id') in eliminados:
+                continue
+            yield registro
+        self.lapidas = lapidas
+
+    @staticmethod
+    def _tamano_journal(firma):
+        # El journal es el primer archivo de la firma
+        return firma[0][2] if firma and firma[0] is not None else None
+
+    def _leer_tabla(self, firma=None):
+        # Solo hasta el tamaño de la firma, sin bloquear a los escritores: lo que
+        # otro proceso anexe durante la lectura llega en la próxima cola
+        return TablaColumnar.desde_registros(self.iterar(self._tamano_journal(firma)))
+
+    def instantanea(self):
+        """Como en la base, pero si otro proceso (p. ej. el servicio de ingesta)
+        solo anexó líneas, se leen únicamente esas; en frío se parte de la
+        instantánea guardada"""
+        with self._cerrojo:
+            firma = self.firma()
+            if firma != self._firma_cache and self._solo_anexado(self._firma_cache, firma):
+                self._aplicar_cola(firma)
+            elif firma != self._firma_cache:
+                self._cargar_instantanea_guardada(firma)
+            return super().instantanea()
+
+    def _publicar(self, registros, agregados, firma=None):
+        super()._publicar(registros, agregados, firma)
+        self._programar_instantanea()
+
+    # Instantánea en disco
+
+    def _cubre(self, guardada, firma):
+        """¿firma es guardada más líneas anexadas al journal?"""
+        return guardada == firma or self._solo_anexado(guardada, firma)
+
+    def _cargar_instantanea_guardada(self, firma):
+        """Publicar la instantánea guardada y aplicarle la cola del journal.
+        Si falta, está dañada o no corresponde al journal actual no se toca nada
+        y la lectura completa se encarga."""
+        try:
+            with open(self.ruta_instantanea, 'rb') as f:
+                guardada = pickle.load(f)
+            firma_guardada = tuple(tuple(p) if p is not None else None for p in guardada['firma'])
+            # La marca descarta un journal nuevo que reutilizó el inodo del anterior
+            if not self._cubre(firma_guardada, firma) or self._marca(firma_guardada) != guardada['marca']:
+                return
+            if guardada.get('version_agregados') != VERSION_AGREGADOS:
+                return
+            tabla, _ = formato_binario.leer_tabla(io.BytesIO(guardada['tabla']))
+            agregados = guardada['agregados']
+        except (OSError, pickle.PickleError, EOFError, KeyError, TypeError, ValueError, AttributeError):
+            return
+        self.avisos = []
+        self.lapidas = guardada.get('lapidas', 0)
+        self._firma_guardada = firma_guardada
+        self._publicar(tabla, agregados, firma_guardada)
+        if firma_guardada != firma:
+            self._aplicar_cola(firma)
+
+    def _marca(self, firma):
+        """Últimos bytes del journal cubiertos por la firma"""
+        tamano = firma[0][2]
+        with open(self.ruta, 'rb') as f:
+            f.seek(max(0, tamano - 64))
+            return f.read(min(tamano, 64))
+
+    def _sin_cubrir(self):
+        """Bytes del almacén que la última instantánea guardada no cubre"""
+        firma = self._firma_cache
+        if not firma or firma[0] is None:
+            return 0
+        guardada = self._firma_guardada
+        if guardada is not None and self._cubre(guardada, firma):
+            return firma[0][2] - guardada[0][2]
+        return sum(parte[2] for parte in firma if parte is not None)
+
+    def _programar_instantanea(self):
+        if self._guardando_instantanea or self._sin_cubrir() <= INTERVALO_INSTANTANEA:
+            return
+        instantanea, firma = self._instantanea, self._firma_cache
+        try:
+            marca = self._marca(firma)
+        except OSError:
+            return
+        self._guardando_instantanea = True
+        # La tabla se vuelca aquí, bajo el cerrojo: comparte arreglos y extras con las
+        # tablas que se derivan después. Los agregados nunca se modifican en sitio.
+        tabla = io.BytesIO()
+        formato_binario.escribir_tabla(tabla, instantanea.registros)
+        guardada = {'firma': firma, 'marca': marca, 'tabla': tabla.getvalue(),
+                    'agregados': instantanea.agregados, 'version_agregados': VERSION_AGREGADOS,
+                    'lapidas': self.lapidas}
+        threading.Thread(target=self._guardar_instantanea, args=(guardada,),
+                         name='guardar-instantanea', daemon=True).start()
+
+    def _guardar_instantanea(self, guardada):
+        try:
+            escribir_atomico(self.ruta_instantanea, lambda f: pickle.dump(guardada, f, protocol=pickle.HIGHEST_PROTOCOL),
+                             modo='wb')
+            self._firma_guardada = guardada['firma']
+        except Exception as e:
+            print(f"No se pudo guardar la instantánea {self.ruta_instantanea}: {e}", file=sys.stderr)
+        finally:
+            self._guardando_instantanea = False
+
+    @staticmethod
+    def _solo_anexado(firma_antes, firma_despues):
+        # El journal (primer archivo) creció y el resto de archivos no cambió
+        if not firma_antes or firma_antes[0] is None or firma_despues[0] is None:
+            return False
+        antes, despues = firma_antes[0], firma_despues[0]
+        return antes[0] == despues[0] and despues[2] > antes[2] and firma_antes[1:] == firma_despues[1:]
+
+    def _aplicar_cola(self, firma):
+        """Parchar la instantánea con las líneas anexadas desde la firma en caché.
+        Si la cola no empieza y termina en un salto de línea no se toca nada y
+        la lectura completa se encarga."""
+        desde, hasta = self._firma_cache[0][2], firma[0][2]
+        with open(self.ruta, 'rb') as f:
+            f.seek(desde - 1 if desde else 0)
+            cola = f.read(hasta - desde + (1 if desde else 0))
+        if desde:
+            if cola[:1] != b'\n':
+                return
+            cola = cola[1:]
+        if not cola.endswith(b'\n'):
+            return
+        previa = self._instantanea
+        tabla, agregados = self._reproducir(previa.registros, previa.agregados,
+                                            cola.decode('utf-8', errors='replace').splitlines())
+        self._publicar(tabla, agregados, firma)
+
+    def _reproducir(self, tabla, agregados, lineas):
+        """(tabla, agregados) con las líneas del journal aplicadas: registros nuevos
+        al final y lápidas que quitan filas; agregados puede ser None (no se calculan)"""
+        nuevos = {}
+        eliminados = []
+        # Registros anexados y eliminados dentro de las mismas líneas
+        anulados = []
+        for linea in lineas:
+            linea = linea.strip()
+            if not linea or linea.startswith(PREFIJO_GENERACION):
+                continue
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError:
+                self.avisos.append("Línea del journal dañada, se omite")
+                continue
+            if not (linea.startswith(PREFIJO_LAPIDA) and isinstance(registro, dict) and 'eliminado' in registro):
+                # Los registros sin id no pueden tener lápida: clave propia
+                nuevos[registro.get('id', object()) if isinstance(registro, dict) else object()] = registro
+                continue
+            self.lapidas += 1
+            clave = registro['eliminado']
+            if nuevos.pop(clave, None) is None:
+                eliminados.append(clave)
+            else:
+                anulados.append(clave)
+        if nuevos or anulados:
+            # Registros que la tabla ya tiene (una lectura completa que se adelantó a su
+            # firma): no se vuelven a añadir, y si después se eliminaron se quitan
+            presentes = tabla.ids_presentes(list(nuevos) + anulados)
+            if presentes:
+                nuevos = {clave: r for clave, r in nuevos.items() if clave not in presentes}
+                eliminados += [clave for clave in anulados if clave in presentes]
+        filas = [f for f in map(tabla.posicion_id, eliminados) if f is not None]
+        if filas:
+            if agregados is not None:
+                agregados = agregados.sin_registros(tabla.filas(filas))
+            tabla = tabla.sin_filas(filas)
+        if nuevos:
+            nuevos = list(nuevos.values())
+            tabla = tabla.con_registros(nuevos)
+            if agregados is not None:
+                agregados = agregados.con_agregados(Agregados(nuevos))
+        return tabla, agregados
+
+    def _guardar(self, registros):
+        escribir_atomico(self.ruta, lambda f: f.writelines(serializar_linea(r) for r in registros))
+        self.lapidas = 0
+
+    def _agregar(self, registro):
+        anexar_linea(self.ruta, serializar_linea(registro))
+
+    def _agregar_lote(self, registros):
+        """Todo el lote en una sola escritura y un solo fsync; devuelve el texto anexado"""
+        bloque = ''.join(serializar_linea(r) for r in registros)
+        anexar_linea(self.ruta, bloque)
+        return bloque
+
+    def _escritura_exacta_lote(self, firma_antes, firma_despues, escrito):
+        return self._crecio_solo(firma_antes, firma_despues, escrito)
+
+    @staticmethod
+    def _crecio_solo(firma_antes, firma_despues, linea):
+        # Mismo archivo y creció exactamente la línea anexada: nadie más escribió
+        antes, despues = firma_antes[0], firma_despues[0]
+        if antes is None or despues is None or antes[0] != despues[0] or firma_antes[1:] != firma_despues[1:]:
+            return False
+        return despues[2] - antes[2] == len(linea.encode('utf-8'))
+
+    def _escritura_exacta(self, firma_antes, firma_despues, registro):
+        return self._crecio_solo(firma_antes, firma_despues, serializar_linea(registro))
+
+    def _eliminar(self, clave, fecha=None):
+        """Anexar una lápida en lugar de reescribir el journal"""
+        tabla = self.instantanea().registros
+        fila = tabla.posicion_id(clave)
+        if fila is None:
+            return None, None
+        eliminado = tabla[fila]
+        firma_antes = self.firma()
+        lapida = serializar_linea({'eliminado': clave})
+        anexar_linea(self.ruta, lapida)
+        self.lapidas += 1
+        self._programar_compactacion(len(tabla) - 1)
+        # Si otro proceso escribió entre medias, la próxima lectura recarga el journal
+        if firma_antes == self._firma_cache and self._crecio_solo(firma_antes, self.firma(), lapida):
+            return eliminado, tabla.sin_fila(fila)
+        return eliminado, None
+
+    def _programar_compactacion(self, vivos):
+        if self._compactando or self.lapidas < max(MINIMO_LAPIDAS, PROPORCION_LAPIDAS * vivos):
+            return
+        self._compactando = True
+        threading.Thread(target=self._compactar_en_segundo_plano, name='compactar-journal', daemon=True).start()
+
+    def _compactar_en_segundo_plano(self):
+        try:
+            self.compactar()
+        except Exception as e:
+            print(f"No se pudo compactar {self.ruta}: {e}", file=sys.stderr)
+        finally:
+            self._compactando = False
+
+    def compactar(self):
+        """Reescribir el journal solo con los registros vivos; devuelve cuántas lápidas quitó"""
+        # Con el bloqueo tomado nadie anexa: la instantánea incluye lo que otros
+        # procesos escribieron y nada se pierde al reemplazar el archivo
+        with self._exclusivo():
+            registros = self.instantanea().registros
+            lapidas = self.lapidas
+            if not lapidas:
+                return 0
+            self._guardar(registros)
+            # Los registros no cambian: se conserva la instantánea y solo se actualiza la firma
+            self._firma_cache = self.firma()
+            self._programar_instantanea()
+            return lapidas
+
+
+class AlmacenSQLite(AlmacenBase):
+    """Base SQLite embebida en modo WAL con índices por tienda"""
+    nombre = 'sqlite'
+    nombre_archivo = 'registros_clientes_viale.db'
+    consulta_por_tienda = True
+    _guardado_es_exacto = False
+    # SQLite ya coordina a los escritores con sus propios bloqueos
+    bloqueo_entre_procesos = False
+
+    # id es el id estable del registro; los que llegan sin id reciben uno autoincremental
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS registros (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tienda TEXT,
+            seller TEXT,
+            rango_horario TEXT,
+            date TEXT,
+            count INTEGER,
+            tickets INTEGER,
+            soles REAL,
+            timestamp TEXT,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_tienda_date ON registros (tienda, date);
+        CREATE INDEX IF NOT EXISTS idx_tienda_seller ON registros (tienda, seller);
+        CREATE INDEX IF NOT EXISTS idx_tienda_rango ON registros (tienda, rango_horario);
+    """
+
+    def __init__(self, directorio=None):
+        super().__init__(directorio)
+        # Una conexión por hilo: cada sesión de Streamlit corre en su propio hilo
+        self._local = threading.local()
+        with self._conexion() as con:
+            con.executescript(self.ESQUEMA)
+        # Conexión dedicada a vigilar cambios: su data_version cambia con cada
+        # commit hecho por cualquier otra conexión (de este u otro proceso).
+        # Las escrituras también van por ella, bajo el cerrojo: sus propios
+        # commits no mueven su data_version
+        self._vigia = sqlite3.connect(self.ruta, timeout=30, check_same_thread=False)
+        self._vigia.execute("PRAGMA synchronous=NORMAL")
+
+    def _conexion(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def firma(self):
+        with self._cerrojo:
+            data_version = self._vigia.execute("PRAGMA data_version").fetchone()[0]
+        return super().firma() + (data_version,)
+
+    @staticmethod
+    def _a_fila(registro):
+        extra = {k: v for k, v in registro.items() if k not in CAMPOS}
+        return tuple(registro.get(c) for c in CAMPOS) + (json.dumps(extra, ensure_ascii=False, default=str) if extra else None,)
+
+    @staticmethod
+    def _a_registro(fila):
+        # Las columnas nulas se omiten para conservar los registros antiguos sin 'tienda'
+        registro = {c: v for c, v in zip(CAMPOS, fila) if v is not None}
+        if fila[len(CAMPOS)]:
+            registro.update(json.loads(fila[len(CAMPOS)]))
+        return registro
+
+    def _insertar(self, con, registros):
+        con.executemany(
+            f"INSERT INTO registros ({', '.join(CAMPOS)}, extra) VALUES ({', '.join('?' * (len(CAMPOS) + 1))})",
+            [self._a_fila(r) for r in registros]
+        )
+
+    def migrar(self):
+        """Importar el journal o el JSON único si la base está vacía"""
+        con = self._conexion()
+        if con.execute("SELECT 1 FROM registros LIMIT 1").fetchone():
+            return 0
+        for origen in (AlmacenJournal(self.directorio), AlmacenJSON(self.directorio)):
+            if origen.existe():
+                registros = origen.cargar()
+                with con:
+                    self._insertar(con, registros)
+                os.replace(origen.ruta, origen.ruta + '.migrado')
+                return len(registros)
+        return 0
+
+    def iterar(self):
+        filas = self._conexion().execute(f"SELECT {', '.join(CAMPOS)}, extra FROM registros ORDER BY id")
+        return (self._a_registro(f) for f in filas)
+
+    def _guardar(self, registros):
+        con = self._conexion()
+        with con:
+            con.execute("DELETE FROM registros")
+            self._insertar(con, registros)
+
+    def _agregar(self, registro):
+        with self._vigia:
+            self._insertar(self._vigia, [registro])
+
+    def _agregar_lote(self, registros):
+        # Una sola transacción para todo el lote
+        with self._vigia:
+            self._insertar(self._vigia, registros)
+        return registros
+
+    @staticmethod
+    def _solo_commit_propio(firma_antes, firma_despues):
+        # data_version igual: ninguna otra conexión hizo commit entre medias
+        return firma_antes[-1] == firma_despues[-1]
+
+    def _escritura_exacta(self, firma_antes, firma_despues, registro):
+        # Sin id la base asigna uno autoincremental que la instantánea no conoce
+        return 'id' in registro and self._solo_commit_propio(firma_antes, firma_despues)
+
+    def _escritura_exacta_lote(self, firma_antes, firma_despues, escrito):
+        return all('id' in r for r in escrito) and self._solo_commit_propio(firma_antes, firma_despues)
+
+    def pagina_tienda(self, tienda, desde=None, hasta=None, vendedor=None, inicio=0, cantidad=50):
+        # idx_tienda_date resuelve el filtro y el orden; solo se leen las filas de la página
+        condiciones, parametros = ["tienda = ?"], [tienda]
+        if desde is not None:
+            condiciones.append("date >= ?")
+            parametros.append(desde.isoformat())
+        if hasta is not None:
+            condiciones.append("date <= ?")
+            parametros.append(hasta.isoformat())
+        if vendedor is not None:
+            condiciones.append("(seller = ? OR (seller IS NULL AND ? = 'Desconocido'))")
+            parametros += [vendedor, vendedor]
+        donde = ' AND '.join(condiciones)
+        con = self._conexion()
+        total = con.execute(f"SELECT COUNT(*) FROM registros WHERE {donde}", parametros).fetchone()[0]
+        filas = con.execute(
+            f"SELECT {', '.join(CAMPOS)}, extra FROM registros WHERE {donde} "
+            "ORDER BY date DESC, id DESC LIMIT ? OFFSET ?",
+            parametros + [cantidad, inicio]
+        )
+        registros = [self._a_registro(f) for f in filas]
+        return total, [(r['id'], r) for r in registros]
+
+    def _eliminar(self, clave, fecha=None):
+        firma_antes = self.firma()
+        fila = self._vigia.execute(f"SELECT {', '.join(CAMPOS)}, extra FROM registros WHERE id = ?",
+                                   (clave,)).fetchone()
+        if fila is None:
+            return None, None
+        with self._vigia:
+            self._vigia.execute("DELETE FROM registros WHERE id = ?", (clave,))
+        # Si otra conexión escribió entre medias, la próxima lectura recarga la base
+        if firma_antes == self._firma_cache and self._solo_commit_propio(firma_antes, self.firma()):
+            tabla = self._instantanea.registros
+            posicion = tabla.posicion_id(clave)
+            if posicion is not None:
+                return tabla[posicion], tabla.sin_fila(posicion)
+        return self._a_registro(fila), None
+
+
+SIN_FECHA = 'sin-fecha'
+
+
+def mes_de(registro):
+    """'AAAA-MM' de la fecha del registro; SIN_FECHA si no es una fecha ISO"""
+    valor = registro.get('date')
+    if type(valor) is str:
+        try:
+            if date.fromisoformat(valor).isoformat() == valor:
+                return valor[:7]
+        except ValueError:
+            pass
+    return SIN_FECHA
+
+
+def inicio_ventana(hoy=None):
+    """Primer mes abierto: el actual y los MESES_ABIERTOS - 1 anteriores"""
+    hoy = hoy or date.today()
+    indice = hoy.year * 12 + hoy.month - 1 - (MESES_ABIERTOS - 1)
+    return f"{indice // 12:04d}-{indice % 12 + 1:02d}"
+
+
+class AlmacenSegmentos(AlmacenBase):
+    """Un journal por mes en datos_persistentes/segmentos/.
+
+    Cada mes es un journal AAAA-MM.jsonl con lápidas, como el backend jsonl.
+    Los meses anteriores a la ventana activa (MESES_ABIERTOS) se sellan: se
+    compactan en AAAA-MM.jsonl.gz, que ya no se modifica, con sus agregados
+    precalculados en AAAA-MM.agregados. La instantánea solo decodifica los
+    registros de la ventana; de los meses sellados se cargan los agregados.
+    Lo que llegue tarde a un mes sellado (registros o lápidas) va a un
+    journal a su lado, que se funde en el sellado la próxima vez que se sella.
+    """
+    nombre = 'segmentos'
+    nombre_archivo = 'segmentos'
+    consulta_por_tienda = True
+    ABIERTO = '.jsonl'
+    SELLADO = '.jsonl.gz'
+    AGREGADOS = '.agregados'
+
+    def __init__(self, directorio=None):
+        super().__init__(directorio)
+        self._ventana = None
+        # (clave, tabla) de la última consulta fuera de la ventana, para paginar sin releer
+        self._consulta = (None, None)
+
+    def _ruta_mes(self, mes, extension):
+        return os.path.join(self.ruta, mes + extension)
+
+    def _meses(self):
+        """{mes: (¿sellado?, ¿journal?)} en orden cronológico"""
+        try:
+            nombres = os.listdir(self.ruta)
+        except FileNotFoundError:
+            return {}
+        meses = {}
+        for nombre in nombres:
+            for extension, posicion in ((self.SELLADO, 0), (self.ABIERTO, 1)):
+                if nombre.endswith(extension):
+                    meses.setdefault(nombre[:-len(extension)], [False, False])[posicion] = True
+        return {mes: tuple(partes) for mes, partes in sorted(meses.items())}
+
+    def existe(self):
+        return bool(self._meses())
+
+    def archivos_datos(self):
+        return [self._ruta_mes(mes, extension)
+                for mes, partes in self._meses().items()
+                for extension, presente in zip((self.SELLADO, self.ABIERTO), partes) if presente]
+
+    def firma(self):
+        """(nombre, inodo, mtime, tamaño) de cada segmento"""
+        firma = []
+        for ruta in self.archivos_datos():
+            try:
+                estado = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            firma.append((os.path.basename(ruta), estado.st_ino, estado.st_mtime_ns, estado.st_size))
+        return tuple(firma)
+
+    # Lectura de un mes
+
+    def _leer_journal(self, mes):
+        """(registros, {id: registro eliminado}) del journal del mes"""
+        registros, lapidas = [], {}
+        ruta = self._ruta_mes(mes, self.ABIERTO)
+        if not os.path.exists(ruta):
+            return registros, lapidas
+        with open(ruta, 'r', encoding='utf-8') as f:
+            for numero, linea in enumerate(f, start=1):
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    dato = json.loads(linea)
+                except json.JSONDecodeError:
+                    self.avisos.append(f"Línea {numero} de {mes}{self.ABIERTO} dañada, se omite")
+                    continue
+                if linea.startswith(PREFIJO_LAPIDA):
+                    lapidas[dato['eliminado']] = dato.get('registro')
+                else:
+                    registros.append(dato)
+        return registros, lapidas
+
+    def _leer_sellado(self, mes):
+        ruta = self._ruta_mes(mes, self.SELLADO)
+        if not os.path.exists(ruta):
+            return []
+        with gzip.open(ruta, 'rt', encoding='utf-8') as f:
+            return [json.loads(linea) for linea in f if linea.strip()]
+
+    def registros_mes(self, mes):
+        """Registros vivos del mes: el sellado más su journal, sin los eliminados"""
+        sellados = self._leer_sellado(mes)
+        registros, lapidas = self._leer_journal(mes)
+        if sellados and registros:
+            # Tras un sellado interrumpido el journal puede repetir registros ya sellados
+            ids = {r.get('id') for r in sellados}
+            registros = [r for r in registros if r.get('id') is None or r.get('id') not in ids]
+        registros = sellados + registros
+        if lapidas:
+            registros = [r for r in registros if r.get('id') not in lapidas]
+        return registros
+
+    def _agregados_sellado(self, mes):
+        """Agregados del archivo sellado; se recalculan si faltan o no le corresponden"""
+        estado = os.stat(self._ruta_mes(mes, self.SELLADO))
+        clave = (VERSION_AGREGADOS, estado.st_size, estado.st_mtime_ns)
+        ruta = self._ruta_mes(mes, self.AGREGADOS)
+        try:
+            with open(ruta, 'rb') as f:
+                guardado = pickle.load(f)
+            if guardado['clave'] == clave:
+                return guardado['agregados']
+        except (OSError, pickle.PickleError, EOFError, KeyError, TypeError, AttributeError):
+            pass
+        agregados = construir_agregados(TablaColumnar.desde_registros(self._leer_sellado(mes)))
+        escribir_atomico(ruta, lambda f: pickle.dump({'clave': clave, 'agregados': agregados}, f,
+                                                     protocol=pickle.HIGHEST_PROTOCOL), modo='wb')
+        return agregados
+
+    def _agregados_mes(self, mes, sellado, journal):
+        """Agregados de un mes fuera de la ventana sin decodificar su archivo sellado"""
+        if not journal:
+            return self._agregados_sellado(mes)
+        if not sellado:
+            return construir_agregados(TablaColumnar.desde_registros(self.registros_mes(mes)))
+        agregados = self._agregados_sellado(mes)
+        registros, lapidas = self._leer_journal(mes)
+        for registro in registros:
+            agregados.agregar(registro)
+        for eliminado in lapidas.values():
+            if eliminado is not None:
+                agregados.quitar(eliminado)
+        return agregados
+
+    # Sellado
+
+    def _sellar(self, ventana):
+        """Sellar los meses anteriores a la ventana que todavía tienen journal"""
+        if not any(mes < ventana and journal for mes, (_, journal) in self._meses().items()):
+            return
+        # Bajo el bloqueo entre procesos: un registro tardío anexado mientras se
+        # sella se perdería al borrar el journal. Los meses se vuelven a listar
+        # porque otro proceso pudo sellarlos mientras se esperaba
+        with self._exclusivo():
+            for mes, (_, journal) in self._meses().items():
+                if mes >= ventana or not journal:
+                    continue
+                registros = self.registros_mes(mes)
+                ruta = self._ruta_mes(mes, self.SELLADO)
+
+                def escribir(f):
+                    with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as comprimido:
+                        comprimido.writelines(serializar_linea(r).encode('utf-8') for r in registros)
+                escribir_atomico(ruta, escribir, modo='wb')
+                estado = os.stat(ruta)
+                agregados = construir_agregados(TablaColumnar.desde_registros(registros))
+                escribir_atomico(self._ruta_mes(mes, self.AGREGADOS), lambda f: pickle.dump(
+                    {'clave': (VERSION_AGREGADOS, estado.st_size, estado.st_mtime_ns), 'agregados': agregados}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL), modo='wb')
+                os.remove(self._ruta_mes(mes, self.ABIERTO))
+
+    def instantanea(self):
+        """Registros de la ventana activa y agregados de toda la historia"""
+        with self._cerrojo:
+            ventana = inicio_ventana()
+            if ventana != self._ventana:
+                self._sellar(ventana)
+            firma = self.firma()
+            if firma != self._firma_cache or ventana != self._ventana:
+                self.avisos = []
+                registros, agregados = [], Agregados()
+                for mes, (sellado, journal) in self._meses().items():
+                    if mes >= ventana:
+                        registros.extend(self.registros_mes(mes))
+                    else:
+                        agregados.fusionar(self._agregados_mes(mes, sellado, journal))
+                tabla = TablaColumnar.desde_registros(registros)
+                self._ventana = ventana
+                self._publicar(tabla, agregados.fusionar(construir_agregados(tabla)), firma)
+            return self._instantanea
+
+    # Escritura
+
+    def migrar(self):
+        """Repartir el journal o el JSON único en segmentos si aún no hay ninguno"""
+        with self._exclusivo():
+            if self.existe():
+                return 0
+            for origen in (AlmacenJournal(self.directorio), AlmacenJSON(self.directorio)):
+                if origen.existe():
+                    registros = [r if 'id' in r else dict(r, id=nuevo_id()) for r in origen.cargar()]
+                    self.guardar(registros)
+                    os.replace(origen.ruta, origen.ruta + '.migrado')
+                    return len(registros)
+            return 0
+
+    def iterar(self):
+        self.avisos = []
+        for mes in self._meses():
+            yield from self.registros_mes(mes)
+
+    def tabla_completa(self):
+        return TablaColumnar.desde_registros(self.iterar())
+
+    def _guardar(self, registros):
+        # Se escribe un directorio nuevo y se intercambia con el actual
+        por_mes = {}
+        for registro in registros:
+            por_mes.setdefault(mes_de(registro), []).append(registro)
+        nuevo = tempfile.mkdtemp(dir=self.directorio, prefix=self.nombre_archivo + '.')
+        try:
+            for mes, lista in por_mes.items():
+                with open(os.path.join(nuevo, mes + self.ABIERTO), 'w', encoding='utf-8') as f:
+                    f.writelines(serializar_linea(r) for r in lista)
+                    f.flush()
+                    os.fsync(f.fileno())
+            viejo = self.ruta + '.viejo'
+            shutil.rmtree(viejo, ignore_errors=True)
+            if os.path.exists(self.ruta):
+                os.replace(self.ruta, viejo)
+            os.replace(nuevo, self.ruta)
+        except Exception:
+            shutil.rmtree(nuevo, ignore_errors=True)
+            raise
+        shutil.rmtree(viejo, ignore_errors=True)
+        # Los meses fuera de la ventana se vuelven a sellar en la próxima lectura
+        self._ventana = None
+
+    @staticmethod
+    def _solo_crecio(firma_antes, firma_despues, nombre, linea):
+        """¿El único cambio es que el segmento nombre creció exactamente la línea?"""
+        antes = {f[0]: f[1:] for f in firma_antes}
+        despues = {f[0]: f[1:] for f in firma_despues}
+        previo, actual = antes.pop(nombre, None), despues.pop(nombre, None)
+        if antes != despues or actual is None:
+            return False
+        if previo is None:
+            return actual[2] == len(linea.encode('utf-8'))
+        return previo[0] == actual[0] and actual[2] - previo[2] == len(linea.encode('utf-8'))
+
+    def _anexar(self, mes, linea):
+        """Anexar al journal del mes; True si nadie más escribió desde la instantánea"""
+        firma_antes = self.firma()
+        os.makedirs(self.ruta, exist_ok=True)
+        anexar_linea(self._ruta_mes(mes, self.ABIERTO), linea)
+        return firma_antes == self._firma_cache and self._solo_crecio(
+            firma_antes, self.firma(), mes + self.ABIERTO, linea)
+
+    def agregar(self, registro):
+        with self._exclusivo():
+            mes = mes_de(registro)
+            if self._anexar(mes, serializar_linea(registro)):
+                previa = self._instantanea
+                # Un registro tardío de un mes sellado solo cambia los agregados
+                registros = previa.registros.con_registro(registro) if mes >= self._ventana else previa.registros
+                self._publicar(registros, previa.agregados.con_registro(registro))
+            return self.version
+
+    def _agregar_lote(self, registros):
+        # Una escritura por mes; la instantánea se recarga (solo la ventana) en la próxima lectura
+        por_mes = {}
+        for registro in registros:
+            por_mes.setdefault(mes_de(registro), []).append(serializar_linea(registro))
+        os.makedirs(self.ruta, exist_ok=True)
+        for mes, lineas in por_mes.items():
+            anexar_linea(self._ruta_mes(mes, self.ABIERTO), ''.join(lineas))
+
+    def _buscar(self, clave, fecha=None):
+        """(registro, mes) con ese id fuera de la ventana; con fecha solo se abre su mes"""
+        meses = [mes_de({'date': fecha})] if fecha is not None else list(reversed(self._meses()))
+        for mes in meses:
+            for registro in self.registros_mes(mes):
+                if registro.get('id') == clave:
+                    return registro, mes
+        return None, None
+
+    def _eliminar(self, clave, fecha=None):
+        tabla = self.instantanea().registros
+        fila = tabla.posicion_id(clave)
+        if fila is not None:
+            eliminado = tabla[fila]
+            mes = mes_de(eliminado)
+        else:
+            eliminado, mes = self._buscar(clave, fecha)
+            if eliminado is None:
+                return None, None
+        # La lápida lleva el registro: así los agregados del mes sellado se corrigen sin abrirlo
+        if self._anexar(mes, serializar_linea({'eliminado': clave, 'registro': eliminado})):
+            return eliminado, tabla.sin_fila(fila) if fila is not None else tabla
+        return eliminado, None
+
+    def pagina_tienda(self, tienda, desde=None, hasta=None, vendedor=None, inicio=0, cantidad=50):
+        """Dentro de la ventana usa la instantánea; si no, abre solo los meses del rango"""
+        instantanea = self.instantanea()
+        if desde is not None and desde.isoformat()[:7] >= self._ventana:
+            tabla = instantanea.registros
+        else:
+            tabla = self._tabla_rango(desde, hasta)
+        return tabla.pagina_historial(tienda, desde, hasta, vendedor, inicio, cantidad)
+
+    def _tabla_rango(self, desde, hasta):
+        meses = list(self._meses())
+        if desde is not None or hasta is not None:
+            primero = desde.isoformat()[:7] if desde is not None else ''
+            ultimo = hasta.isoformat()[:7] if hasta is not None else '9999-12'
+            meses = [m for m in meses if primero <= m <= ultimo]
+        clave = (tuple(meses), self.firma())
+        if self._consulta[0] != clave:
+            self._consulta = (clave, TablaColumnar.desde_registros(
+                r for mes in meses for r in self.registros_mes(mes)))
+        return self._consulta[1]
+
+
+class AlmacenBinario(AlmacenJournal):
+    """Archivo base en formato binario compacto más un delta JSON Lines.
+
+    Las escrituras anexan al delta igual que el journal (registros y
+    lápidas). Al arrancar se carga el archivo base con formato_binario, sin
+    decodificar JSON, y se reproduce solo el delta. Cuando el delta pasa de
+    MAXIMO_DELTA se vuelca al base en segundo plano.
+
+    El base y el delta llevan un número de generación: si el proceso se cae
+    entre escribir el base nuevo y vaciar el delta, el delta viejo (ya
+    incluido en el base) se reconoce por su generación y se ignora.
+    """
+    nombre = 'binario'
+    nombre_archivo = 'registros_clientes_viale.delta.jsonl'
+    nombre_base = 'registros_clientes_viale' + formato_binario.EXTENSION
+
+    def __init__(self, directorio=None):
+        super().__init__(directorio)
+        self.ruta_base = os.path.join(self.directorio, self.nombre_base)
+
+    def existe(self):
+        return os.path.exists(self.ruta_base) or os.path.exists(self.ruta)
+
+    def archivos_datos(self):
+        # El delta va primero: _crecio_solo y _solo_anexado miran el primer archivo
+        return [self.ruta, self.ruta_base]
+
+    def migrar(self):
+        """Convertir el journal o el JSON único al formato binario (una sola vez)"""
+        with self._exclusivo():
+            if self.existe():
+                return 0
+            for origen in (AlmacenJournal(self.directorio), AlmacenJSON(self.directorio)):
+                if origen.existe():
+                    registros = origen.cargar()
+                    self.guardar(registros)
+                    os.replace(origen.ruta, origen.ruta + '.migrado')
+                    return len(registros)
+            return 0
+
+    def _cargar_base(self):
+        """(tabla, generación) del archivo base; vacío si aún no existe"""
+        try:
+            tabla, metadatos = formato_binario.cargar(self.ruta_base)
+        except FileNotFoundError:
+            return TablaColumnar(), 0
+        return tabla, metadatos.get('generacion', 0)
+
+    def _lineas_delta(self, generacion, hasta=None):
+        """Líneas del delta que corresponden al archivo base de esa generación
+        (con hasta, solo las de los primeros hasta bytes)"""
+        try:
+            lineas = [linea.rstrip('\n') for linea in self._lineas(hasta)]
+        except FileNotFoundError:
+            return []
+        if lineas and lineas[0].startswith(PREFIJO_GENERACION):
+            try:
+                propia = json.loads(lineas[0])['generacion']
+            except (json.JSONDecodeError, KeyError, TypeError):
+                propia = None
+            if propia != generacion:
+                # Delta de un base anterior: ya está volcado en el base actual
+                return []
+        return lineas
+
+    def _leer_tabla(self, firma=None):
+        self.avisos = []
+        self.lapidas = 0
+        tabla, generacion = self._cargar_base()
+        tabla, _ = self._reproducir(tabla, None, self._lineas_delta(generacion, self._tamano_journal(firma)))
+        return tabla
+
+    def iterar(self):
+        return iter(self._leer_tabla())
+
+    def _guardar(self, registros):
+        if not isinstance(registros, TablaColumnar):
+            registros = TablaColumnar.desde_registros(registros)
+        # Solo se llega con el bloqueo tomado (guardar, compactar): dos procesos
+        # no pueden escribir la misma generación
+        generacion = self._generacion_base() + 1
+        formato_binario.guardar(self.ruta_base, registros, {'generacion': generacion})
+        escribir_atomico(self.ruta, lambda f: f.write(serializar_linea({'generacion': generacion})))
+        self.lapidas = 0
+
+    def _generacion_base(self):
+        try:
+            with open(self.ruta_base, 'rb') as f:
+                return formato_binario.leer_encabezado(f)['metadatos'].get('generacion', 0)
+        except FileNotFoundError:
+            return 0
+
+    def _agregar(self, registro):
+        super()._agregar(registro)
+        self._programar_compactacion(0)
+
+    def _agregar_lote(self, registros):
+        bloque = super()._agregar_lote(registros)
+        self._programar_compactacion(0)
+        return bloque
+
+    def _programar_compactacion(self, vivos):
+        if not self._compactando and self._tamano_delta() > MAXIMO_DELTA:
+            self._compactando = True
+            threading.Thread(target=self._compactar_en_segundo_plano, name='compactar-binario', daemon=True).start()
+        else:
+            super()._programar_compactacion(vivos)
+
+    def _tamano_delta(self):
+        try:
+            return os.path.getsize(self.ruta)
+        except FileNotFoundError:
+            return 0
+
+    def compactar(self):
+        """Volcar el delta al archivo base; devuelve cuántas lápidas quitó"""
+        # Bajo el bloqueo entre procesos, igual que el journal: el delta leído es el último
+        with self._exclusivo():
+            registros = self.instantanea().registros
+            lapidas = self.lapidas
+            self._guardar(registros)
+            self._firma_cache = self.firma()
+            self._programar_instantanea()
+            return lapidas
+
+
+def tamano_profundo(objeto, vistos=None):
+    """Bytes ocupados por un objeto y todo lo que contiene (cada objeto se cuenta una vez)"""
+    vistos = set() if vistos is None else vistos
+    if id(objeto) in vistos:
+        return 0
+    vistos.add(id(objeto))
+    tamano = sys.getsizeof(objeto)
+    if isinstance(objeto, dict):
+        tamano += sum(tamano_profundo(k, vistos) + tamano_profundo(v, vistos) for k, v in objeto.items())
+    elif isinstance(objeto, (list, tuple, set)):
+        tamano += sum(tamano_profundo(v, vistos) for v in objeto)
+    elif hasattr(objeto, '__dict__'):
+        tamano += tamano_profundo(vars(objeto), vistos)
+    return tamano
+
+
+def estimar_memoria(instantanea, muestra=2000):
+    """Bytes de la tabla columnar, de los mismos registros como lista de dicts
+    (estimado con una muestra) y de los agregados"""
+    registros = instantanea.registros
+    paso = max(1, len(registros) // muestra)
+    elegidos = registros[::paso]
+    por_registro = sum(tamano_profundo(r) for r in elegidos) / len(elegidos) if elegidos else 0
+    return {
+        'registros': registros.memoria_bytes(),
+        'registros_como_dicts': 8 * len(registros) + int(por_registro * len(registros)),
+        'agregados': tamano_profundo(instantanea.agregados),
+    }
+
+
+BACKENDS = {
+    'json': AlmacenJSON,
+    'jsonl': AlmacenJournal,
+    'sqlite': AlmacenSQLite,
+    'segmentos': AlmacenSegmentos,
+    'binario': AlmacenBinario,
+}
+
+
+def crear_almacen(backend=None, directorio=None):
+    """Crear el almacén configurado (VIALE_ALMACENAMIENTO) o el indicado"""
+    backend = (backend or BACKEND_POR_DEFECTO).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
+    return BACKENDS[backend](directorio)
@@ -1,10 +1,26 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, date
+import altair as alt
+from datetime import datetime, date, timedelta
+import hashlib
 import io
 import os
-import json
 import tempfile
+import time
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import almacenamiento
+import catalogo
+import clasificacion
+import cola_escritura
+import exportacion
+import importacion
+import metricas
+import refresco
+import reportes_tienda
+from agregados import Agregados, REGISTROS, CLIENTES
+from columnar import TablaColumnar
+from modelo import RANGOS_HORARIO, nuevo_id
 
 # Configurar la página
 st.set_page_config(
@@ -17,62 +33,87 @@ st.set_page_config(
 st.title("🏪 REGISTRO DE CLIENTES ATENDIDOS")
 st.markdown("---")
 
-# Lista de rangos de horario
-RANGOS_HORARIO = [
-    "10 a.m - 11 a.m",
-    "11 a.m - 12 p.m", 
-    "12 p.m - 1 p.m",
-    "1 p.m - 2 p.m",
-    "2 p.m - 3 p.m",
-    "3 p.m - 4 p.m",
-    "4 p.m - 5 p.m",
-    "5 p.m - 6 p.m",
-    "6 p.m - 7 p.m",
-    "7 p.m - 8 p.m",
-    "8 p.m - 9 p.m",
-    "9 p.m - 10 p.m"
-]
+# ALMACENAMIENTO: backend elegido con VIALE_ALMACENAMIENTO (ver almacenamiento.BACKENDS)
+@st.cache_resource
+def obtener_almacen():
+    """Almacén compartido por todas las sesiones del proceso"""
+    return almacenamiento.crear_almacen()
+
+ALMACEN = obtener_almacen()
+
+@st.cache_resource
+def obtener_cola_escritura():
+    """Escritor único con commit agrupado para todas las sesiones"""
+    return cola_escritura.ColaEscritura(ALMACEN)
+
+COLA_ESCRITURA = obtener_cola_escritura()
 
 # RUTA PERSISTENTE MEJORADA
 def obtener_ruta_archivo():
-    """Obtener ruta de archivo persistente - MEJORADA"""
-    # Usar directorio de trabajo actual
-    directorio_datos = "./datos_persistentes"
-    if not os.path.exists(directorio_datos):
-        os.makedirs(directorio_datos, exist_ok=True)
-    return os.path.join(directorio_datos, 'registros_clientes_viale.json')
+    """Obtener ruta de archivo persistente del backend configurado"""
+    return ALMACEN.ruta
 
 def guardar_registros(registros):
-    """Guardar registros permanentemente - MEJORADA"""
+    """Guardar registros permanentemente (reescritura completa y atómica)"""
     try:
-        ruta_archivo = obtener_ruta_archivo()
-        # Guardar con formato seguro
-        with open(ruta_archivo, 'w', encoding='utf-8') as f:
-            json.dump(registros, f, ensure_ascii=False, indent=2, default=str)
+        with metricas.tramo('guardar_registros') as tramo:
+            tramo['registros'] = len(registros)
+            ALMACEN.guardar(registros)
+        REFRESCADOR.comprobar()
         return True
     except Exception as e:
         st.error(f"❌ Error crítico al guardar datos: {str(e)}")
         return False
 
-def cargar_registros():
-    """Cargar registros guardados - MEJORADA con manejo robusto"""
+def cargar_instantanea():
+    """Instantánea compartida por el proceso; el archivo solo se lee si cambió"""
+    with metricas.tramo('cargar_registros') as tramo:
+        instantanea = _cargar_instantanea()
+        tramo['registros'] = len(instantanea.registros)
+    return instantanea
+
+def _cargar_instantanea():
     try:
-        ruta_archivo = obtener_ruta_archivo()
-        if os.path.exists(ruta_archivo):
-            with open(ruta_archivo, 'r', encoding='utf-8') as f:
-                registros = json.load(f)
-                if isinstance(registros, list):
-                    st.sidebar.success(f"💾 {len(registros)} registros cargados desde archivo")
-                    return registros
-                else:
-                    st.warning("⚠️ Formato de archivo inválido, iniciando con lista vacía")
-                    return []
+        migrados = ALMACEN.migrar()
+        if migrados:
+            st.sidebar.info(f"🔁 {migrados} registros migrados a {ALMACEN.nombre}")
+        if ALMACEN.existe():
+            asignados = ALMACEN.asignar_ids()
+            if asignados:
+                st.sidebar.info(f"🔑 {asignados} registros antiguos recibieron un id estable")
+        if ALMACEN.existe():
+            instantanea = ALMACEN.instantanea()
+            for aviso in ALMACEN.avisos:
+                st.warning(f"⚠️ {aviso}")
+            st.sidebar.success(f"💾 {instantanea.agregados.total[REGISTROS]} registros cargados desde {ALMACEN.nombre}")
+            return instantanea
         else:
             st.sidebar.info("📝 No se encontró archivo previo, iniciando nuevo registro")
-            return []
+            return almacenamiento.Instantanea(None, TablaColumnar(), Agregados())
     except Exception as e:
         st.error(f"❌ Error al cargar archivo: {str(e)}")
-        return []
+        return almacenamiento.Instantanea(None, TablaColumnar(), Agregados())
+
+# HISTORIAL: días que se muestran por defecto y tamaños de página
+DIAS_HISTORIAL = 30
+REGISTROS_POR_PAGINA = [25, 50, 100]
+
+def cargar_pagina_historial(datos, tienda, desde, hasta, vendedor, inicio, cantidad):
+    """(total, [(clave, registro)]) de la página visible; SQLite consulta solo esas filas"""
+    if ALMACEN.consulta_por_tienda:
+        try:
+            return ALMACEN.pagina_tienda(tienda, desde, hasta, vendedor, inicio, cantidad)
+        except Exception as e:
+            st.error(f"❌ Error al consultar registros: {str(e)}")
+            return 0, []
+    # Filtrado vectorizado sobre las columnas de tienda, fecha y vendedor
+    return datos.registros.pagina_historial(tienda, desde, hasta, vendedor, inicio, cantidad)
+
+def formatear_fecha(valor):
+    """dd/mm/aaaa a partir de la fecha ISO guardada, sin pasar por pandas"""
+    if isinstance(valor, str) and len(valor) == 10 and valor[4] == '-' and valor[7] == '-':
+        return f"{valor[8:]}/{valor[5:7]}/{valor[:4]}"
+    return str(valor)
 
 # FUNCIONES AUXILIARES
 def calcular_porcentaje(tickets, clientes):
@@ -83,89 +124,125 @@ def calcular_porcentaje(tickets, clientes):
     except:
         return 0
 
-def obtener_valor_seguro(record, campo, default=0):
-    return record.get(campo, default)
-
 # INICIALIZACIÓN ROBUSTA - SIEMPRE CARGAR DESDE ARCHIVO
 def inicializar_datos():
-    """Inicializar datos siempre desde archivo - SOLUCIÓN DEFINITIVA"""
-    registros = cargar_registros()
-    
-    # Verificar si session_state necesita actualización
-    if 'records' not in st.session_state or st.session_state.records != registros:
-        st.session_state.records = registros
-    
-    return registros
+    """Tomar la instantánea compartida; la sesión solo guarda su versión"""
+    instantanea = cargar_instantanea()
+    st.session_state.version_registros = instantanea.version
+    return instantanea
+
+# Inicializar la aplicación: DATOS es compartido por todas las sesiones y no se modifica
+DATOS = inicializar_datos()
+
+# REFRESCO EN SEGUNDO PLANO: un hilo por servidor vigila el almacén y actualiza la instantánea
+@st.cache_resource
+def obtener_refrescador():
+    """Refrescador compartido por todas las sesiones del proceso"""
+    return refresco.Refrescador(ALMACEN).iniciar()
+
+REFRESCADOR = obtener_refrescador()
 
-# Inicializar la aplicación
-registros_iniciales = inicializar_datos()
+def instantanea_vigente():
+    """Instantánea actual para un fragmento que se re-ejecuta solo; la mantiene al día
+    el refrescador, así que leerla no toca el disco"""
+    try:
+        return REFRESCADOR.instantanea()
+    except Exception:
+        return DATOS
+
+# Sesiones vistas recientemente (para el reporte de memoria)
+@st.cache_resource
+def obtener_sesiones_activas():
+    return {}
+
+contexto_sesion = get_script_run_ctx()
+if contexto_sesion is not None:
+    obtener_sesiones_activas()[contexto_sesion.session_id] = time.time()
 
 # Función para ACTUALIZAR desde archivo
 def actualizar_desde_archivo():
-    """Forzar actualización desde archivo - MEJORADA"""
-    registros_actuales = cargar_registros()
-    st.session_state.records = registros_actuales
-    st.success(f"✅ Sincronizado: {len(registros_actuales)} registros")
-    return registros_actuales
+    """Forzar actualización desde archivo: el refrescador ya hizo el trabajo, solo se comprueba la firma"""
+    instantanea = REFRESCADOR.comprobar()
+    st.session_state.version_registros = instantanea.version
+    st.success(f"✅ Sincronizado: {len(instantanea.registros)} registros")
+    return instantanea.registros
 
 # Inicializar estados de sesión para los modales
 if 'mostrar_modal_descarga' not in st.session_state:
     st.session_state.mostrar_modal_descarga = False
 if 'mostrar_modal_reinicio' not in st.session_state:
     st.session_state.mostrar_modal_reinicio = False
+if 'mostrar_modal_reportes' not in st.session_state:
+    st.session_state.mostrar_modal_reportes = False
+
+# CATÁLOGO DE TIENDAS: índice tienda → vendedores compartido por todas las sesiones
+@st.cache_resource
+def obtener_vigia_catalogo():
+    """Vigía del Excel de asesores; recarga el catálogo solo cuando cambia el archivo"""
+    return catalogo.VigiaCatalogo()
 
 # Función para limpiar cache
 def limpiar_cache_tiendas():
-    if 'cargar_datos_tiendas' in st.session_state:
-        del st.session_state['cargar_datos_tiendas']
-    st.cache_data.clear()
+    # Solo se invalida el catálogo; el resto de cachés de la app se conserva
+    obtener_vigia_catalogo().invalidar()
     st.success("✅ Cache limpiado")
 
 # Cargar datos de tiendas y vendedores
-@st.cache_data(ttl=300)
 def cargar_datos_tiendas():
-    """Cargar datos de tiendas y vendedores"""
+    """Cargar el catálogo de tiendas y vendedores"""
     try:
-        df = pd.read_excel("Asesores.xlsx")
-        return df
+        with metricas.tramo('cargar_datos_tiendas') as tramo:
+            catalogo_tiendas = obtener_vigia_catalogo().obtener()
+            tramo['registros'] = len(catalogo_tiendas.df)
+        return catalogo_tiendas
     except Exception as e:
         st.error(f"❌ Error al cargar Excel: {str(e)}")
         datos_ejemplo = {
             'Tienda': ['AL705', 'AL705', 'AL418', 'AL418'],
             'Vendedor': ['Vendedor A', 'Vendedor B', 'KAELIN DÍAZ', 'JAVIER VLAVERDE']
         }
-        return pd.DataFrame(datos_ejemplo)
+        return catalogo.Catalogo(pd.DataFrame(datos_ejemplo))
 
 # Cargar datos de tiendas
-df_tiendas = cargar_datos_tiendas()
+CATALOGO = cargar_datos_tiendas()
+df_tiendas = CATALOGO.df
 
 # Mostrar información del archivo cargado
-if 'Tienda' in df_tiendas.columns and 'Vendedor' in df_tiendas.columns:
+if CATALOGO.valido:
     st.sidebar.success(f"✅ {len(df_tiendas)} registros de tiendas cargados")
     
     with st.expander("📊 RESUMEN DE DATOS CARGADOS", expanded=False):
-        st.write(f"**Tiendas únicas en Excel:** {len(df_tiendas['Tienda'].unique())}")
-        st.write(f"**Vendedores únicos:** {len(df_tiendas['Vendedor'].unique())}")
+        st.write(f"**Tiendas únicas en Excel:** {len(CATALOGO.tiendas)}")
+        st.write(f"**Vendedores únicos:** {CATALOGO.total_vendedores}")
         
         st.write("**Todas las tiendas en Excel:**")
-        for tienda in sorted(df_tiendas['Tienda'].unique()):
-            vendedores = df_tiendas[df_tiendas['Tienda'] == tienda]['Vendedor'].unique()
-            st.write(f"- **{tienda}**: {len(vendedores)} vendedores")
+        st.write("\n".join(f"- **{tienda}**: {len(CATALOGO.por_tienda[tienda])} vendedores" for tienda in CATALOGO.tiendas))
 
 # Funciones básicas
 def obtener_tiendas():
-    if 'Tienda' in df_tiendas.columns:
-        return sorted(df_tiendas['Tienda'].unique().tolist())
-    return []
+    return CATALOGO.tiendas
 
 def obtener_vendedores_por_tienda(tienda_seleccionada):
-    if 'Tienda' in df_tiendas.columns and 'Vendedor' in df_tiendas.columns:
+    if CATALOGO.valido:
         if tienda_seleccionada:
-            vendedores = df_tiendas[df_tiendas['Tienda'] == tienda_seleccionada]['Vendedor'].unique().tolist()
+            vendedores = CATALOGO.vendedores(tienda_seleccionada)
             return vendedores if vendedores else ["No hay vendedores"]
         return ["Selecciona tienda"]
     return ["Error"]
 
+# FRAGMENTOS: cada panel se re-ejecuta solo. Tras guardar o eliminar se re-ejecutan
+# únicamente los que muestran registros, no el catálogo, la importación ni el resto
+PANELES_DATOS = ["estado_almacen", "historial", "estadisticas", "clasificacion", "exportacion"]
+
+def avisar(clave, tipo, mensaje):
+    """Mensaje para el fragmento que lo muestra (los callbacks no escriben en la página)"""
+    st.session_state[clave] = (tipo, mensaje)
+
+def mostrar_aviso(clave):
+    aviso = st.session_state.pop(clave, None)
+    if aviso:
+        getattr(st, aviso[0])(aviso[1])
+
 # FUNCIÓN CRÍTICA MEJORADA: Guardar permanentemente
 def add_record(tienda, vendedor, rango_horario, date_str, count, tickets, soles):
     """Guardar registro - SOLUCIÓN PERSISTENTE MEJORADA"""
@@ -177,45 +254,45 @@ def add_record(tienda, vendedor, rango_horario, date_str, count, tickets, soles)
         'count': count,
         'tickets': tickets,
         'soles': soles,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        # Id estable: eliminar no depende de posiciones que cambian al anexar otras tablets
+        'id': nuevo_id()
     }
     
-    # SIEMPRE cargar desde archivo primero para evitar conflictos
-    registros_actuales = cargar_registros()
-    registros_actuales.append(record)
+    # Las tablets que guardan a la vez comparten una sola escritura (un fsync por lote);
+    # la llamada vuelve cuando el lote ya está en disco
+    try:
+        COLA_ESCRITURA.agregar(record)
+        # Si el backend no parchó la instantánea, se relee ya y no en el próximo ciclo del refrescador
+        REFRESCADOR.comprobar()
+        guardado = True
+    except Exception as e:
+        avisar('aviso_formulario', 'error', f"❌ Error crítico al guardar datos: {str(e)}")
+        guardado = False
     
-    # Guardar en archivo inmediatamente
-    if guardar_registros(registros_actuales):
-        # Actualizar session_state solo después de guardar exitosamente
-        st.session_state.records = registros_actuales
-        st.success(f"✅ Guardado permanentemente: {tienda} - {vendedor} - {rango_horario}")
+    if guardado:
+        avisar('aviso_formulario', 'success', f"✅ Guardado permanentemente: {tienda} - {vendedor} - {rango_horario}")
         return True
     else:
-        st.error("❌ Error crítico: No se pudo guardar el registro")
+        avisar('aviso_formulario', 'error', "❌ Error crítico: No se pudo guardar el registro")
         return False
 
 # FUNCIÓN CRÍTICA MEJORADA: Eliminar permanentemente
-def delete_record(index):
-    """Eliminar registro - SOLUCIÓN PERSISTENTE MEJORADA"""
-    # SIEMPRE cargar desde archivo primero
-    registros_actuales = cargar_registros()
+def delete_record(clave, fecha=None):
+    """Eliminar registro por su id estable (en modo journal solo anexa una lápida)"""
+    try:
+        deleted = ALMACEN.eliminar(clave, fecha)
+        REFRESCADOR.comprobar()
+    except Exception as e:
+        avisar('aviso_historial', 'error', f"❌ Error crítico: No se pudo eliminar el registro ({str(e)})")
+        return False
     
-    if 0 <= index < len(registros_actuales):
-        deleted = registros_actuales.pop(index)
-        
-        # Guardar en archivo inmediatamente
-        if guardar_registros(registros_actuales):
-            # Actualizar session_state solo después de guardar exitosamente
-            st.session_state.records = registros_actuales
-            st.success(f"🗑️ Eliminado permanentemente: {deleted.get('seller', 'N/A')}")
-            return True
-        else:
-            st.error("❌ Error crítico: No se pudo eliminar el registro")
-            return False
+    if deleted is not None:
+        avisar('aviso_historial', 'success', f"🗑️ Eliminado permanentemente: {deleted.get('seller', 'N/A')}")
+        return True
     return False
 
-def formatear_registro_para_mostrar(index):
-    record = st.session_state.records[index]
+def formatear_registro_para_mostrar(record):
     if 'tienda' in record:
         tickets = record.get('tickets', 'N/A')
         soles = record.get('soles', 'N/A')
@@ -224,213 +301,104 @@ def formatear_registro_para_mostrar(index):
     else:
         return f"{record['seller']} - {record['date']} - {record['count']} clientes (registro antiguo)"
 
-# FUNCIONES DE ESTADÍSTICAS MEJORADAS
-def get_stats_por_tienda(tienda_seleccionada):
-    """Obtener estadísticas solo para la tienda seleccionada"""
-    if not st.session_state.records:
-        return {
-            'total_clients': 0,
-            'total_records': 0,
-            'total_tickets': 0,
-            'total_soles': 0,
-            'top_seller': {'name': 'N/A', 'count': 0},
-            'avg_per_day': 0,
-            'avg_tickets_per_day': 0,
-            'avg_soles_per_day': 0,
-            'porcentaje_general': 0,
-            'ticket_promedio': 0,
-            'mejor_dia': {'fecha': 'N/A', 'clientes': 0},
-            'horario_pico': {'horario': 'N/A', 'clientes': 0}
-        }
-    
-    # Filtrar registros por tienda
-    registros_tienda = [r for r in st.session_state.records if r.get('tienda') == tienda_seleccionada]
-    
-    if not registros_tienda:
-        return {
-            'total_clients': 0,
-            'total_records': 0,
-            'total_tickets': 0,
-            'total_soles': 0,
-            'top_seller': {'name': 'N/A', 'count': 0},
-            'avg_per_day': 0,
-            'avg_tickets_per_day': 0,
-            'avg_soles_per_day': 0,
-            'porcentaje_general': 0,
-            'ticket_promedio': 0,
-            'mejor_dia': {'fecha': 'N/A', 'clientes': 0},
-            'horario_pico': {'horario': 'N/A', 'clientes': 0}
-        }
-    
-    total_clients = 0
-    total_tickets = 0
-    total_soles = 0
-    
-    # Estadísticas por día y horario
-    dias_stats = {}
-    horarios_stats = {}
-    
-    for record in registros_tienda:
-        total_clients += obtener_valor_seguro(record, 'count', 0)
-        total_tickets += obtener_valor_seguro(record, 'tickets', 0)
-        total_soles += obtener_valor_seguro(record, 'soles', 0)
-        
-        # Estadísticas por fecha
-        fecha = record.get('date', '')
-        if fecha in dias_stats:
-            dias_stats[fecha] += obtener_valor_seguro(record, 'count', 0)
-        else:
-            dias_stats[fecha] = obtener_valor_seguro(record, 'count', 0)
-        
-        # Estadísticas por horario
-        horario = record.get('rango_horario', '')
-        if horario in horarios_stats:
-            horarios_stats[horario] += obtener_valor_seguro(record, 'count', 0)
-        else:
-            horarios_stats[horario] = obtener_valor_seguro(record, 'count', 0)
-    
-    total_records = len(registros_tienda)
-    
-    # Calcular top seller
-    seller_stats = {}
-    for record in registros_tienda:
-        seller = record.get('seller', 'Desconocido')
-        count = obtener_valor_seguro(record, 'count', 0)
-        if seller in seller_stats:
-            seller_stats[seller] += count
-        else:
-            seller_stats[seller] = count
-    
-    top_seller = 'N/A'
-    top_seller_count = 0
-    if seller_stats:
-        top_seller = max(seller_stats, key=seller_stats.get)
-        top_seller_count = seller_stats[top_seller]
-    
-    # Calcular promedios
-    avg_per_day = total_clients / total_records if total_records > 0 else 0
-    avg_tickets_per_day = total_tickets / total_records if total_records > 0 else 0
-    avg_soles_per_day = total_soles / total_records if total_records > 0 else 0
-    
-    # Calcular porcentaje general
-    porcentaje_general = calcular_porcentaje(total_tickets, total_clients)
-    
-    # Calcular ticket promedio
-    ticket_promedio = total_soles / total_tickets if total_tickets > 0 else 0
-    
-    # Mejor día
-    mejor_dia = 'N/A'
-    mejor_dia_count = 0
-    if dias_stats:
-        mejor_dia = max(dias_stats, key=dias_stats.get)
-        mejor_dia_count = dias_stats[mejor_dia]
-    
-    # Horario pico
-    horario_pico = 'N/A'
-    horario_pico_count = 0
-    if horarios_stats:
-        horario_pico = max(horarios_stats, key=horarios_stats.get)
-        horario_pico_count = horarios_stats[horario_pico]
-    
-    return {
-        'total_clients': total_clients,
-        'total_records': total_records,
-        'total_tickets': total_tickets,
-        'total_soles': total_soles,
-        'top_seller': {'name': top_seller, 'count': top_seller_count},
-        'avg_per_day': round(avg_per_day, 1),
-        'avg_tickets_per_day': round(avg_tickets_per_day, 1),
-        'avg_soles_per_day': round(avg_soles_per_day, 1),
-        'porcentaje_general': porcentaje_general,
-        'ticket_promedio': round(ticket_promedio, 1),
-        'mejor_dia': {'fecha': mejor_dia, 'clientes': mejor_dia_count},
-        'horario_pico': {'horario': horario_pico, 'clientes': horario_pico_count}
-    }
-
-def get_stats_general():
+# FUNCIONES DE ESTADÍSTICAS MEJORADAS (leen los agregados incrementales)
+def get_stats_por_tienda(datos, tienda_seleccionada, desde=None, hasta=None):
+    """Obtener estadísticas solo para la tienda seleccionada (en el periodo, si se indica)"""
+    with metricas.tramo('get_stats_por_tienda') as tramo:
+        stats = datos.agregados.stats_tienda(tienda_seleccionada, desde, hasta)
+        tramo['registros'] = stats['total_records']
+    return stats
+
+# Periodos del panel de estadísticas: días hacia atrás desde hoy (None = todo el historial)
+PERIODOS_ESTADISTICAS = {
+    "Todo el historial": None,
+    "Últimos 7 días": 7,
+    "Últimos 30 días": 30,
+    "Últimos 90 días": 90,
+    "Últimos 365 días": 365,
+}
+DIAS_SEMANA = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+def rango_periodo(periodo):
+    """(desde, hasta) del periodo elegido; (None, None) para todo el historial"""
+    dias = PERIODOS_ESTADISTICAS[periodo]
+    if dias is None:
+        return None, None
+    hoy = date.today()
+    return hoy - timedelta(days=dias - 1), hoy
+
+def grafico_mapa_calor(matriz):
+    """Mapa de calor día de la semana × rango horario a partir de la matriz del rollup"""
+    celdas = pd.DataFrame(
+        [(dia, rango, int(matriz[i][j])) for i, dia in enumerate(DIAS_SEMANA) for j, rango in enumerate(RANGOS_HORARIO)],
+        columns=['Día', 'Horario', 'Clientes']
+    )
+    return alt.Chart(celdas).mark_rect().encode(
+        x=alt.X('Horario:N', sort=RANGOS_HORARIO, title=None),
+        y=alt.Y('Día:N', sort=DIAS_SEMANA, title=None),
+        color=alt.Color('Clientes:Q', scale=alt.Scale(scheme='oranges')),
+        tooltip=['Día', 'Horario', 'Clientes'],
+    )
+
+def get_stats_general(datos):
     """Obtener estadísticas de todas las tiendas"""
-    if not st.session_state.records:
-        return {
-            'total_clients': 0,
-            'total_records': 0,
-            'total_tickets': 0,
-            'total_soles': 0,
-            'top_seller': {'name': 'N/A', 'count': 0},
-            'top_tienda': {'name': 'N/A', 'count': 0},
-            'avg_per_day': 0,
-            'avg_tickets_per_day': 0,
-            'avg_soles_per_day': 0,
-            'porcentaje_general': 0,
-            'ticket_promedio': 0
-        }
-    
-    total_clients = 0
-    total_tickets = 0
-    total_soles = 0
-    
-    for record in st.session_state.records:
-        total_clients += obtener_valor_seguro(record, 'count', 0)
-        total_tickets += obtener_valor_seguro(record, 'tickets', 0)
-        total_soles += obtener_valor_seguro(record, 'soles', 0)
-    
-    total_records = len(st.session_state.records)
-    
-    # Calcular top seller
-    seller_stats = {}
-    for record in st.session_state.records:
-        seller = record.get('seller', 'Desconocido')
-        count = obtener_valor_seguro(record, 'count', 0)
-        if seller in seller_stats:
-            seller_stats[seller] += count
-        else:
-            seller_stats[seller] = count
-    
-    top_seller = 'N/A'
-    top_seller_count = 0
-    if seller_stats:
-        top_seller = max(seller_stats, key=seller_stats.get)
-        top_seller_count = seller_stats[top_seller]
-    
-    # Calcular top tienda
-    tienda_stats = {}
-    for record in st.session_state.records:
-        tienda = record.get('tienda', 'Desconocido')
-        count = obtener_valor_seguro(record, 'count', 0)
-        if tienda in tienda_stats:
-            tienda_stats[tienda] += count
-        else:
-            tienda_stats[tienda] = count
-    
-    top_tienda_name = 'N/A'
-    top_tienda_count = 0
-    if tienda_stats:
-        top_tienda_name = max(tienda_stats, key=tienda_stats.get)
-        top_tienda_count = tienda_stats[top_tienda_name]
-    
-    # Calcular promedios
-    avg_per_day = total_clients / total_records if total_records > 0 else 0
-    avg_tickets_per_day = total_tickets / total_records if total_records > 0 else 0
-    avg_soles_per_day = total_soles / total_records if total_records > 0 else 0
-    
-    # Calcular porcentaje general
-    porcentaje_general = calcular_porcentaje(total_tickets, total_clients)
-    
-    # Calcular ticket promedio
-    ticket_promedio = total_soles / total_tickets if total_tickets > 0 else 0
+    with metricas.tramo('get_stats_general') as tramo:
+        stats = datos.agregados.stats_general()
+        tramo['registros'] = stats['total_records']
+    return stats
+
+# Formulario del sidebar: elegir vendedor, horario o cantidades solo re-ejecuta este fragmento
+def guardar_desde_formulario(tienda_seleccionada):
+    """Callback de "Guardar Registro": lee el formulario de session_state"""
+    vendedor_seleccionado = st.session_state.vendedor_selector
+    if vendedor_seleccionado in ["No hay vendedores", "Selecciona tienda", "Error"]:
+        avisar('aviso_formulario', 'error', "❌ Selecciona un vendedor válido")
+        return
+    if add_record(tienda_seleccionada, vendedor_seleccionado, st.session_state.rango_selector,
+                  st.session_state.fecha_registro.isoformat(), st.session_state.clientes_registro,
+                  st.session_state.tickets_registro, st.session_state.soles_registro):
+        # Hay una versión nueva de los datos: se refrescan el formulario y los paneles que la muestran
+        st.rerun(["formulario_registro"] + PANELES_DATOS)
+
+@st.fragment(key="formulario_registro")
+def formulario_registro(tienda_seleccionada):
+    vendedores = obtener_vendedores_por_tienda(tienda_seleccionada)
+    
+    if vendedores and vendedores[0] not in ["No hay vendedores", "Selecciona tienda", "Error"]:
+        st.info(f"👤 Vendedores de {tienda_seleccionada}: {len(vendedores)} disponibles")
+    
+    st.selectbox(
+        "👤 Selecciona el Vendedor:",
+        options=vendedores,
+        key="vendedor_selector"
+    )
+    
+    st.selectbox(
+        "⏰ Rango horario:",
+        options=RANGOS_HORARIO,
+        key="rango_selector"
+    )
+    
+    st.date_input("📅 Fecha:", value=date.today(), key="fecha_registro")
+    st.number_input("✅ Clientes:", min_value=1, value=1, key="clientes_registro")
+    st.number_input("🎫 Tickets:", min_value=0, value=0, key="tickets_registro")
+    st.number_input("💰 Soles (S/.):", min_value=0.0, value=0.0, step=0.1, format="%.2f", key="soles_registro")
+    
+    st.button("💾 Guardar Registro", type="primary", use_container_width=True,
+              on_click=guardar_desde_formulario, args=(tienda_seleccionada,))
+    mostrar_aviso('aviso_formulario')
+
+@st.fragment(key="estado_almacen")
+def estado_almacen():
+    # Información de estado
+    st.info(f"**Registros en memoria:** {len(instantanea_vigente().registros)}")
     
-    return {
-        'total_clients': total_clients,
-        'total_records': total_records,
-        'total_tickets': total_tickets,
-        'total_soles': total_soles,
-        'top_seller': {'name': top_seller, 'count': top_seller_count},
-        'top_tienda': {'name': top_tienda_name, 'count': top_tienda_count},
-        'avg_per_day': round(avg_per_day, 1),
-        'avg_tickets_per_day': round(avg_tickets_per_day, 1),
-        'avg_soles_per_day': round(avg_soles_per_day, 1),
-        'porcentaje_general': porcentaje_general,
-        'ticket_promedio': round(ticket_promedio, 1)
-    }
+    # Información del archivo
+    ruta_archivo = obtener_ruta_archivo()
+    if os.path.exists(ruta_archivo):
+        st.success("💾 Archivo de datos: PRESENTE")
+    else:
+        st.warning("📝 Archivo de datos: Por crear")
 
 # Sidebar para nuevo registro
 with st.sidebar:
@@ -445,34 +413,7 @@ with st.sidebar:
             key="tienda_selector"
         )
         
-        vendedores = obtener_vendedores_por_tienda(tienda_seleccionada)
-        
-        if vendedores and vendedores[0] not in ["No hay vendedores", "Selecciona tienda", "Error"]:
-            st.info(f"👤 Vendedores de {tienda_seleccionada}: {len(vendedores)} disponibles")
-        
-        vendedor_seleccionado = st.selectbox(
-            "👤 Selecciona el Vendedor:",
-            options=vendedores,
-            key="vendedor_selector"
-        )
-        
-        rango_horario = st.selectbox(
-            "⏰ Rango horario:",
-            options=RANGOS_HORARIO,
-            key="rango_selector"
-        )
-        
-        fecha = st.date_input("📅 Fecha:", value=date.today())
-        count = st.number_input("✅ Clientes:", min_value=1, value=1)
-        tickets = st.number_input("🎫 Tickets:", min_value=0, value=0)
-        soles = st.number_input("💰 Soles (S/.):", min_value=0.0, value=0.0, step=0.1, format="%.2f")
-        
-        if st.button("💾 Guardar Registro", type="primary", use_container_width=True):
-            if vendedor_seleccionado not in ["No hay vendedores", "Selecciona tienda", "Error"]:
-                if add_record(tienda_seleccionada, vendedor_seleccionado, rango_horario, fecha.isoformat(), count, tickets, soles):
-                    st.rerun()
-            else:
-                st.error("❌ Selecciona un vendedor válido")
+        formulario_registro(tienda_seleccionada)
 
     # BOTÓN CRÍTICO: Actualizar desde archivo
     st.markdown("---")
@@ -487,22 +428,19 @@ with st.sidebar:
         limpiar_cache_tiendas()
         st.rerun()
     
-    # Información de estado
-    st.info(f"**Registros en memoria:** {len(st.session_state.records)}")
-    
-    # Información del archivo
-    ruta_archivo = obtener_ruta_archivo()
-    if os.path.exists(ruta_archivo):
-        st.success("💾 Archivo de datos: PRESENTE")
-    else:
-        st.warning("📝 Archivo de datos: Por crear")
+    estado_almacen()
 
-# Layout principal
-col1, col2 = st.columns([2, 1])
+# Paneles en fragmentos: filtrar, paginar o cambiar el periodo solo re-ejecuta su panel
+def eliminar_desde_historial(registros_por_id):
+    """Callback del botón de eliminar: borra el registro elegido en la página visible"""
+    record_id = st.session_state.registro_a_eliminar
+    if delete_record(record_id, registros_por_id[record_id].get('date')):
+        st.rerun(PANELES_DATOS)
 
-with col1:
-    # USAR LA TIENDA SELECCIONADA EN EL SIDEBAR
-    tienda_actual = st.session_state.tienda_selector if 'tienda_selector' in st.session_state else (tiendas[0] if tiendas else "NO_HAY_TIENDAS")
+@st.fragment(key="historial")
+def panel_historial(tienda_actual):
+    datos = instantanea_vigente()
+    total_registros = datos.agregados.total[REGISTROS]
     
     st.header(f"📋 HISTORIAL DE REGISTROS - {tienda_actual}")
     
@@ -511,72 +449,103 @@ with col1:
         actualizar_desde_archivo()
         st.rerun()
     
-    if st.session_state.records:
-        # Obtener registros de la tienda actual
-        registros_tienda_actual = [r for r in st.session_state.records if r.get('tienda') == tienda_actual]
-        
-        st.info(f"**Registros para {tienda_actual}:** {len(registros_tienda_actual)}")
-        
-        if registros_tienda_actual:
-            # Agrupar por vendedor
-            vendedores_tienda = list(set([r['seller'] for r in registros_tienda_actual]))
+    totales_vendedores = datos.agregados.totales_vendedor(tienda_actual)
+    if total_registros:
+        total_tienda = datos.agregados.por_tienda.get(tienda_actual, [0, 0, 0, 0])[REGISTROS]
+        st.info(f"**Registros para {tienda_actual}:** {total_tienda}")
+        
+        if total_tienda:
+            # Totales por vendedor desde los agregados precalculados
+            df_resumen = pd.DataFrame([exportacion.fila_vendedor(vendedor, acumulado)
+                                       for vendedor, acumulado in totales_vendedores.items()])
+            with st.expander(f"👥 Resumen por vendedor - {len(totales_vendedores)} vendedores", expanded=True):
+                st.dataframe(df_resumen, hide_index=True, use_container_width=True)
             
-            for vendedor in vendedores_tienda:
-                registros_vendedor = [r for r in registros_tienda_actual if r['seller'] == vendedor]
-                
-                datos_vendedor = []
-                for registro in registros_vendedor:
-                    datos_vendedor.append({
-                        'Fecha': pd.to_datetime(registro['date']).strftime('%d/%m/%Y'),
-                        'Vendedor': registro.get('seller', 'N/A'),
-                        'Rango Horario': registro.get('rango_horario', 'N/A'),
-                        'Clientes': registro.get('count', 0),
-                        'Tickets': registro.get('tickets', 0),
-                        'Soles (S/.)': registro.get('soles', 0),
-                        'Porcentaje': f"{calcular_porcentaje(registro.get('tickets', 0), registro.get('count', 0))}%"
-                    })
-                
-                df_vendedor = pd.DataFrame(datos_vendedor)
-                df_vendedor = df_vendedor.sort_values('Fecha', ascending=False)
+            # Filtros: rango de fechas (por defecto los últimos días), vendedor y tamaño de página
+            col_fil1, col_fil2, col_fil3 = st.columns([2, 2, 1])
+            with col_fil1:
+                rango_fechas = st.date_input(
+                    "📅 Rango de fechas:",
+                    value=(date.today() - timedelta(days=DIAS_HISTORIAL - 1), date.today()),
+                    key="historial_fechas"
+                )
+            with col_fil2:
+                filtro_vendedor = st.selectbox(
+                    "👤 Vendedor:", ["Todos"] + list(totales_vendedores), key="historial_vendedor"
+                )
+            with col_fil3:
+                por_pagina = st.selectbox("Por página:", REGISTROS_POR_PAGINA, key="historial_por_pagina")
+            
+            # Mientras se elige el rango, date_input devuelve una sola fecha
+            fechas = tuple(rango_fechas) if isinstance(rango_fechas, (tuple, list)) else (rango_fechas,)
+            desde, hasta = (fechas[0], fechas[-1]) if fechas else (None, None)
+            vendedor = None if filtro_vendedor == "Todos" else filtro_vendedor
+            
+            # El total llega con la primera consulta; si la página quedó fuera de rango se vuelve a pedir
+            pagina = st.session_state.get('historial_pagina', 1)
+            total_filtrados, pagina_registros = cargar_pagina_historial(
+                datos, tienda_actual, desde, hasta, vendedor, (pagina - 1) * por_pagina, por_pagina
+            )
+            paginas = max(1, -(-total_filtrados // por_pagina))
+            if pagina > paginas:
+                pagina = st.session_state.historial_pagina = paginas
+                total_filtrados, pagina_registros = cargar_pagina_historial(
+                    datos, tienda_actual, desde, hasta, vendedor, (pagina - 1) * por_pagina, por_pagina
+                )
+            
+            if pagina_registros:
+                df_pagina = pd.DataFrame([{
+                    'Fecha': formatear_fecha(registro.get('date')),
+                    'Vendedor': registro.get('seller', 'N/A'),
+                    'Rango Horario': registro.get('rango_horario', 'N/A'),
+                    'Clientes': registro.get('count', 0),
+                    'Tickets': registro.get('tickets', 0),
+                    'Soles (S/.)': registro.get('soles', 0),
+                    'Porcentaje': f"{calcular_porcentaje(registro.get('tickets', 0), registro.get('count', 0))}%"
+                } for _, registro in pagina_registros])
+                st.dataframe(df_pagina, hide_index=True, use_container_width=True)
                 
-                with st.expander(f"👤 {vendedor} - {len(registros_vendedor)} registros", expanded=True):
-                    # Estadísticas del vendedor
-                    total_clientes_vendedor = sum([r.get('count', 0) for r in registros_vendedor])
-                    total_tickets_vendedor = sum([r.get('tickets', 0) for r in registros_vendedor])
-                    total_soles_vendedor = sum([r.get('soles', 0) for r in registros_vendedor])
-                    porcentaje_promedio = calcular_porcentaje(total_tickets_vendedor, total_clientes_vendedor)
-                    
-                    col_stat1, col_stat2, col_stat3 = st.columns(3)
-                    with col_stat1:
-                        st.metric("Total Clientes", total_clientes_vendedor)
-                    with col_stat2:
-                        st.metric("Total Tickets", total_tickets_vendedor)
-                    with col_stat3:
-                        st.metric("Porcentaje", f"{porcentaje_promedio}%")
-                    
-                    st.dataframe(df_vendedor, hide_index=True, use_container_width=True)
+                col_pag1, col_pag2 = st.columns([1, 3])
+                with col_pag1:
+                    st.number_input("Página:", min_value=1, max_value=paginas, step=1, key="historial_pagina")
+                with col_pag2:
+                    inicio = (pagina - 1) * por_pagina
+                    st.caption(f"Mostrando {inicio + 1}-{inicio + len(pagina_registros)} de {total_filtrados} registros · página {pagina} de {paginas}")
+            else:
+                st.info("📭 No hay registros en el rango seleccionado. Amplía el rango de fechas.")
             
             # Sección de eliminación
             st.subheader("🗑️ Eliminar Registros")
-            indices_tienda = [i for i, r in enumerate(st.session_state.records) if r.get('tienda') == tienda_actual]
+            # Solo se ofrecen los registros de la página visible
+            registros_por_id = dict(pagina_registros)
             
-            if indices_tienda:
-                record_index = st.selectbox("Selecciona registro:", options=indices_tienda, format_func=formatear_registro_para_mostrar)
-                if st.button("Eliminar Registro Seleccionado", type="secondary"):
-                    if delete_record(record_index):
-                        st.rerun()
+            if registros_por_id:
+                st.selectbox(
+                    "Selecciona registro:",
+                    options=list(registros_por_id),
+                    format_func=lambda id_registro: formatear_registro_para_mostrar(registros_por_id[id_registro]),
+                    key="registro_a_eliminar"
+                )
+                st.button("Eliminar Registro Seleccionado", type="secondary",
+                          on_click=eliminar_desde_historial, args=(registros_por_id,))
+            mostrar_aviso('aviso_historial')
         else:
             st.warning(f"⚠️ No hay registros para la tienda '{tienda_actual}'")
     else:
         st.info("📝 No hay registros en el sistema. Agrega el primero en el sidebar.")
 
-with col2:
-    tienda_actual = st.session_state.tienda_selector if 'tienda_selector' in st.session_state else (tiendas[0] if tiendas else "NO_HAY_TIENDAS")
+@st.fragment(key="estadisticas")
+def panel_estadisticas(tienda_actual):
+    datos = instantanea_vigente()
+    total_registros = datos.agregados.total[REGISTROS]
     
     st.header(f"📊 ESTADÍSTICAS - {tienda_actual}")
     
-    # Estadísticas MEJORADAS
-    stats_tienda = get_stats_por_tienda(tienda_actual)
+    periodo = st.selectbox("🗓️ Periodo:", list(PERIODOS_ESTADISTICAS), key="periodo_estadisticas")
+    desde, hasta = rango_periodo(periodo)
+    
+    # Estadísticas MEJORADAS (el rollup diario responde los periodos)
+    stats_tienda = get_stats_por_tienda(datos, tienda_actual, desde, hasta)
     
     if stats_tienda['total_records'] > 0:
         # Métricas principales
@@ -619,200 +588,427 @@ with col2:
                 st.metric("⏰ Horario Pico", stats_tienda['horario_pico']['horario'], delta=f"{stats_tienda['horario_pico']['clientes']} clientes")
         
         # Gráficos
-        if st.session_state.records:
+        if total_registros:
             st.markdown("---")
             st.subheader("📊 Análisis Visual")
             
-            datos_grafico = []
-            for record in st.session_state.records:
-                if record.get('tienda') == tienda_actual:
-                    datos_grafico.append({
-                        'seller': record.get('seller', 'Desconocido'),
-                        'count': obtener_valor_seguro(record, 'count', 0),
-                        'tickets': obtener_valor_seguro(record, 'tickets', 0),
-                        'soles': obtener_valor_seguro(record, 'soles', 0)
-                    })
+            totales_vendedor = datos.agregados.totales_vendedor(tienda_actual, desde, hasta)
             
-            df_grafico = pd.DataFrame(datos_grafico)
-            
-            if not df_grafico.empty:
+            if totales_vendedor:
                 st.write("**👥 Desempeño por Vendedor (Clientes Atendidos)**")
-                seller_totals = df_grafico.groupby('seller')['count'].sum()
+                seller_totals = pd.Series(
+                    {vendedor: acumulado[CLIENTES] for vendedor, acumulado in totales_vendedor.items()},
+                    name='count'
+                ).sort_index()
                 st.bar_chart(seller_totals, use_container_width=True)
+            
+            st.write("**🗓️ Mapa de Calor Semanal (Clientes por Día y Horario)**")
+            st.altair_chart(grafico_mapa_calor(datos.agregados.mapa_calor(tienda_actual, desde, hasta)),
+                            use_container_width=True)
     else:
         st.info("No hay estadísticas para esta tienda")
 
-# SECCIÓN DE EXPORTACIÓN CON CONTRASEÑA
-st.markdown("---")
-st.header("📤 EXPORTACIÓN DE DATOS")
-
-col_exp1, col_exp2 = st.columns(2)
-
-with col_exp1:
-    if st.session_state.records:
-        # Crear DataFrame para exportación
-        datos_exportacion = []
-        for record in st.session_state.records:
-            clientes = obtener_valor_seguro(record, 'count', 0)
-            tickets = obtener_valor_seguro(record, 'tickets', 0)
-            soles = obtener_valor_seguro(record, 'soles', 0)
-            rango_horario = record.get('rango_horario', 'N/A')
-            porcentaje = calcular_porcentaje(tickets, clientes)
-            
-            datos_exportacion.append({
-                'Tienda': record.get('tienda', 'N/A'),
-                'Vendedor': record.get('seller', 'N/A'),
-                'Rango Horario': rango_horario,
-                'Fecha': record['date'],
-                'Clientes': clientes,
-                'Tickets': tickets,
-                'Soles (S/.)': soles,
-                'Porcentaje': f"{porcentaje}%",
-                'Timestamp': record.get('timestamp', 'N/A')
-            })
-        
-        df_export = pd.DataFrame(datos_exportacion)
-        df_export['Fecha'] = pd.to_datetime(df_export['Fecha'])
-        df_export = df_export.sort_values('Fecha', ascending=False)
+# Layout principal
+col1, col2 = st.columns([2, 1])
+# USAR LA TIENDA SELECCIONADA EN EL SIDEBAR
+tienda_actual = st.session_state.tienda_selector if 'tienda_selector' in st.session_state else (tiendas[0] if tiendas else "NO_HAY_TIENDAS")
+
+with col1:
+    panel_historial(tienda_actual)
+
+with col2:
+    panel_estadisticas(tienda_actual)
+
+# CLASIFICACIÓN DE TIENDAS Y VENDEDORES
+@st.cache_resource(max_entries=2, show_spinner="🏆 Preparando clasificación...")
+def obtener_indice_clasificacion(version, _datos):
+    """Índice de sumas acumuladas por día; se reconstruye solo cuando cambia la versión"""
+    return clasificacion.IndiceClasificacion(_datos.agregados.diario)
+
+# Cambiar fechas, métrica o cantidad solo re-ejecuta esta sección
+@st.fragment(key="clasificacion")
+def seccion_clasificacion():
+    datos = instantanea_vigente()
+    st.markdown("---")
+    st.header("🏆 CLASIFICACIÓN")
+
+    if not datos.agregados.total[REGISTROS]:
+        st.info("📝 No hay registros para clasificar.")
+        return
+
+    hoy = date.today()
+    col_cla1, col_cla2, col_cla3 = st.columns([2, 1, 1])
+    with col_cla1:
+        fechas = st.date_input("🗓️ Periodo:", value=(hoy - timedelta(days=29), hoy), key="periodo_clasificacion")
+    with col_cla2:
+        metrica = st.selectbox("📏 Ordenar por:", list(clasificacion.METRICAS), key="metrica_clasificacion")
+    with col_cla3:
+        cantidad = st.number_input("🔢 Top:", min_value=1, max_value=100, value=10, step=1, key="cantidad_clasificacion")
+
+    # Mientras se elige el rango, el selector devuelve solo la primera fecha
+    if isinstance(fechas, (tuple, list)):
+        desde, hasta = (fechas[0], fechas[-1]) if fechas else (None, None)
+    else:
+        desde = hasta = fechas
+
+    indice = obtener_indice_clasificacion(datos.version, datos)
+    col_top1, col_top2 = st.columns(2)
+    for columna, entidad, titulo in ((col_top1, 'tiendas', "🏪 Tiendas"), (col_top2, 'vendedores', "👥 Vendedores")):
+        with columna:
+            st.subheader(titulo)
+            top = indice.top(entidad, metrica, int(cantidad), desde, hasta)
+            if top:
+                st.dataframe(pd.DataFrame(clasificacion.filas_tabla(top, metrica)),
+                             hide_index=True, use_container_width=True)
+            else:
+                st.info("Sin registros en el periodo")
+
+seccion_clasificacion()
+
+# IMPORTACIÓN MASIVA DESDE CSV O EXCEL
+FILAS_ERROR_VISIBLES = 200
+
+@st.cache_data(max_entries=1, show_spinner="🔎 Validando archivo...")
+def validar_importacion(contenido, nombre, firma_tiendas):
+    """(válidas, errores) del archivo; se recalcula solo si cambia el archivo o el catálogo"""
+    return importacion.validar(importacion.leer_archivo(contenido, nombre), CATALOGO)
+
+def importar_registros(validas):
+    """Guardar todas las filas válidas en una sola escritura"""
+    try:
+        ALMACEN.agregar_lote(importacion.a_registros(validas))
+        REFRESCADOR.comprobar()
+    except Exception as e:
+        st.error(f"❌ Error crítico al importar: {str(e)}")
+        return False
+    st.success(f"✅ {len(validas)} registros importados permanentemente")
+    return True
+
+# Subir y validar un archivo solo re-ejecuta esta sección
+@st.fragment(key="importacion")
+def seccion_importacion():
+    st.markdown("---")
+    st.header("📥 IMPORTACIÓN MASIVA")
+    st.info("Sube un CSV o Excel con las columnas Tienda, Vendedor, Rango Horario, Fecha, Clientes y, opcionalmente, Tickets y Soles (S/.).")
+
+    archivo_importacion = st.file_uploader("📄 Archivo de conteos:", type=["csv", "xlsx"], key="archivo_importacion")
+    if archivo_importacion is not None:
+        contenido_importacion = archivo_importacion.getvalue()
+        try:
+            filas_validas, filas_error = validar_importacion(contenido_importacion, archivo_importacion.name, CATALOGO.firma)
+        except Exception as e:
+            st.error(f"❌ No se pudo leer el archivo: {str(e)}")
+        else:
+            col_imp1, col_imp2 = st.columns(2)
+            with col_imp1:
+                st.metric("✅ Filas válidas", len(filas_validas))
+            with col_imp2:
+                st.metric("❌ Filas con errores", len(filas_error))
+        
+            if len(filas_error):
+                st.warning(f"⚠️ Las filas con errores no se importarán (se muestran las primeras {FILAS_ERROR_VISIBLES}).")
+                st.dataframe(filas_error.head(FILAS_ERROR_VISIBLES), hide_index=True, use_container_width=True)
+                st.download_button(
+                    label="⬇️ Descargar filas con errores (CSV)",
+                    data=filas_error.to_csv(index=False).encode('utf-8-sig'),
+                    file_name=f"errores_{os.path.splitext(archivo_importacion.name)[0]}.csv",
+                    mime="text/csv",
+                    key="descargar_errores_importacion"
+                )
+        
+            # Evitar importar dos veces el mismo archivo en la sesión
+            huella_importacion = hashlib.sha1(contenido_importacion).hexdigest()
+            if st.session_state.get('importacion_hecha') == huella_importacion:
+                st.success("✅ Este archivo ya fue importado")
+            elif len(filas_validas):
+                contraseña = st.text_input("Ingrese la contraseña para importar:", type="password", key="contraseña_importacion")
+                if st.button(f"📥 Importar {len(filas_validas)} registros", type="primary", key="confirmar_importacion"):
+                    if contraseña == "demanda2025":
+                        if importar_registros(filas_validas):
+                            st.session_state.importacion_hecha = huella_importacion
+                            st.rerun()
+                    else:
+                        st.error("❌ Contraseña incorrecta")
+
+seccion_importacion()
+
+# Reporte Excel bajo demanda, cacheado por versión de datos
+@st.cache_data(max_entries=2, show_spinner="📊 Generando reporte Excel...")
+def generar_reporte_excel(version, firma_tiendas, _datos, _df_tiendas):
+    """Bytes del reporte; se regenera solo cuando cambian los registros o las tiendas"""
+    return exportacion.generar_excel(ALMACEN.tabla_completa(), get_stats_general(_datos), _df_tiendas)
+
+# Formatos por bloques: tienda y fechas opcionales, sin el límite de filas de Excel
+FORMATOS_DESCARGA = {
+    "CSV (.csv)": (exportacion.generar_csv, "csv", "text/csv"),
+    "Parquet (.parquet)": (exportacion.generar_parquet, "parquet", "application/vnd.apache.parquet"),
+}
+
+def preparar_descarga(formato, tienda, desde, hasta):
+    """Función sin argumentos para download_button: se ejecuta solo al pulsar descargar"""
+    generar, extension, _ = FORMATOS_DESCARGA[formato]
+    def descarga():
+        with metricas.tramo(f'exportar_{extension}') as tramo:
+            tabla = ALMACEN.tabla_completa()
+            indices = exportacion.indices_exportacion(tabla, tienda, desde, hasta)
+            salida = io.BytesIO()
+            for parte in generar(tabla, indices):
+                salida.write(parte)
+            tramo['registros'] = len(indices)
+            tramo['bytes_escritos'] = salida.tell()
+        return salida
+    return descarga
+
+def cambiar_modal(nombre, visible):
+    # Callback: el clic ya re-ejecuta el fragmento del botón, no hace falta st.rerun
+    st.session_state[nombre] = visible
+
+# SECCIÓN DE EXPORTACIÓN CON CONTRASEÑA (abrir o cerrar los modales solo re-ejecuta esta sección)
+@st.fragment(key="exportacion")
+def seccion_exportacion():
+    datos = instantanea_vigente()
+    total_registros = datos.agregados.total[REGISTROS]
+    st.markdown("---")
+    st.header("📤 EXPORTACIÓN DE DATOS")
+
+    col_exp1, col_exp2 = st.columns(2)
+
+    with col_exp1:
+        if total_registros:
+            # Botón de descarga con protección por contraseña
+            st.subheader("💾 Exportar Reporte Completo")
+            st.info("Descarga un archivo Excel con todos los registros, estadísticas y datos de tiendas.")
         
-        # Obtener estadísticas generales para el reporte
-        stats_general = get_stats_general()
+            st.button("📊 Generar Reporte Excel", key="download_excel", use_container_width=True,
+                      on_click=cambiar_modal, args=("mostrar_modal_descarga", True))
         
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Hoja 1: Todos los registros
-            df_export.to_excel(writer, index=False, sheet_name='Todos_Los_Registros')
+            # Modal para descarga
+            if st.session_state.mostrar_modal_descarga:
+                st.markdown("---")
+                st.subheader("🔒 Confirmación de Descarga")
+                st.warning("El reporte contiene información sensible. Confirme con la contraseña.")
             
-            # Hoja 2: Estadísticas generales
-            stats_df = pd.DataFrame([{
-                'Total Clientes': stats_general['total_clients'],
-                'Total Tickets': stats_general['total_tickets'],
-                'Total Soles': stats_general['total_soles'],
-                'Total Registros': stats_general['total_records'],
-                'Vendedor Top': f"{stats_general['top_seller']['name']} ({stats_general['top_seller']['count']})",
-                'Tienda Top': f"{stats_general['top_tienda']['name']} ({stats_general['top_tienda']['count']})",
-                'Promedio Clientes/Día': stats_general['avg_per_day'],
-                'Promedio Tickets/Día': stats_general['avg_tickets_per_day'],
-                'Promedio Soles/Día': stats_general['avg_soles_per_day'],
-                'Porcentaje General': f"{stats_general['porcentaje_general']}%",
-                'Ticket Promedio': f"S/. {stats_general['ticket_promedio']:,.1f}"
-            }])
-            stats_df.to_excel(writer, index=False, sheet_name='Estadisticas_Generales')
+                formatos = ["Excel (.xlsx)"] + [f for f in FORMATOS_DESCARGA
+                                                if f != "Parquet (.parquet)" or exportacion.PARQUET_DISPONIBLE]
+                formato = st.radio("📄 Formato:", formatos, horizontal=True, key="formato_descarga")
+                filtro_tienda, desde, hasta = None, None, None
+                if formato != "Excel (.xlsx)":
+                    col_fmt1, col_fmt2 = st.columns(2)
+                    with col_fmt1:
+                        eleccion = st.selectbox("🏪 Tienda:", ["Todas"] + obtener_tiendas(), key="tienda_descarga")
+                        filtro_tienda = None if eleccion == "Todas" else eleccion
+                    with col_fmt2:
+                        # Vacío = todas las fechas; con una sola fecha elegida se exporta ese día
+                        fechas = st.date_input("📅 Rango de fechas (opcional):", value=(), key="fechas_descarga")
+                        fechas = tuple(fechas) if isinstance(fechas, (tuple, list)) else (fechas,)
+                        if fechas:
+                            desde, hasta = fechas[0], fechas[-1]
+                
+                contraseña = st.text_input("Ingrese la contraseña:", type="password", key="contraseña_descarga")
             
-            # Hoja 3: Datos de tiendas y vendedores
-            df_tiendas.to_excel(writer, index=False, sheet_name='Tiendas_Vendedores')
-        
-        output.seek(0)
-        
-        # Botón de descarga con protección por contraseña
-        st.subheader("💾 Exportar Reporte Completo")
-        st.info("Descarga un archivo Excel con todos los registros, estadísticas y datos de tiendas.")
-        
-        if st.button("📊 Generar Reporte Excel", key="download_excel", use_container_width=True):
-            st.session_state.mostrar_modal_descarga = True
-            st.rerun()
-        
-        # Modal para descarga
-        if st.session_state.mostrar_modal_descarga:
-            st.markdown("---")
-            st.subheader("🔒 Confirmación de Descarga")
-            st.warning("El reporte contiene información sensible. Confirme con la contraseña.")
+                col_btn1, col_btn2 = st.columns(2)
+                with col_btn1:
+                    if st.button("✅ Confirmar Descarga", key="confirmar_descarga", use_container_width=True):
+                        if contraseña == "demanda2025":
+                            st.session_state.mostrar_modal_descarga = False
+                            st.success("✅ Contraseña correcta - Descargando archivo...")
+                            momento = datetime.now().strftime('%Y%m%d_%H%M')
+                            if formato in FORMATOS_DESCARGA:
+                                # Se genera por bloques al pulsar el botón de descarga, no en cada ejecución
+                                _, extension, mime = FORMATOS_DESCARGA[formato]
+                                output = preparar_descarga(formato, filtro_tienda, desde, hasta)
+                                nombre_archivo = f"registro_clientes{'_' + filtro_tienda if filtro_tienda else ''}_{momento}.{extension}"
+                            else:
+                                # El reporte solo se genera aquí, y se reutiliza mientras los datos no cambien
+                                with metricas.tramo('exportar_excel') as tramo:
+                                    output = generar_reporte_excel(datos.version, CATALOGO.firma, datos, df_tiendas)
+                                    tramo['registros'] = total_registros
+                                    tramo['bytes_escritos'] = len(output)
+                                mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                                nombre_archivo = f"registro_clientes_completo_{momento}.xlsx"
+                            # Descargar el archivo inmediatamente
+                            st.download_button(
+                                label="⬇️ Haga clic aquí para descargar",
+                                data=output,
+                                file_name=nombre_archivo,
+                                mime=mime,
+                                key="download_final",
+                                use_container_width=True
+                            )
+                        else:
+                            st.error("❌ Contraseña incorrecta")
+                with col_btn2:
+                    st.button("❌ Cancelar", key="cancelar_descarga", use_container_width=True,
+                              on_click=cambiar_modal, args=("mostrar_modal_descarga", False))
+        
+            st.info(f"**El reporte incluirá:** {total_registros} registros de todas las tiendas")
             
-            contraseña = st.text_input("Ingrese la contraseña:", type="password", key="contraseña_descarga")
+            # Un libro por tienda en un zip (lo mismo que python reportes_tienda.py)
+            st.subheader("🗂️ Reportes por Tienda")
+            st.info("Descarga un zip con un Excel por tienda: sus registros, estadísticas y resumen por vendedor.")
+            st.button("🗂️ Generar Reportes por Tienda", key="reportes_tienda", use_container_width=True,
+                      on_click=cambiar_modal, args=("mostrar_modal_reportes", True))
             
-            col_btn1, col_btn2 = st.columns(2)
-            with col_btn1:
-                if st.button("✅ Confirmar Descarga", key="confirmar_descarga", use_container_width=True):
-                    if contraseña == "demanda2025":
-                        st.session_state.mostrar_modal_descarga = False
-                        st.success("✅ Contraseña correcta - Descargando archivo...")
-                        # Descargar el archivo inmediatamente
-                        st.download_button(
-                            label="⬇️ Haga clic aquí para descargar",
-                            data=output,
-                            file_name=f"registro_clientes_completo_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            key="download_final",
-                            use_container_width=True
-                        )
-                    else:
-                        st.error("❌ Contraseña incorrecta")
-            with col_btn2:
-                if st.button("❌ Cancelar", key="cancelar_descarga", use_container_width=True):
-                    st.session_state.mostrar_modal_descarga = False
-                    st.rerun()
-        
-        st.info(f"**El reporte incluirá:** {len(st.session_state.records)} registros de todas las tiendas")
-        
-    else:
-        st.warning("No hay datos para exportar")
-
-with col_exp2:
-    if st.session_state.records:
-        # Botón de reinicio con protección por contraseña
-        st.subheader("🔄 Reinicio de Datos")
-        st.error("**ACCIÓN IRREVERSIBLE:** Esta acción elimina PERMANENTEMENTE todos los registros.")
-        
-        if st.button("🗑️ Iniciar Proceso de Reinicio", type="primary", key="reset_all", use_container_width=True):
-            st.session_state.mostrar_modal_reinicio = True
-            st.rerun()
+            if st.session_state.mostrar_modal_reportes:
+                st.markdown("---")
+                st.subheader("🔒 Confirmación de Reportes")
+                contraseña = st.text_input("Ingrese la contraseña:", type="password", key="contraseña_reportes")
+                
+                col_rep1, col_rep2 = st.columns(2)
+                with col_rep1:
+                    if st.button("✅ Generar Zip", key="confirmar_reportes", use_container_width=True):
+                        if contraseña == "demanda2025":
+                            st.session_state.mostrar_modal_reportes = False
+                            progreso = st.progress(0.0, text="Generando libros...")
+                            def al_avanzar(hechos, total, tienda):
+                                progreso.progress(hechos / total, text=f"{hechos}/{total} libros ({tienda})")
+                            # Los libros se escriben en varios procesos y entran al zip a medida que terminan
+                            fd, ruta_zip = tempfile.mkstemp(suffix='.zip')
+                            os.close(fd)
+                            try:
+                                with metricas.tramo('reportes_tienda') as tramo:
+                                    reportes_tienda.generar_zip_aparte(ruta_zip, al_avanzar=al_avanzar)
+                                    with open(ruta_zip, 'rb') as f:
+                                        output = f.read()
+                                    tramo['bytes_escritos'] = len(output)
+                                progreso.empty()
+                                st.download_button(
+                                    label="⬇️ Descargar reportes",
+                                    data=output,
+                                    file_name=f"reportes_tiendas_{datetime.now().strftime('%Y%m%d_%H%M')}.zip",
+                                    mime="application/zip",
+                                    key="download_reportes",
+                                    use_container_width=True
+                                )
+                            except (RuntimeError, OSError) as e:
+                                progreso.empty()
+                                st.error(f"❌ No se pudieron generar los reportes: {e}")
+                            finally:
+                                if os.path.exists(ruta_zip):
+                                    os.remove(ruta_zip)
+                        else:
+                            st.error("❌ Contraseña incorrecta")
+                with col_rep2:
+                    st.button("❌ Cancelar", key="cancelar_reportes", use_container_width=True,
+                              on_click=cambiar_modal, args=("mostrar_modal_reportes", False))
         
-        # Modal para reinicio
-        if st.session_state.mostrar_modal_reinicio:
-            st.markdown("---")
-            st.subheader("🔒 Confirmar Reinicio Total")
-            st.error("""
-            ⚠️ **ADVERTENCIA CRÍTICA:** 
-            - Se eliminarán TODOS los registros permanentemente
-            - Esta acción NO se puede deshacer
-            - Se perderá toda la información histórica
-            """)
+        else:
+            st.warning("No hay datos para exportar")
+
+    with col_exp2:
+        if total_registros:
+            # Botón de reinicio con protección por contraseña
+            st.subheader("🔄 Reinicio de Datos")
+            st.error("**ACCIÓN IRREVERSIBLE:** Esta acción elimina PERMANENTEMENTE todos los registros.")
+        
+            st.button("🗑️ Iniciar Proceso de Reinicio", type="primary", key="reset_all", use_container_width=True,
+                      on_click=cambiar_modal, args=("mostrar_modal_reinicio", True))
+        
+            # Modal para reinicio
+            if st.session_state.mostrar_modal_reinicio:
+                st.markdown("---")
+                st.subheader("🔒 Confirmar Reinicio Total")
+                st.error("""
+                ⚠️ **ADVERTENCIA CRÍTICA:** 
+                - Se eliminarán TODOS los registros permanentemente
+                - Esta acción NO se puede deshacer
+                - Se perderá toda la información histórica
+                """)
             
-            contraseña = st.text_input("Ingrese la contraseña para confirmar:", type="password", key="contraseña_reinicio")
+                contraseña = st.text_input("Ingrese la contraseña para confirmar:", type="password", key="contraseña_reinicio")
             
-            col_rein1, col_rein2 = st.columns(2)
-            with col_rein1:
-                if st.button("✅ CONFIRMAR REINICIO", type="primary", key="confirmar_reinicio", use_container_width=True):
-                    if contraseña == "demanda2025":
-                        # Limpiar tanto session_state como archivo
-                        st.session_state.records = []
-                        try:
-                            ruta_archivo = obtener_ruta_archivo()
-                            with open(ruta_archivo, 'w', encoding='utf-8') as f:
-                                json.dump([], f)
-                            st.success("✅ Todos los datos han sido eliminados permanentemente")
-                        except:
-                            st.error("❌ Error al limpiar archivo")
-                        st.session_state.mostrar_modal_reinicio = False
-                        st.rerun()
-                    else:
-                        st.error("❌ Contraseña incorrecta")
-            with col_rein2:
-                if st.button("❌ Cancelar", key="cancelar_reinicio", use_container_width=True):
-                    st.session_state.mostrar_modal_reinicio = False
-                    st.rerun()
-    else:
-        st.info("No hay datos para reiniciar")
+                col_rein1, col_rein2 = st.columns(2)
+                with col_rein1:
+                    if st.button("✅ CONFIRMAR REINICIO", type="primary", key="confirmar_reinicio", use_container_width=True):
+                        if contraseña == "demanda2025":
+                            # Limpiar tanto session_state como archivo
+                            if guardar_registros([]):
+                                st.success("✅ Todos los datos han sido eliminados permanentemente")
+                            else:
+                                st.error("❌ Error al limpiar archivo")
+                            st.session_state.mostrar_modal_reinicio = False
+                            st.rerun()
+                        else:
+                            st.error("❌ Contraseña incorrecta")
+                with col_rein2:
+                    st.button("❌ Cancelar", key="cancelar_reinicio", use_container_width=True,
+                              on_click=cambiar_modal, args=("mostrar_modal_reinicio", False))
+        else:
+            st.info("No hay datos para reiniciar")
+
+seccion_exportacion()
 
 # HERRAMIENTAS ADICIONALES
-with st.expander("🔄 HERRAMIENTAS DE GESTIÓN", expanded=False):
-    st.subheader("🧹 Mantenimiento de Datos")
-    
-    col_mant1, col_mant2 = st.columns(2)
-    
-    with col_mant1:
-        st.write("**Limpiar Registros Antiguos**")
-        st.warning("Elimina registros que no tienen información de tienda (formato antiguo).")
-        if st.button("🧹 Ejecutar Limpieza", key="clean_old", use_container_width=True):
-            registros_originales = len(st.session_state.records)
-            st.session_state.records = [r for r in st.session_state.records if 'tienda' in r]
-            registros_nuevos = len(st.session_state.records)
-            eliminados = registros_originales - registros_nuevos
+@st.fragment(key="herramientas")
+def herramientas_gestion():
+    datos = instantanea_vigente()
+    with st.expander("🔄 HERRAMIENTAS DE GESTIÓN", expanded=False):
+        st.subheader("🧹 Mantenimiento de Datos")
+    
+        col_mant1, col_mant2 = st.columns(2)
+    
+        with col_mant1:
+            st.write("**Limpiar Registros Antiguos**")
+            st.warning("Elimina registros que no tienen información de tienda (formato antiguo).")
+            if st.button("🧹 Ejecutar Limpieza", key="clean_old", use_container_width=True):
+                # Toda la historia, no solo la ventana en memoria del backend segmentado
+                historia = ALMACEN.tabla_completa()
+                registros_originales = len(historia)
+                registros_limpios = [r for r in historia if 'tienda' in r]
+                registros_nuevos = len(registros_limpios)
+                eliminados = registros_originales - registros_nuevos
             
-            # Guardar cambios
-            if guardar_registros(st.session_state.records):
-                st.success(f"✅ Se eliminaron {eliminados} registros antiguos")
-            st.rerun()
+                # Guardar cambios
+                if guardar_registros(registros_limpios):
+                    st.success(f"✅ Se eliminaron {eliminados} registros antiguos")
+                st.rerun()
+    
+        with col_mant2:
+            st.write("**Uso de Memoria**")
+            st.info("Todas las sesiones comparten una sola copia de los registros y sus estadísticas.")
+            if st.button("📦 Calcular Memoria", key="reporte_memoria", use_container_width=True):
+                # Sesiones con actividad en los últimos 30 minutos
+                limite = time.time() - 1800
+                sesiones = sum(1 for visto in obtener_sesiones_activas().values() if visto >= limite)
+                memoria = almacenamiento.estimar_memoria(datos)
+                compartida = memoria['registros'] + memoria['agregados']
+                por_sesion = compartida * sesiones
+                st.write(f"**Sesiones activas:** {sesiones}")
+                st.write(f"**Registros en memoria (columnar):** {memoria['registros'] / 1024 ** 2:,.1f} MB")
+                st.write(f"**Como lista de dicts:** {memoria['registros_como_dicts'] / 1024 ** 2:,.1f} MB")
+                st.write(f"**Estadísticas precalculadas:** {memoria['agregados'] / 1024 ** 2:,.1f} MB")
+                st.write(f"**Copia compartida:** {compartida / 1024 ** 2:,.1f} MB")
+                st.write(f"**Con una copia por sesión:** {por_sesion / 1024 ** 2:,.1f} MB")
+                st.success(f"✅ Ahorro: {(por_sesion - compartida) / 1024 ** 2:,.1f} MB")
+
+herramientas_gestion()
+
+# PANEL DE MÉTRICAS (opcional, para administradores): VIALE_PANEL_METRICAS=1
+@st.fragment(key="metricas")
+def panel_metricas():
+    with st.expander("⏱️ MÉTRICAS DE RENDIMIENTO", expanded=False):
+        st.caption(f"Percentiles de los últimos {metricas.METRICAS.ventana / 60:.0f} minutos, compartidos por todas las sesiones del servidor.")
+        st.button("🔄 Actualizar Métricas", key="actualizar_metricas")
+        resumen = metricas.METRICAS.resumen()
+        if resumen:
+            st.dataframe(pd.DataFrame([{
+                'Tramo': nombre,
+                'Llamadas': datos['muestras'],
+                'p50 (ms)': datos['p50_ms'],
+                'p95 (ms)': datos['p95_ms'],
+                'Máx (ms)': datos['max_ms'],
+                'Registros': datos['registros'],
+                'KB leídos': round(datos['bytes_leidos'] / 1024, 1),
+                'KB escritos': round(datos['bytes_escritos'] / 1024, 1),
+                'Errores': datos['errores'],
+            } for nombre, datos in resumen.items()]), hide_index=True, use_container_width=True)
+        else:
+            st.info("Todavía no hay mediciones")
+        if metricas.METRICAS.ruta:
+            st.caption(f"📄 Archivo de métricas: `{metricas.METRICAS.ruta}`")
+
+if os.environ.get("VIALE_PANEL_METRICAS") == "1":
+    panel_metricas()
 
 # Footer
 st.markdown("---")
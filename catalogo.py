@@ -0,0 +1,127 @@
+"""Catálogo de tiendas y vendedores (Asesores.xlsx).
+
+El Excel se lee una sola vez por cambio del archivo: el índice tienda →
+vendedores se guarda en una caché binaria (pickle) junto a los datos
+persistentes, identificada por el mtime y el tamaño del xlsx. Mientras el
+archivo no cambie, los procesos nuevos cargan la caché en lugar de volver a
+pasar por pd.read_excel.
+"""
+import os
+import pickle
+import threading
+
+import pandas as pd
+
+from almacenamiento import escribir_atomico, obtener_directorio_datos
+
+RUTA_ASESORES = "Asesores.xlsx"
+NOMBRE_CACHE = "asesores.cache"
+# Cambia si cambia la estructura guardada en la caché
+VERSION_CACHE = 2
+
+
+class Catalogo:
+    """Índice tienda → vendedores construido una vez a partir del DataFrame"""
+
+    def __init__(self, df, firma=None):
+        self.df = df
+        self.firma = firma
+        self.valido = 'Tienda' in df.columns and 'Vendedor' in df.columns
+        self.por_tienda = {}
+        vendedores = set()
+        if self.valido:
+            for tienda, vendedor in zip(df['Tienda'], df['Vendedor']):
+                if pd.isna(tienda) or pd.isna(vendedor):
+                    continue
+                lista = self.por_tienda.setdefault(tienda, [])
+                # Sin repetidos y en el orden en que aparecen en el Excel
+                if vendedor not in lista:
+                    lista.append(vendedor)
+                vendedores.add(vendedor)
+        self.tiendas = sorted(self.por_tienda)
+        self.total_vendedores = len(vendedores)
+        # Nombre sin espacios sobrantes → nombre tal como figura en el Excel
+        self.tiendas_normalizadas = {str(t).strip(): t for t in self.por_tienda}
+        self.vendedores_normalizados = {
+            (str(t).strip(), str(v).strip()): v for t, lista in self.por_tienda.items() for v in lista
+        }
+
+    def vendedores(self, tienda):
+        return list(self.por_tienda.get(tienda, []))
+
+
+def firma_archivo(ruta):
+    """(mtime, tamaño) del archivo; None si no existe"""
+    try:
+        estado = os.stat(ruta)
+    except FileNotFoundError:
+        return None
+    return (estado.st_mtime_ns, estado.st_size)
+
+
+def ruta_cache(directorio=None):
+    return os.path.join(obtener_directorio_datos(directorio), NOMBRE_CACHE)
+
+
+def cargar_catalogo(ruta=RUTA_ASESORES, directorio=None):
+    """Catálogo desde la caché binaria si sigue vigente; si no, desde el Excel"""
+    firma = firma_archivo(ruta)
+    if firma is None:
+        raise FileNotFoundError(f"No existe {ruta}")
+    cache = ruta_cache(directorio)
+    clave = (VERSION_CACHE, os.path.abspath(ruta), firma)
+    try:
+        with open(cache, 'rb') as f:
+            guardado = pickle.load(f)
+        if guardado['clave'] == clave:
+            return guardado['catalogo']
+    except (OSError, pickle.PickleError, EOFError, KeyError, TypeError, AttributeError):
+        # Caché ausente, dañada o de otra versión: se reconstruye
+        pass
+
+    catalogo = Catalogo(pd.read_excel(ruta), firma)
+    try:
+        escribir_atomico(cache, lambda f: pickle.dump({'clave': clave, 'catalogo': catalogo}, f,
+                                                      protocol=pickle.HIGHEST_PROTOCOL), modo='wb')
+    except OSError:
+        # Sin caché el catálogo sigue siendo válido; solo se perderá al reiniciar
+        pass
+    return catalogo
+
+
+class VigiaCatalogo:
+    """Catálogo compartido por el proceso; se recarga solo cuando cambia el xlsx"""
+
+    def __init__(self, ruta=RUTA_ASESORES, directorio=None):
+        self.ruta = ruta
+        self.directorio = directorio
+        self._cerrojo = threading.Lock()
+        self._firma = None
+        self._catalogo = None
+        self._error = None
+
+    def obtener(self):
+        """Catálogo vigente; relanza el error de lectura hasta que el archivo cambie"""
+        with self._cerrojo:
+            firma = firma_archivo(self.ruta)
+            if firma is None or firma != self._firma:
+                self._firma = firma
+                self._catalogo, self._error = None, None
+                try:
+                    self._catalogo = cargar_catalogo(self.ruta, self.directorio)
+                except Exception as e:
+                    self._error = e
+            if self._error is not None:
+                raise self._error
+            return self._catalogo
+
+    def invalidar(self):
+        """Olvidar el catálogo en memoria y en disco; la próxima lectura vuelve al Excel"""
+        with self._cerrojo:
+            self._firma = None
+            self._catalogo = None
+            self._error = None
+            try:
+                os.remove(ruta_cache(self.directorio))
+            except FileNotFoundError:
+                pass
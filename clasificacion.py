@@ -0,0 +1,130 @@
+"""Clasificación de tiendas y vendedores por periodo.
+
+El índice se construye una vez por versión de los datos a partir del rollup
+diario. Por cada entidad (tienda o vendedor) guarda sus días con actividad,
+ordenados por entidad y fecha, y las sumas acumuladas de esos días en un solo
+arreglo. El total de cualquier entidad entre dos fechas es la diferencia de
+dos acumulados. Dos searchsorted dan esos índices para todas las entidades a
+la vez, sin recorrer el historial, y un heap elige las K primeras.
+
+    python clasificacion.py --registros 1000000 --tiendas 200 --dias 1095
+"""
+import argparse
+import heapq
+import time
+from datetime import timedelta
+
+import numpy as np
+
+import rollup
+from agregados import CLIENTES, REGISTROS, SOLES, TICKETS, a_soles, calcular_porcentaje
+
+# Métricas ofrecidas: nombre visible → posición en el acumulado (None = conversión)
+METRICAS = {
+    'Clientes': CLIENTES,
+    'Tickets': TICKETS,
+    'Soles (S/.)': SOLES,
+    'Conversión (%)': None,
+}
+
+
+class _IndiceEntidad:
+    """Sumas acumuladas por (entidad, día) para un tipo de entidad"""
+
+    def __init__(self, entidades, fechas, sumas, nombres):
+        claves = (entidades << rollup.BITS_FECHA) | fechas
+        unicas, inversos = np.unique(claves, return_inverse=True)
+        por_dia = np.zeros((len(unicas), 4), dtype=np.int64)
+        np.add.at(por_dia, inversos, sumas)
+        self.claves = unicas
+        # Fila 0 en ceros: el acumulado "antes del primer día" de cualquier entidad
+        self.acumulados = np.vstack([np.zeros((1, 4), dtype=np.int64), np.cumsum(por_dia, axis=0)])
+        self.entidades = np.unique(unicas >> rollup.BITS_FECHA)
+        self.nombres = [nombres(int(e)) for e in self.entidades]
+
+    def totales(self, desde=None, hasta=None):
+        """Matriz entidades × [registros, clientes, tickets, céntimos] entre dos fechas (inclusive)"""
+        base = self.entidades << rollup.BITS_FECHA
+        inicio = base | (desde.toordinal() if desde is not None else 0)
+        ultimo = (1 << rollup.BITS_FECHA) - 1
+        fin = base | (min(hasta.toordinal(), ultimo) if hasta is not None else ultimo)
+        # Índices en acumulados (desplazados en 1 por la fila de ceros)
+        antes = np.searchsorted(self.claves, inicio, side='left')
+        hasta_incluido = np.searchsorted(self.claves, fin, side='right')
+        return self.acumulados[hasta_incluido] - self.acumulados[antes]
+
+
+def _valor(fila, posicion):
+    if posicion is None:
+        return calcular_porcentaje(int(fila[TICKETS]), int(fila[CLIENTES]))
+    return int(fila[posicion])
+
+
+class IndiceClasificacion:
+    """Top-K de tiendas y vendedores por clientes, tickets, soles o conversión"""
+
+    def __init__(self, diario):
+        tiendas, fechas, _, vendedores, sumas = diario.columnas()
+        # Como en stats_general: los registros antiguos sin tienda cuentan como 'Desconocido'
+        self.tiendas = _IndiceEntidad(tiendas, fechas, sumas,
+                                      lambda c: rollup.TIENDAS.valores[c] if c else 'Desconocido')
+        self.vendedores = _IndiceEntidad(vendedores, fechas, sumas, rollup.VENDEDORES.valores.__getitem__)
+
+    def top(self, entidad, metrica, k=10, desde=None, hasta=None):
+        """[(nombre, valor, [registros, clientes, tickets, céntimos])] de las k primeras
+        entidades ('tiendas' o 'vendedores') en el periodo; sin actividad no entran"""
+        indice = self.tiendas if entidad == 'tiendas' else self.vendedores
+        totales = indice.totales(desde, hasta)
+        posicion = METRICAS[metrica]
+        activas = np.flatnonzero(totales[:, REGISTROS] > 0)
+        # Con empate gana el nombre que va antes (índice menor)
+        mejores = heapq.nlargest(k, ((_valor(totales[i], posicion), -i) for i in activas.tolist()))
+        return [(indice.nombres[-negado], valor, totales[-negado].tolist()) for valor, negado in mejores]
+
+
+def filas_tabla(top, metrica):
+    """Filas para mostrar una clasificación (posición, nombre y sus totales)"""
+    return [{
+        'Puesto': puesto,
+        'Nombre': nombre,
+        metrica: a_soles(valor) if METRICAS[metrica] == SOLES else valor,
+        'Clientes': acumulado[CLIENTES],
+        'Tickets': acumulado[TICKETS],
+        'Soles (S/.)': a_soles(acumulado[SOLES]),
+        'Conversión (%)': calcular_porcentaje(acumulado[TICKETS], acumulado[CLIENTES]),
+    } for puesto, (nombre, valor, acumulado) in enumerate(top, start=1)]
+
+
+def medir(registros, tiendas, dias, consultas=200):
+    """(segundos de construcción del índice, ms por consulta top-10) con datos sintéticos"""
+    from columnar import TablaColumnar, construir_agregados
+    from datos_sinteticos import PRIMER_DIA, registros_sinteticos
+
+    tabla = TablaColumnar.desde_registros(registros_sinteticos(registros, tiendas=tiendas, dias=dias))
+    agregados = construir_agregados(tabla)
+    inicio = time.perf_counter()
+    indice = IndiceClasificacion(agregados.diario)
+    construccion = time.perf_counter() - inicio
+    azar = np.random.default_rng(1)
+    primer_dia = PRIMER_DIA
+    inicio = time.perf_counter()
+    for _ in range(consultas):
+        a, b = sorted(azar.integers(0, dias, 2).tolist())
+        entidad = 'tiendas' if azar.integers(2) else 'vendedores'
+        metrica = list(METRICAS)[azar.integers(len(METRICAS))]
+        indice.top(entidad, metrica, 10, primer_dia + timedelta(days=a), primer_dia + timedelta(days=b))
+    return construccion, (time.perf_counter() - inicio) * 1000 / consultas
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Tiempo de construcción y consulta del índice de clasificación")
+    parser.add_argument('--registros', type=int, default=1000000)
+    parser.add_argument('--tiendas', type=int, default=200)
+    parser.add_argument('--dias', type=int, default=1095)
+    opciones = parser.parse_args(argumentos)
+    construccion, por_consulta = medir(opciones.registros, opciones.tiendas, opciones.dias)
+    print(f"índice {construccion:.2f} s   consulta top-10 {por_consulta:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Cola de escritura con commit agrupado.
+
+Un único hilo escritor por almacén recibe los registros de todas las
+sesiones (y del servicio de ingesta). Lo que llega dentro de una ventana
+corta (VENTANA_ESCRITURA, 50 ms por defecto) se guarda con un solo
+agregar_lote: una escritura y un fsync para todo el grupo. La ventana se
+cierra antes si pasa PAUSA_ESCRITURA sin que llegue nada: quien ya está
+esperando no gana nada con seguir esperando. Cada llamada
+espera hasta que su lote está en disco y recibe la versión resultante, o la
+excepción si el lote falló.
+
+    python cola_escritura.py --hilos 16 --registros 400
+
+compara el rendimiento con escrituras concurrentes contra el guardado de
+antes (cargar todo, añadir el registro y reescribir) y contra agregar directo.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+# Segundos que el escritor espera más registros tras recibir el primero
+VENTANA_ESCRITURA = float(os.environ.get("VIALE_VENTANA_ESCRITURA", "0.05"))
+# Silencio tras el cual el lote se escribe sin agotar la ventana
+PAUSA_ESCRITURA = 0.002
+# Tope de registros por commit (un lote más grande se parte en varios)
+MAXIMO_LOTE = 5000
+
+
+class _Pendiente:
+    """Resultado de una escritura encolada"""
+
+    def __init__(self):
+        self._hecho = threading.Event()
+        self._version = None
+        self._error = None
+
+    def resolver(self, version=None, error=None):
+        self._version, self._error = version, error
+        self._hecho.set()
+
+    def esperar(self, tiempo=None):
+        if not self._hecho.wait(tiempo):
+            raise TimeoutError("La escritura sigue en cola")
+        if self._error is not None:
+            raise self._error
+        return self._version
+
+
+class ColaEscritura:
+    """Escritor único con commit agrupado sobre un AlmacenBase"""
+
+    def __init__(self, almacen, ventana=VENTANA_ESCRITURA, maximo_lote=MAXIMO_LOTE, pausa=PAUSA_ESCRITURA):
+        self.almacen = almacen
+        self.ventana = ventana
+        self.pausa = pausa
+        self.maximo_lote = maximo_lote
+        self._condicion = threading.Condition()
+        self._pendientes = []
+        self._hilo = None
+        self._cerrada = False
+        # Para el reporte de rendimiento
+        self.lotes = 0
+        self.escritos = 0
+
+    def agregar(self, registro, tiempo=None):
+        """Encolar un registro y esperar a que su lote esté en disco; devuelve la versión"""
+        return self.encolar(registro).esperar(tiempo)
+
+    def encolar(self, registro):
+        """Encolar sin esperar; el resultado se obtiene con .esperar()"""
+        pendiente = _Pendiente()
+        with self._condicion:
+            if self._cerrada:
+                raise RuntimeError("La cola de escritura está cerrada")
+            self._pendientes.append((registro, pendiente))
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._escribir, name='cola-escritura', daemon=True)
+                self._hilo.start()
+            self._condicion.notify()
+        return pendiente
+
+    def cerrar(self):
+        """Escribir lo pendiente y detener el hilo escritor"""
+        with self._condicion:
+            self._cerrada = True
+            self._condicion.notify()
+            hilo = self._hilo
+        if hilo is not None:
+            hilo.join()
+
+    def _tomar_lote(self):
+        with self._condicion:
+            while not self._pendientes and not self._cerrada:
+                self._condicion.wait()
+            if not self._pendientes:
+                return None
+            # La ventana empieza con el primer registro del lote
+            limite = time.monotonic() + self.ventana
+            while not self._cerrada and len(self._pendientes) < self.maximo_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                antes = len(self._pendientes)
+                self._condicion.wait(min(restante, self.pausa))
+                if len(self._pendientes) == antes:
+                    break
+            lote = self._pendientes[:self.maximo_lote]
+            del self._pendientes[:self.maximo_lote]
+            return lote
+
+    def _escribir(self):
+        while True:
+            lote = self._tomar_lote()
+            if lote is None:
+                return
+            try:
+                version = self.almacen.agregar_lote([registro for registro, _ in lote])
+            except Exception as e:
+                for _, pendiente in lote:
+                    pendiente.resolver(error=e)
+                continue
+            self.lotes += 1
+            self.escritos += len(lote)
+            for _, pendiente in lote:
+                pendiente.resolver(version)
+
+
+def _medir(escribir, hilos, por_hilo, registro):
+    from modelo import nuevo_id
+
+    def trabajar():
+        for _ in range(por_hilo):
+            escribir(dict(registro, id=nuevo_id()))
+
+    trabajadores = [threading.Thread(target=trabajar) for _ in range(hilos)]
+    inicio = time.perf_counter()
+    for t in trabajadores:
+        t.start()
+    for t in trabajadores:
+        t.join()
+    return hilos * por_hilo / (time.perf_counter() - inicio)
+
+
+def comparar(backend, hilos=16, por_hilo=200, ventana=VENTANA_ESCRITURA, por_hilo_reescritura=20):
+    """(escrituras/s cargando y reescribiendo todo, con agregar directo, con la cola, lotes)
+    en un directorio temporal.
+
+    Reescribir todo cuesta lo que ya hay guardado, así que ese camino se mide con
+    por_hilo_reescritura registros por hilo: con más registros solo sería más lento."""
+    import almacenamiento
+
+    registro = {'tienda': 'AL000', 'seller': 'VENDEDOR', 'rango_horario': '10 a.m - 11 a.m',
+                'date': '2025-01-01', 'count': 1, 'tickets': 0, 'soles': 0.0, 'timestamp': '2025-01-01T10:00:00'}
+    with tempfile.TemporaryDirectory() as directorio:
+        original = almacenamiento.crear_almacen(backend, os.path.join(directorio, 'original'))
+        original.instantanea()
+        # El guardado de antes: cada sesión cargaba todo, añadía su registro y reescribía. Sin el
+        # candado dos sesiones se pisaban y se perderían escrituras que sí se cuentan
+        candado = threading.Lock()
+
+        def guardar_todo(nuevo):
+            with candado:
+                original.guardar(list(original.iterar()) + [nuevo])
+        por_segundo_original = _medir(guardar_todo, hilos, por_hilo_reescritura, registro)
+
+        directo = almacenamiento.crear_almacen(backend, os.path.join(directorio, 'directo'))
+        directo.instantanea()
+        por_segundo_directo = _medir(directo.agregar, hilos, por_hilo, registro)
+
+        agrupado = almacenamiento.crear_almacen(backend, os.path.join(directorio, 'cola'))
+        agrupado.instantanea()
+        cola = ColaEscritura(agrupado, ventana)
+        por_segundo_cola = _medir(cola.agregar, hilos, por_hilo, registro)
+        cola.cerrar()
+        return por_segundo_original, por_segundo_directo, por_segundo_cola, cola.lotes
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Rendimiento de la cola de escritura frente al guardado "
+                                                 "que reescribe todo y a agregar directo")
+    parser.add_argument('--backend', action='append', help="backend a medir (repetible; por defecto todos)")
+    parser.add_argument('--hilos', type=int, default=16)
+    parser.add_argument('--registros', type=int, default=200, help="registros por hilo")
+    parser.add_argument('--ventana', type=float, default=VENTANA_ESCRITURA)
+    parser.add_argument('--registros-reescritura', type=int, default=20,
+                        help="registros por hilo al medir el guardado que reescribe todo")
+    opciones = parser.parse_args(argumentos)
+    import almacenamiento
+    for backend in opciones.backend or list(almacenamiento.BACKENDS):
+        original, directo, agrupado, lotes = comparar(backend, opciones.hilos, opciones.registros, opciones.ventana,
+                                                      opciones.registros_reescritura)
+        print(f"{backend:10} reescribir {original:8.0f}/s   directo {directo:8.0f}/s   cola {agrupado:8.0f}/s   "
+              f"({opciones.hilos * opciones.registros} registros en {lotes} lotes; "
+              f"reescribir, {opciones.hilos * opciones.registros_reescritura})")
+
+
+if __name__ == '__main__':
+    main()
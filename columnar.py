@@ -0,0 +1,563 @@
+"""Representación columnar de los registros de clientes.
+
+Los registros se guardan en arreglos NumPy: count, tickets, soles e id como
+números, tienda, seller y rango_horario como códigos enteros de un
+diccionario de cadenas, la fecha como ordinal de día y el timestamp en
+microseconds. Cada registro ocupa unas decenas de bytes en lugar de un dict
+con ocho cadenas, así que caben millones de filas en memoria.
+
+``TablaColumnar`` se comporta como una secuencia de dicts de solo lectura:
+``tabla[i]`` reconstruye el registro original. Los valores que no encajan en
+su columna (tipos inesperados, fechas no ISO, campos adicionales) se guardan
+aparte por fila, de modo que la conversión es sin pérdida.
+"""
+from collections.abc import Sequence
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import rollup
+from agregados import Agregados
+from modelo import CAMPOS, RANGOS_HORARIO
+
+TIENDA, SELLER, RANGO, FECHA, COUNT, TICKETS_, SOLES_, TIMESTAMP, ID = range(len(CAMPOS))
+
+# Tipo de cada columna, en el orden de CAMPOS, más la máscara de campos presentes
+TIPOS = {
+    'tienda': np.int32,
+    'seller': np.int32,
+    'rango_horario': np.int16,
+    'date': np.int32,
+    'count': np.int64,
+    'tickets': np.int64,
+    'soles': np.float64,
+    'timestamp': np.int64,
+    'id': np.int64,
+    'presentes': np.uint16,
+}
+
+EPOCA = datetime(1970, 1, 1)
+TAMANO_BLOQUE = 65536
+
+
+class Diccionario:
+    """Cadenas ↔ códigos enteros; solo crece, así los códigos nunca cambian"""
+
+    def __init__(self, valores=()):
+        self.valores = []
+        self.codigos = {}
+        for valor in valores:
+            self.codificar(valor)
+
+    def codificar(self, valor):
+        codigo = self.codigos.get(valor)
+        if codigo is None:
+            codigo = self.codigos[valor] = len(self.valores)
+            self.valores.append(valor)
+        return codigo
+
+    def __len__(self):
+        return len(self.valores)
+
+
+def _fecha_a_ordinal(valor, cache={}):
+    if type(valor) is not str:
+        return None
+    ordinal = cache.get(valor)
+    if ordinal is None:
+        try:
+            fecha = date.fromisoformat(valor)
+        except (TypeError, ValueError):
+            return None
+        if fecha.isoformat() != valor:
+            return None
+        ordinal = cache[valor] = fecha.toordinal()
+    return ordinal
+
+
+def _ordinal_a_fecha(ordinal, cache={}):
+    valor = cache.get(ordinal)
+    if valor is None:
+        valor = cache[ordinal] = date.fromordinal(ordinal).isoformat()
+    return valor
+
+
+def _timestamp_a_us(valor):
+    try:
+        momento = datetime.fromisoformat(valor)
+    except (TypeError, ValueError):
+        return None
+    if momento.tzinfo is not None or momento.isoformat() != valor:
+        return None
+    return round((momento - EPOCA).total_seconds() * 1_000_000)
+
+
+def _us_a_timestamp(microsegundos):
+    return (EPOCA + timedelta(microseconds=int(microsegundos))).isoformat()
+
+
+class _Columnas:
+    """Arreglos con capacidad de reserva; ``usadas`` filas ya están escritas"""
+
+    def __init__(self, capacidad=0):
+        capacidad = max(capacidad, 16)
+        self.arreglos = {nombre: np.zeros(capacidad, dtype=tipo) for nombre, tipo in TIPOS.items()}
+        self.usadas = 0
+
+    @property
+    def capacidad(self):
+        return len(self.arreglos['presentes'])
+
+    def reservar(self, filas):
+        necesaria = self.usadas + filas
+        if necesaria <= self.capacidad:
+            return
+        capacidad = max(necesaria, self.capacidad * 2)
+        for nombre, arreglo in self.arreglos.items():
+            nuevo = np.zeros(capacidad, dtype=arreglo.dtype)
+            nuevo[:self.usadas] = arreglo[:self.usadas]
+            self.arreglos[nombre] = nuevo
+
+    def copiar(self, filas):
+        copia = _Columnas(filas)
+        for nombre, arreglo in self.arreglos.items():
+            copia.arreglos[nombre][:filas] = arreglo[:filas]
+        copia.usadas = filas
+        return copia
+
+
+class TablaColumnar(Sequence):
+    """Secuencia inmutable de registros respaldada por columnas NumPy.
+
+    Varias tablas pueden compartir los mismos arreglos: ``con_registro`` escribe
+    detrás de la última fila visible, así que las tablas anteriores (más cortas)
+    no ven el cambio. Eliminar crea arreglos nuevos.
+    """
+
+    def __init__(self, columnas=None, filas=0, tiendas=None, sellers=None, rangos=None, extras=None):
+        self._columnas = columnas or _Columnas()
+        self._filas = filas
+        self.tiendas = tiendas or Diccionario()
+        self.sellers = sellers or Diccionario()
+        self.rangos = rangos or Diccionario(RANGOS_HORARIO)
+        # fila -> {campo: valor original} para lo que no cabe en las columnas
+        self._extras = extras if extras is not None else {}
+
+    # Construcción
+
+    @classmethod
+    def desde_registros(cls, registros):
+        """Codificar un iterable de dicts por bloques, sin materializar la lista completa"""
+        tabla = cls()
+        bloque = []
+        for registro in registros:
+            bloque.append(registro)
+            if len(bloque) >= TAMANO_BLOQUE:
+                tabla._anexar(bloque)
+                bloque = []
+        if bloque:
+            tabla._anexar(bloque)
+        return tabla
+
+    def _codificar(self, registro, fila):
+        """Valores de columna de un registro; lo que no encaja va a extras.
+
+        Desenrollado campo por campo: es el bucle caliente al cargar el historial.
+        """
+        valores = [-1, -1, -1, -1, 0, 0, 0.0, 0, 0]
+        presentes = 0
+        extras = {}
+        for posicion, campo, diccionario in ((TIENDA, 'tienda', self.tiendas),
+                                             (SELLER, 'seller', self.sellers),
+                                             (RANGO, 'rango_horario', self.rangos)):
+            if campo in registro:
+                presentes |= 1 << posicion
+                valor = registro[campo]
+                if type(valor) is str:
+                    codigo = diccionario.codigos.get(valor)
+                    valores[posicion] = codigo if codigo is not None else diccionario.codificar(valor)
+                else:
+                    extras[campo] = valor
+        if 'date' in registro:
+            presentes |= 1 << FECHA
+            ordinal = _fecha_a_ordinal(registro['date'])
+            if ordinal is None:
+                extras['date'] = registro['date']
+            else:
+                valores[FECHA] = ordinal
+        for posicion, campo in ((COUNT, 'count'), (TICKETS_, 'tickets'), (ID, 'id')):
+            if campo in registro:
+                presentes |= 1 << posicion
+                valor = registro[campo]
+                if type(valor) is int and -2 ** 63 <= valor < 2 ** 63:
+                    valores[posicion] = valor
+                else:
+                    extras[campo] = valor
+        if 'soles' in registro:
+            presentes |= 1 << SOLES_
+            if type(registro['soles']) is float:
+                valores[SOLES_] = registro['soles']
+            else:
+                extras['soles'] = registro['soles']
+        if 'timestamp' in registro:
+            presentes |= 1 << TIMESTAMP
+            microsegundos = _timestamp_a_us(registro['timestamp'])
+            if microsegundos is None:
+                extras['timestamp'] = registro['timestamp']
+            else:
+                valores[TIMESTAMP] = microsegundos
+        if len(registro) > bin(presentes).count('1'):
+            for campo, valor in registro.items():
+                if campo not in CAMPOS:
+                    extras[campo] = valor
+        if extras:
+            self._extras[fila] = extras
+        return valores, presentes
+
+    def _anexar(self, registros):
+        columnas = self._columnas
+        if columnas.usadas != self._filas:
+            # Otra tabla ya escribió detrás de nuestra última fila: copia propia
+            columnas = self._columnas = columnas.copiar(self._filas)
+            self._extras = {f: e for f, e in self._extras.items() if f < self._filas}
+        columnas.reservar(len(registros))
+        inicio = self._filas
+        codificados = [self._codificar(r, inicio + i) for i, r in enumerate(registros)]
+        fin = inicio + len(registros)
+        for posicion, campo in enumerate(CAMPOS):
+            columnas.arreglos[campo][inicio:fin] = [valores[posicion] for valores, _ in codificados]
+        columnas.arreglos['presentes'][inicio:fin] = [presentes for _, presentes in codificados]
+        columnas.usadas = self._filas = fin
+
+    def _derivar(self, columnas, filas, extras):
+        return TablaColumnar(columnas, filas, self.tiendas, self.sellers, self.rangos, extras)
+
+    def con_registro(self, registro):
+        """Tabla nueva con el registro anexado; esta tabla no cambia"""
+        tabla = self._derivar(self._columnas, self._filas, self._extras)
+        tabla._anexar([registro])
+        return tabla
+
+    def con_registros(self, registros):
+        tabla = self._derivar(self._columnas, self._filas, self._extras)
+        if registros:
+            tabla._anexar(list(registros))
+        return tabla
+
+    def sin_fila(self, fila):
+        """Tabla nueva sin la fila indicada"""
+        return self.sin_filas([fila])
+
+    def sin_filas(self, filas):
+        """Tabla nueva sin las filas indicadas; varias bajas cuestan una sola copia"""
+        quitar = np.unique(np.asarray(filas, dtype=np.int64))
+        restantes = self._filas - len(quitar)
+        columnas = _Columnas(restantes + 1)
+        for nombre, arreglo in self._columnas.arreglos.items():
+            columnas.arreglos[nombre][:restantes] = np.delete(arreglo[:self._filas], quitar)
+        columnas.usadas = restantes
+        quitadas = set(quitar.tolist())
+        # Cada fila con extras se corre tantas posiciones como filas se quitaron antes
+        extras = {f - int(np.searchsorted(quitar, f)): e for f, e in self._extras.items()
+                  if f < self._filas and f not in quitadas}
+        return self._derivar(columnas, restantes, extras)
+
+    # Volcado de columnas (formato binario)
+
+    def arreglos(self):
+        """{columna: arreglo} con las filas visibles, en el orden de TIPOS"""
+        return {nombre: self.columna(nombre) for nombre in TIPOS}
+
+    def extras(self):
+        """{fila: {campo: valor}} de los valores guardados fuera de columna"""
+        return {f: e for f, e in self._extras.items() if f < self._filas}
+
+    @classmethod
+    def desde_arreglos(cls, arreglos, tiendas, sellers, rangos, extras=None):
+        """Tabla a partir de lo que devuelven arreglos(), los diccionarios y extras()"""
+        filas = len(arreglos['presentes'])
+        columnas = _Columnas(filas)
+        for nombre, tipo in TIPOS.items():
+            columnas.arreglos[nombre][:filas] = np.asarray(arreglos[nombre]).astype(tipo, copy=False)
+        columnas.usadas = filas
+        return cls(columnas, filas, Diccionario(tiendas), Diccionario(sellers), Diccionario(rangos),
+                   dict(extras or {}))
+
+    # Secuencia de dicts
+
+    def __len__(self):
+        return self._filas
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [self._registro(i) for i in range(*indice.indices(self._filas))]
+        if indice < 0:
+            indice += self._filas
+        if not 0 <= indice < self._filas:
+            raise IndexError(indice)
+        return self._registro(indice)
+
+    def __iter__(self):
+        for inicio in range(0, self._filas, TAMANO_BLOQUE):
+            yield from self._bloque(inicio, min(inicio + TAMANO_BLOQUE, self._filas))
+
+    def _registro(self, fila):
+        return self._bloque(fila, fila + 1)[0]
+
+    def _bloque(self, inicio, fin):
+        """Materializar filas [inicio, fin) convirtiendo cada columna de una vez"""
+        return self._materializar(slice(inicio, fin), range(inicio, fin))
+
+    def filas(self, indices):
+        """Materializar las filas indicadas (arreglo o lista de posiciones), en ese orden"""
+        indices = np.asarray(indices, dtype=np.int64)
+        return self._materializar(indices, indices.tolist())
+
+    def _materializar(self, selector, numeros):
+        arreglos = self._columnas.arreglos
+        columnas = [arreglos[campo][:self._filas][selector].tolist() for campo in CAMPOS]
+        presentes = arreglos['presentes'][:self._filas][selector].tolist()
+        tiendas, sellers, rangos = self.tiendas.valores, self.sellers.valores, self.rangos.valores
+        registros = []
+        for desplazamiento, (fila, mascara) in enumerate(zip(numeros, presentes)):
+            extras = self._extras.get(fila)
+            registro = {}
+            for posicion, campo in enumerate(CAMPOS):
+                if not mascara & (1 << posicion):
+                    continue
+                if extras and campo in extras:
+                    registro[campo] = extras[campo]
+                    continue
+                valor = columnas[posicion][desplazamiento]
+                if posicion == TIENDA:
+                    valor = tiendas[valor]
+                elif posicion == SELLER:
+                    valor = sellers[valor]
+                elif posicion == RANGO:
+                    valor = rangos[valor]
+                elif posicion == FECHA:
+                    valor = _ordinal_a_fecha(valor)
+                elif posicion == TIMESTAMP:
+                    valor = _us_a_timestamp(valor)
+                registro[campo] = valor
+            if extras:
+                for campo, valor in extras.items():
+                    if campo not in registro:
+                        registro[campo] = valor
+            registros.append(registro)
+        return registros
+
+    # Consultas vectorizadas
+
+    def columna(self, campo):
+        """Vista de solo lectura de una columna (sin copiar)"""
+        vista = self._columnas.arreglos[campo][:self._filas]
+        vista.flags.writeable = False
+        return vista
+
+    def filas_con_extras(self):
+        return [f for f in self._extras if f < self._filas]
+
+    def mascara_tienda(self, tienda):
+        """Filas cuya 'tienda' es igual a la indicada (None = sin tienda)"""
+        if tienda is None:
+            mascara = self.columna('tienda') == -1
+        else:
+            codigo = self.tiendas.codigos.get(tienda) if isinstance(tienda, str) else None
+            mascara = self.columna('tienda') == codigo if codigo is not None else np.zeros(self._filas, dtype=bool)
+        # Filas con la tienda guardada aparte (valor no textual)
+        for fila in self.filas_con_extras():
+            if 'tienda' in self._extras[fila]:
+                mascara[fila] = self._extras[fila]['tienda'] == tienda
+        return mascara
+
+    def indices_tienda(self, tienda):
+        return np.flatnonzero(self.mascara_tienda(tienda))
+
+    def indices_historial(self, tienda, desde=None, hasta=None, vendedor=None):
+        """Posiciones de la tienda entre las fechas indicadas (date, inclusive), de la más
+        reciente a la más antigua; dentro de un mismo día, la última registrada primero"""
+        mascara = self.mascara_tienda(tienda)
+        especiales = [f for f in self.filas_con_extras() if mascara[f]]
+        mascara[especiales] = False
+        ordinales = self.columna('date')
+        if desde is not None:
+            mascara &= ordinales >= desde.toordinal()
+        if hasta is not None:
+            mascara &= ordinales <= hasta.toordinal()
+        if vendedor is not None:
+            codigos = self.columna('seller')
+            codigo = self.sellers.codigos.get(vendedor) if isinstance(vendedor, str) else None
+            del_vendedor = codigos == codigo if codigo is not None else np.zeros(self._filas, dtype=bool)
+            if vendedor == 'Desconocido':
+                # Registros sin vendedor, igual que en los agregados
+                del_vendedor |= codigos == -1
+            mascara &= del_vendedor
+        # Las filas con valores fuera de columna se evalúan una a una
+        for fila in especiales:
+            registro = self[fila]
+            fecha = _fecha_a_ordinal(registro.get('date'))
+            if (desde is not None or hasta is not None) and fecha is None:
+                continue
+            if desde is not None and fecha < desde.toordinal():
+                continue
+            if hasta is not None and fecha > hasta.toordinal():
+                continue
+            if vendedor is not None and registro.get('seller', 'Desconocido') != vendedor:
+                continue
+            mascara[fila] = True
+        indices = np.flatnonzero(mascara)
+        return indices[np.lexsort((-indices, -ordinales[indices].astype(np.int64)))]
+
+    def indices_periodo(self, desde=None, hasta=None):
+        """Posiciones de todas las tiendas entre las fechas indicadas (date, inclusive), en orden de registro"""
+        if desde is None and hasta is None:
+            return np.arange(self._filas)
+        ordinales = self.columna('date')
+        # Sin fecha o con una fecha no válida (guardada aparte) la columna vale -1: no entra
+        mascara = ordinales > 0
+        if desde is not None:
+            mascara &= ordinales >= desde.toordinal()
+        if hasta is not None:
+            mascara &= ordinales <= hasta.toordinal()
+        return np.flatnonzero(mascara)
+
+    def pagina_historial(self, tienda, desde=None, hasta=None, vendedor=None, inicio=0, cantidad=50):
+        """(total, [(id, registro)]); solo se materializan las filas de la página"""
+        indices = self.indices_historial(tienda, desde, hasta, vendedor)
+        visibles = indices[inicio:inicio + cantidad]
+        return len(indices), [(registro.get('id'), registro) for registro in self.filas(visibles)]
+
+    def posicion_id(self, id_registro):
+        """Posición de la fila con ese id, o None"""
+        if type(id_registro) is int and -2 ** 63 <= id_registro < 2 ** 63:
+            presentes = self.columna('presentes')
+            for fila in np.flatnonzero(self.columna('id') == id_registro).tolist():
+                # Las filas con el id guardado aparte tienen la columna en 0
+                if presentes[fila] & (1 << ID) and 'id' not in self._extras.get(fila, ()):
+                    return fila
+        for fila in self.filas_con_extras():
+            if 'id' in self._extras[fila] and self._extras[fila]['id'] == id_registro:
+                return fila
+        return None
+
+    def ids_presentes(self, ids):
+        """Los de ids que ya tiene alguna fila (una pasada por la columna, no una por id)"""
+        enteros = [i for i in ids if type(i) is int and -2 ** 63 <= i < 2 ** 63]
+        presentes = set()
+        if enteros and len(self):
+            con_id = (self.columna('presentes') & (1 << ID)) != 0
+            for fila in self.filas_con_extras():
+                # Como en posicion_id: las filas con el id guardado aparte tienen la columna en 0
+                if 'id' in self._extras[fila]:
+                    con_id[fila] = False
+            columna = self.columna('id')[con_id]
+            if len(enteros) <= 16:
+                # Pocos ids (la cola de una escritura): una comparación por id
+                presentes.update(i for i in enteros if (columna == i).any())
+            elif len(columna):
+                ordenada = np.sort(columna)
+                candidatos = np.array(enteros, dtype=np.int64)
+                posiciones = np.minimum(np.searchsorted(ordenada, candidatos), len(ordenada) - 1)
+                presentes.update(candidatos[ordenada[posiciones] == candidatos].tolist())
+        buscados = set(ids)
+        for fila in self.filas_con_extras():
+            extras = self._extras[fila]
+            if 'id' in extras and extras['id'] in buscados:
+                presentes.add(extras['id'])
+        return presentes
+
+    def filas_sin_id(self):
+        """Cuántas filas no tienen id"""
+        return int(np.count_nonzero((self.columna('presentes') & (1 << ID)) == 0))
+
+    def memoria_bytes(self):
+        """Bytes de los arreglos (incluida la reserva) más una estimación de los diccionarios"""
+        arreglos = sum(a.nbytes for a in self._columnas.arreglos.values())
+        cadenas = sum(len(v) + 50 for d in (self.tiendas, self.sellers, self.rangos) for v in d.valores)
+        return arreglos + cadenas + 200 * len(self._extras)
+
+
+def _a_globales(codigos, valores, diccionario, ausente):
+    """Códigos de un diccionario de la tabla → códigos del rollup; -1 (ausente) → ausente"""
+    mapa = np.array([diccionario.codificar(v) for v in valores] + [ausente], dtype=np.int64)
+    return mapa[codigos]
+
+
+def construir_agregados(tabla):
+    """Agregados de una tabla agrupando columnas con NumPy en vez de fila por fila"""
+    agregados = Agregados()
+    filas = len(tabla)
+    if not filas:
+        return agregados
+    # Las filas con valores fuera de columna se suman una a una al final
+    especiales = np.zeros(filas, dtype=bool)
+    especiales[tabla.filas_con_extras()] = True
+    normales = ~especiales
+    presentes = tabla.columna('presentes')[normales]
+
+    def codigos(campo, posicion):
+        # -1 marca el campo ausente (mismo default que registro.get)
+        valores = tabla.columna(campo)[normales].astype(np.int64)
+        return np.where(presentes & (1 << posicion), valores, -1)
+
+    def numerica(campo, posicion):
+        return np.where(presentes & (1 << posicion), tabla.columna(campo)[normales], 0)
+
+    valores = [
+        np.ones(len(presentes), dtype=np.int64),
+        numerica('count', COUNT).astype(np.int64),
+        numerica('tickets', TICKETS_).astype(np.int64),
+        np.round(numerica('soles', SOLES_) * 100).astype(np.int64),
+    ]
+    tienda = codigos('tienda', TIENDA)
+    seller = codigos('seller', SELLER)
+    fecha = codigos('date', FECHA)
+    rango = codigos('rango_horario', RANGO)
+
+    def nombre_tienda(c):
+        return tabla.tiendas.valores[c] if c >= 0 else None
+
+    def nombre_seller(c):
+        return tabla.sellers.valores[c] if c >= 0 else 'Desconocido'
+
+    def nombre_fecha(c):
+        return _ordinal_a_fecha(c) if c >= 0 else ''
+
+    def nombre_rango(c):
+        return tabla.rangos.valores[c] if c >= 0 else ''
+
+    def agrupar(claves):
+        """[(clave, [registros, clientes, tickets, céntimos])] en orden de primera aparición"""
+        combinada = np.zeros(len(presentes), dtype=np.int64)
+        for clave in claves:
+            combinada = combinada * (int(clave.max(initial=0)) + 2) + (clave + 1)
+        unicos, primeros, inversos = np.unique(combinada, return_index=True, return_inverse=True)
+        sumas = [np.bincount(inversos, weights=v, minlength=len(unicos)) for v in valores]
+        for g in np.argsort(primeros, kind='stable'):
+            fila = primeros[g]
+            yield [int(c[fila]) for c in claves], [int(round(s[g])) for s in sumas]
+
+    agregados.total = [int(v.sum()) for v in valores]
+    for (s,), acumulado in agrupar([seller]):
+        agregados.por_seller[nombre_seller(s)] = acumulado
+    for (t,), acumulado in agrupar([tienda]):
+        agregados.por_tienda[nombre_tienda(t)] = acumulado
+    for tabla_destino, clave, nombre in (
+        (agregados.por_tienda_seller, seller, nombre_seller),
+        (agregados.por_tienda_fecha, fecha, nombre_fecha),
+        (agregados.por_tienda_horario, rango, nombre_rango),
+    ):
+        for (t, c), acumulado in agrupar([tienda, clave]):
+            tabla_destino.setdefault(nombre_tienda(t), {})[nombre(c)] = acumulado
+
+    agregados.diario = rollup.Rollup.desde_codigos(
+        _a_globales(tienda, tabla.tiendas.valores, rollup.TIENDAS, 0),
+        np.maximum(fecha, 0),
+        _a_globales(rango, tabla.rangos.valores, rollup.RANGOS, 0),
+        _a_globales(seller, tabla.sellers.valores, rollup.VENDEDORES, rollup.VENDEDORES.codificar('Desconocido')),
+        valores,
+    )
+    for fila in np.flatnonzero(especiales):
+        agregados.agregar(tabla[int(fila)])
+    return agregados
@@ -0,0 +1,42 @@
+"""Registros sintéticos con la forma de los del formulario, para medir.
+
+Los usan los bancos de pruebas (rendimiento.py, clasificacion.py,
+formato_binario.py): N tiendas AL000..., M vendedores por tienda, los
+rangos horarios de RANGOS_HORARIO y D días desde PRIMER_DIA. La semilla es
+fija, así que dos ejecuciones generan los mismos registros (salvo el id).
+"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from modelo import RANGOS_HORARIO, nuevo_id
+
+PRIMER_DIA = date(2024, 1, 1)
+
+
+def registros_sinteticos(cantidad, tiendas=200, vendedores_por_tienda=8, dias=730):
+    """Generador de cantidad registros repartidos al azar entre tiendas, vendedores, rangos y días"""
+    azar = np.random.default_rng(0)
+    primer_dia = PRIMER_DIA.toordinal()
+    tienda = azar.integers(0, tiendas, cantidad)
+    vendedor = azar.integers(0, vendedores_por_tienda, cantidad)
+    rango = azar.integers(0, len(RANGOS_HORARIO), cantidad)
+    dia = azar.integers(0, dias, cantidad)
+    clientes = azar.integers(1, 30, cantidad)
+    tickets = azar.integers(0, 10, cantidad)
+    centimos = azar.integers(0, 500000, cantidad)
+    segundos = azar.integers(8 * 3600, 22 * 3600, cantidad)
+    for i in range(cantidad):
+        fecha = date.fromordinal(primer_dia + int(dia[i]))
+        yield {
+            'tienda': f"AL{tienda[i]:03d}",
+            'seller': f"VENDEDOR {tienda[i]:03d}-{vendedor[i]}",
+            'rango_horario': RANGOS_HORARIO[rango[i]],
+            'date': fecha.isoformat(),
+            'count': int(clientes[i]),
+            'tickets': int(tickets[i]),
+            'soles': int(centimos[i]) / 100,
+            'timestamp': (datetime.combine(fecha, datetime.min.time())
+                          + timedelta(seconds=int(segundos[i]), microseconds=int(centimos[i]))).isoformat(),
+            'id': nuevo_id(),
+        }
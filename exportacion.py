@@ -0,0 +1,324 @@
+"""Generación del reporte Excel de exportación.
+
+Sin dependencias de Streamlit: app.py decide cuándo generarlo y lo cachea por
+versión de datos. Con historiales grandes se usa el modo write-only de
+openpyxl, que escribe fila a fila sin construir un DataFrame ni mantener el
+libro completo en memoria.
+
+CSV y Parquet se generan como iteradores de bytes, un bloque de
+TAMANO_BLOQUE registros cada vez, con filtros opcionales de tienda y fechas:
+quien los consume (la descarga de la app, el servicio de ingesta) nunca
+tiene más de un bloque materializado. Parquet requiere pyarrow.
+"""
+import csv
+import io
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+from agregados import CLIENTES, REGISTROS, SOLES, TICKETS, a_soles, calcular_porcentaje
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_DISPONIBLE = True
+except ImportError:
+    PARQUET_DISPONIBLE = False
+
+COLUMNAS_REGISTROS = ['Tienda', 'Vendedor', 'Rango Horario', 'Fecha', 'Clientes', 'Tickets',
+                      'Soles (S/.)', 'Porcentaje', 'Timestamp']
+
+COLUMNAS_VENDEDORES = ['Vendedor', 'Registros', 'Clientes', 'Tickets', 'Soles (S/.)', 'Porcentaje']
+
+# A partir de cuántos registros se escribe en modo streaming
+UMBRAL_STREAMING = 50000
+# Filas de datos por hoja (Excel admite 1.048.576 filas contando el encabezado)
+FILAS_POR_HOJA = 1048575
+TAMANO_BLOQUE = 20000
+
+
+def fila_exportacion(record):
+    """Fila de la hoja Todos_Los_Registros para un registro"""
+    clientes = record.get('count', 0)
+    tickets = record.get('tickets', 0)
+    return {
+        'Tienda': record.get('tienda', 'N/A'),
+        'Vendedor': record.get('seller', 'N/A'),
+        'Rango Horario': record.get('rango_horario', 'N/A'),
+        'Fecha': record['date'],
+        'Clientes': clientes,
+        'Tickets': tickets,
+        'Soles (S/.)': record.get('soles', 0),
+        'Porcentaje': f"{calcular_porcentaje(tickets, clientes)}%",
+        'Timestamp': record.get('timestamp', 'N/A')
+    }
+
+
+def fila_estadisticas(stats_general):
+    """Única fila de la hoja Estadisticas_Generales"""
+    return {
+        'Total Clientes': stats_general['total_clients'],
+        'Total Tickets': stats_general['total_tickets'],
+        'Total Soles': stats_general['total_soles'],
+        'Total Registros': stats_general['total_records'],
+        'Vendedor Top': f"{stats_general['top_seller']['name']} ({stats_general['top_seller']['count']})",
+        'Tienda Top': f"{stats_general['top_tienda']['name']} ({stats_general['top_tienda']['count']})",
+        'Promedio Clientes/Día': stats_general['avg_per_day'],
+        'Promedio Tickets/Día': stats_general['avg_tickets_per_day'],
+        'Promedio Soles/Día': stats_general['avg_soles_per_day'],
+        'Porcentaje General': f"{stats_general['porcentaje_general']}%",
+        'Ticket Promedio': f"S/. {stats_general['ticket_promedio']:,.1f}"
+    }
+
+
+def fila_estadisticas_tienda(stats):
+    """Fila de estadísticas de una tienda (resultado de Agregados.stats_tienda)"""
+    return {
+        'Total Clientes': stats['total_clients'],
+        'Total Tickets': stats['total_tickets'],
+        'Total Soles': stats['total_soles'],
+        'Total Registros': stats['total_records'],
+        'Vendedor Top': f"{stats['top_seller']['name']} ({stats['top_seller']['count']})",
+        'Mejor Día': f"{stats['mejor_dia']['fecha']} ({stats['mejor_dia']['clientes']})",
+        'Horario Pico': f"{stats['horario_pico']['horario']} ({stats['horario_pico']['clientes']})",
+        'Promedio Clientes/Día': stats['avg_per_day'],
+        'Promedio Tickets/Día': stats['avg_tickets_per_day'],
+        'Promedio Soles/Día': stats['avg_soles_per_day'],
+        'Porcentaje General': f"{stats['porcentaje_general']}%",
+        'Ticket Promedio': f"S/. {stats['ticket_promedio']:,.1f}"
+    }
+
+
+def fila_vendedor(vendedor, acumulado):
+    """Fila del resumen por vendedor a partir de sus totales acumulados"""
+    return {
+        'Vendedor': vendedor,
+        'Registros': acumulado[REGISTROS],
+        'Clientes': acumulado[CLIENTES],
+        'Tickets': acumulado[TICKETS],
+        'Soles (S/.)': a_soles(acumulado[SOLES]),
+        'Porcentaje': f"{calcular_porcentaje(acumulado[TICKETS], acumulado[CLIENTES])}%"
+    }
+
+
+def orden_fecha_descendente(tabla):
+    """Posiciones de la tabla ordenadas de la fecha más reciente a la más antigua"""
+    ordinales = tabla.columna('date')
+    # Orden estable: dentro de una misma fecha se respeta el orden de registro
+    return np.argsort(-ordinales.astype(np.int64), kind='stable')
+
+
+def indices_exportacion(tabla, tienda=None, desde=None, hasta=None):
+    """Posiciones a exportar, de la fecha más reciente a la más antigua; sin tienda, todas"""
+    if tienda is not None:
+        return tabla.indices_historial(tienda, desde, hasta)
+    indices = tabla.indices_periodo(desde, hasta)
+    ordinales = tabla.columna('date')[indices]
+    return indices[np.argsort(-ordinales.astype(np.int64), kind='stable')]
+
+
+def _bloques(tabla, indices):
+    for inicio in range(0, len(indices), TAMANO_BLOQUE):
+        yield tabla.filas(indices[inicio:inicio + TAMANO_BLOQUE])
+
+
+def generar_csv(tabla, indices):
+    """Bytes del CSV (UTF-8 con BOM, para que Excel respete las tildes), bloque a bloque"""
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(COLUMNAS_REGISTROS)
+    yield salida.getvalue().encode('utf-8-sig')
+    for bloque in _bloques(tabla, indices):
+        salida.seek(0)
+        salida.truncate()
+        for registro in bloque:
+            fila = fila_exportacion(registro)
+            escritor.writerow([fila[c] for c in COLUMNAS_REGISTROS])
+        yield salida.getvalue().encode('utf-8')
+
+
+class _Sumidero(io.RawIOBase):
+    """Archivo de solo escritura que acumula lo escrito hasta que se vacía"""
+
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        datos = bytes(datos)
+        self.partes.append(datos)
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def vaciar(self):
+        datos = b''.join(self.partes)
+        self.partes = []
+        return datos
+
+
+def _esquema_parquet():
+    return pa.schema([
+        ('Tienda', pa.string()),
+        ('Vendedor', pa.string()),
+        ('Rango Horario', pa.string()),
+        ('Fecha', pa.date32()),
+        ('Clientes', pa.int64()),
+        ('Tickets', pa.int64()),
+        ('Soles (S/.)', pa.float64()),
+        ('Porcentaje', pa.int64()),
+        ('Timestamp', pa.string()),
+    ])
+
+
+def _texto(valor):
+    return None if valor is None else str(valor)
+
+
+def _entero(valor):
+    return valor if type(valor) is int else None
+
+
+def _fecha_parquet(valor):
+    try:
+        return date.fromisoformat(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _lote_parquet(bloque, esquema):
+    columnas = {c: [] for c in COLUMNAS_REGISTROS}
+    for registro in bloque:
+        clientes = registro.get('count', 0)
+        tickets = registro.get('tickets', 0)
+        columnas['Tienda'].append(_texto(registro.get('tienda', 'N/A')))
+        columnas['Vendedor'].append(_texto(registro.get('seller', 'N/A')))
+        columnas['Rango Horario'].append(_texto(registro.get('rango_horario', 'N/A')))
+        columnas['Fecha'].append(_fecha_parquet(registro.get('date')))
+        columnas['Clientes'].append(_entero(clientes))
+        columnas['Tickets'].append(_entero(tickets))
+        soles = registro.get('soles', 0)
+        columnas['Soles (S/.)'].append(float(soles) if type(soles) in (int, float) else None)
+        columnas['Porcentaje'].append(calcular_porcentaje(tickets, clientes))
+        columnas['Timestamp'].append(_texto(registro.get('timestamp', 'N/A')))
+    return pa.record_batch([pa.array(columnas[c], type=esquema.field(c).type) for c in COLUMNAS_REGISTROS],
+                           schema=esquema)
+
+
+def generar_parquet(tabla, indices):
+    """Bytes del archivo Parquet, un grupo de filas por bloque; columnas con tipo
+    (Fecha como fecha, importes como números) en lugar del texto del Excel"""
+    if not PARQUET_DISPONIBLE:
+        raise RuntimeError("La exportación a Parquet requiere pyarrow")
+    esquema = _esquema_parquet()
+    sumidero = _Sumidero()
+    with pq.ParquetWriter(sumidero, esquema, compression='snappy') as escritor:
+        for bloque in _bloques(tabla, indices):
+            escritor.write_batch(_lote_parquet(bloque, esquema), row_group_size=TAMANO_BLOQUE)
+            datos = sumidero.vaciar()
+            if datos:
+                yield datos
+    yield sumidero.vaciar()
+
+
+def generar_excel(registros, stats_general, df_tiendas, streaming=None):
+    """Bytes del libro con las hojas de registros, estadísticas y tiendas"""
+    if streaming is None:
+        streaming = len(registros) > UMBRAL_STREAMING
+    if streaming:
+        return _generar_excel_streaming(registros, stats_general, df_tiendas)
+
+    df_export = pd.DataFrame([fila_exportacion(r) for r in registros], columns=COLUMNAS_REGISTROS)
+    df_export['Fecha'] = pd.to_datetime(df_export['Fecha'])
+    df_export = df_export.sort_values('Fecha', ascending=False)
+
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        # Hoja 1: Todos los registros
+        df_export.to_excel(writer, index=False, sheet_name='Todos_Los_Registros')
+        # Hoja 2: Estadísticas generales
+        pd.DataFrame([fila_estadisticas(stats_general)]).to_excel(writer, index=False, sheet_name='Estadisticas_Generales')
+        # Hoja 3: Datos de tiendas y vendedores
+        df_tiendas.to_excel(writer, index=False, sheet_name='Tiendas_Vendedores')
+    return output.getvalue()
+
+
+def _encabezado(hoja, columnas):
+    # Mismo estilo de encabezado que usa pandas
+    borde = Side(style='thin')
+    celdas = []
+    for columna in columnas:
+        celda = WriteOnlyCell(hoja, value=columna)
+        celda.font = Font(bold=True)
+        celda.border = Border(left=borde, right=borde, top=borde, bottom=borde)
+        celda.alignment = Alignment(horizontal='center', vertical='top')
+        celdas.append(celda)
+    hoja.append(celdas)
+
+
+def _fecha_excel(valor):
+    try:
+        return datetime.fromisoformat(valor)
+    except (TypeError, ValueError):
+        return valor
+
+
+def _hojas_registros(libro, bloques, nombre='Todos_Los_Registros'):
+    """Hojas de registros a partir de bloques ya ordenados; pasado FILAS_POR_HOJA se abre otra"""
+    hoja = None
+    escritas = 0
+    for bloque in bloques:
+        for registro in bloque:
+            if escritas % FILAS_POR_HOJA == 0:
+                # Más filas de las que caben en una hoja: se continúa en otra
+                parte = escritas // FILAS_POR_HOJA
+                hoja = libro.create_sheet(nombre + (f'_{parte + 1}' if parte else ''))
+                _encabezado(hoja, COLUMNAS_REGISTROS)
+            fila = fila_exportacion(registro)
+            fila['Fecha'] = _fecha_excel(fila['Fecha'])
+            hoja.append([fila[c] for c in COLUMNAS_REGISTROS])
+            escritas += 1
+    if hoja is None:
+        _encabezado(libro.create_sheet(nombre), COLUMNAS_REGISTROS)
+
+
+def _hoja(libro, nombre, columnas, filas):
+    hoja = libro.create_sheet(nombre)
+    _encabezado(hoja, [str(c) for c in columnas])
+    for fila in filas:
+        hoja.append(list(fila))
+
+
+def _generar_excel_streaming(tabla, stats_general, df_tiendas):
+    libro = Workbook(write_only=True)
+    _hojas_registros(libro, _bloques(tabla, orden_fecha_descendente(tabla)))
+    estadisticas = fila_estadisticas(stats_general)
+    _hoja(libro, 'Estadisticas_Generales', list(estadisticas), [estadisticas.values()])
+    _hoja(libro, 'Tiendas_Vendedores', df_tiendas.columns, df_tiendas.itertuples(index=False))
+    output = io.BytesIO()
+    libro.save(output)
+    return output.getvalue()
+
+
+def generar_libro_tienda(registros, stats_tienda, vendedores):
+    """Bytes del libro de una tienda: sus registros (ya ordenados), sus estadísticas y el
+    desglose por vendedor ({vendedor: [registros, clientes, tickets, céntimos]})"""
+    libro = Workbook(write_only=True)
+    _hojas_registros(libro, [registros], 'Registros')
+    estadisticas = fila_estadisticas_tienda(stats_tienda)
+    _hoja(libro, 'Estadisticas', list(estadisticas), [estadisticas.values()])
+    _hoja(libro, 'Vendedores', COLUMNAS_VENDEDORES,
+          ([fila[c] for c in COLUMNAS_VENDEDORES]
+           for fila in (fila_vendedor(v, a) for v, a in vendedores.items())))
+    output = io.BytesIO()
+    libro.save(output)
+    return output.getvalue()
@@ -0,0 +1,201 @@
+"""Formato binario compacto para el historial de registros.
+
+Vuelca las columnas de una TablaColumnar tal cual: tienda, seller y
+rango_horario como códigos de un diccionario de cadenas, la fecha como
+ordinal y el timestamp en microsegundos. Cada columna entera se guarda con
+el tipo más pequeño que admite sus valores. Cargar es leer unos pocos
+arreglos contiguos en lugar de decodificar millones de objetos JSON, y los
+valores que no caben en columna (extras) viajan aparte, así que la
+conversión desde y hacia JSON es sin pérdida.
+
+Estructura del archivo:
+    MAGIA (8 bytes) | largo del encabezado (uint32 LE) | encabezado JSON
+    | relleno hasta múltiplo de 8 | columnas, una tras otra, cada una
+    alineada a 8 bytes
+
+    python formato_binario.py convertir registros.json registros.vcol
+    python formato_binario.py medir --registros 1000000
+"""
+import argparse
+import json
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+from columnar import TablaColumnar
+
+MAGIA = b'VIALECOL'
+VERSION_FORMATO = 1
+EXTENSION = '.vcol'
+_ENTEROS = (np.int8, np.int16, np.int32, np.int64)
+
+
+def _tipo_minimo(arreglo):
+    """El tipo entero más pequeño que conserva todos los valores del arreglo"""
+    if arreglo.dtype.kind not in 'iu' or not len(arreglo):
+        return arreglo.dtype
+    minimo, maximo = int(arreglo.min()), int(arreglo.max())
+    for tipo in _ENTEROS:
+        limites = np.iinfo(tipo)
+        if limites.min <= minimo and maximo <= limites.max:
+            return np.dtype(tipo)
+    return arreglo.dtype
+
+
+def _relleno(posicion):
+    return b'\0' * (-posicion % 8)
+
+
+def escribir_tabla(f, tabla, metadatos=None):
+    """Volcar la tabla en un archivo binario abierto; metadatos va al encabezado"""
+    arreglos = {}
+    columnas = []
+    for nombre, arreglo in tabla.arreglos().items():
+        tipo = _tipo_minimo(arreglo).newbyteorder('<')
+        arreglos[nombre] = np.ascontiguousarray(arreglo, dtype=tipo)
+        columnas.append([nombre, tipo.str])
+    encabezado = json.dumps({
+        'version': VERSION_FORMATO,
+        'filas': len(tabla),
+        'columnas': columnas,
+        'tiendas': tabla.tiendas.valores,
+        'sellers': tabla.sellers.valores,
+        'rangos': tabla.rangos.valores,
+        'extras': [[fila, extras] for fila, extras in sorted(tabla.extras().items())],
+        'metadatos': metadatos or {},
+    }, ensure_ascii=False, default=str).encode('utf-8')
+    f.write(MAGIA + struct.pack('<I', len(encabezado)) + encabezado)
+    f.write(_relleno(len(MAGIA) + 4 + len(encabezado)))
+    for nombre, _ in columnas:
+        datos = arreglos[nombre].tobytes()
+        f.write(datos + _relleno(len(datos)))
+
+
+def _encabezado(contenido):
+    """(encabezado, posición de la primera columna)"""
+    if contenido[:len(MAGIA)] != MAGIA:
+        raise ValueError("No es un archivo de registros en formato binario")
+    largo, = struct.unpack_from('<I', contenido, len(MAGIA))
+    inicio = len(MAGIA) + 4
+    encabezado = json.loads(contenido[inicio:inicio + largo].decode('utf-8'))
+    if encabezado['version'] > VERSION_FORMATO:
+        raise ValueError(f"Versión de formato binario no soportada: {encabezado['version']}")
+    posicion = inicio + largo
+    return encabezado, posicion + (-posicion % 8)
+
+
+def leer_encabezado(f):
+    """Encabezado (filas, diccionarios, metadatos...) sin leer las columnas"""
+    inicio = f.read(len(MAGIA) + 4)
+    if len(inicio) < len(MAGIA) + 4:
+        raise ValueError("No es un archivo de registros en formato binario")
+    largo, = struct.unpack_from('<I', inicio, len(MAGIA))
+    return _encabezado(inicio + f.read(largo))[0]
+
+
+def leer_tabla(f):
+    """(tabla, metadatos) desde un archivo binario abierto"""
+    contenido = f.read()
+    encabezado, posicion = _encabezado(contenido)
+    filas = encabezado['filas']
+    arreglos = {}
+    for nombre, tipo in encabezado['columnas']:
+        tipo = np.dtype(tipo)
+        arreglos[nombre] = np.frombuffer(contenido, dtype=tipo, count=filas, offset=posicion)
+        posicion += filas * tipo.itemsize
+        posicion += -posicion % 8
+    tabla = TablaColumnar.desde_arreglos(arreglos, encabezado['tiendas'], encabezado['sellers'],
+                                         encabezado['rangos'], {fila: extras for fila, extras in encabezado['extras']})
+    return tabla, encabezado['metadatos']
+
+
+def guardar(ruta, tabla, metadatos=None):
+    """Escribir la tabla en ruta de forma atómica"""
+    from almacenamiento import escribir_atomico
+    escribir_atomico(ruta, lambda f: escribir_tabla(f, tabla, metadatos), modo='wb')
+
+
+def cargar(ruta):
+    """(tabla, metadatos) de un archivo binario"""
+    with open(ruta, 'rb') as f:
+        return leer_tabla(f)
+
+
+def convertir(origen, destino):
+    """JSON (lista o JSON Lines) ↔ binario según las extensiones; devuelve cuántos registros"""
+    if origen.endswith(EXTENSION):
+        tabla, _ = cargar(origen)
+        registros = list(tabla)
+        with open(destino, 'w', encoding='utf-8') as f:
+            if destino.endswith('.jsonl'):
+                f.writelines(json.dumps(r, ensure_ascii=False, default=str) + '\n' for r in registros)
+            else:
+                json.dump(registros, f, ensure_ascii=False, indent=2, default=str)
+        return len(registros)
+    with open(origen, 'r', encoding='utf-8') as f:
+        if origen.endswith('.jsonl'):
+            registros = [json.loads(linea) for linea in f if linea.strip()]
+        else:
+            registros = json.load(f)
+    tabla = TablaColumnar.desde_registros(registros)
+    guardar(destino, tabla)
+    return len(tabla)
+
+
+def medir(cantidad):
+    """{formato: (bytes, segundos de carga)} para JSON, JSON Lines y binario"""
+    from datos_sinteticos import registros_sinteticos
+
+    tabla = TablaColumnar.desde_registros(registros_sinteticos(cantidad))
+    resultados = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, 'registros')
+        with open(ruta + '.json', 'w', encoding='utf-8') as f:
+            json.dump(list(tabla), f, ensure_ascii=False, indent=2, default=str)
+        with open(ruta + '.jsonl', 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(r, ensure_ascii=False, default=str) + '\n' for r in tabla)
+        guardar(ruta + EXTENSION, tabla)
+
+        def carga_json():
+            with open(ruta + '.json', 'r', encoding='utf-8') as f:
+                return TablaColumnar.desde_registros(json.load(f))
+
+        def carga_jsonl():
+            with open(ruta + '.jsonl', 'r', encoding='utf-8') as f:
+                return TablaColumnar.desde_registros(json.loads(linea) for linea in f)
+
+        def carga_binaria():
+            return cargar(ruta + EXTENSION)[0]
+
+        for formato, extension, carga in (('json', '.json', carga_json), ('jsonl', '.jsonl', carga_jsonl),
+                                          ('binario', EXTENSION, carga_binaria)):
+            inicio = time.perf_counter()
+            cargada = carga()
+            segundos = time.perf_counter() - inicio
+            if formato == 'binario' and not all(a == b for a, b in zip(cargada, tabla)):
+                raise AssertionError("La tabla binaria no coincide con la original")
+            resultados[formato] = (os.path.getsize(ruta + extension), segundos)
+    return resultados
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Formato binario compacto de registros")
+    ordenes = parser.add_subparsers(dest='orden', required=True)
+    conversion = ordenes.add_parser('convertir', help="JSON/JSON Lines ↔ binario según la extensión")
+    conversion.add_argument('origen')
+    conversion.add_argument('destino')
+    medicion = ordenes.add_parser('medir', help="tamaño y tiempo de carga frente a JSON")
+    medicion.add_argument('--registros', type=int, default=1000000)
+    opciones = parser.parse_args(argumentos)
+    if opciones.orden == 'convertir':
+        print(f"{convertir(opciones.origen, opciones.destino)} registros convertidos")
+    else:
+        for formato, (tamano, segundos) in medir(opciones.registros).items():
+            print(f"{formato:8} {tamano / 2 ** 20:9.1f} MiB   carga {segundos:7.2f} s")
+
+
+if __name__ == '__main__':
+    main()
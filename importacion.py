@@ -0,0 +1,247 @@
+"""Importación masiva de conteos históricos desde CSV o Excel.
+
+La validación trabaja por columnas completas con pandas: el catálogo de
+tiendas y vendedores, los rangos horarios, la fecha y los campos numéricos
+se comprueban sin recorrer las filas una a una. Las filas válidas se
+convierten en registros listos para AlmacenBase.agregar_lote.
+
+validar_registro aplica las mismas reglas a un único registro recibido como
+dict (el servicio de ingesta HTTP), sin pasar por pandas.
+"""
+import io
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from modelo import RANGOS_HORARIO, nuevo_id
+
+# Nombres aceptados para cada campo (en minúsculas): los del reporte Excel y los del registro
+ALIAS = {
+    'tienda': ['tienda'],
+    'seller': ['vendedor', 'seller'],
+    'rango_horario': ['rango horario', 'rango_horario', 'horario'],
+    'date': ['fecha', 'date'],
+    'count': ['clientes', 'count'],
+    'tickets': ['tickets'],
+    'soles': ['soles (s/.)', 'soles'],
+}
+OBLIGATORIOS = ['tienda', 'seller', 'rango_horario', 'date', 'count']
+# Fila del archivo donde empiezan los datos (la 1 es el encabezado)
+PRIMERA_FILA = 2
+
+
+def leer_archivo(contenido, nombre):
+    """DataFrame con el contenido de un CSV o xlsx subido"""
+    if nombre.lower().endswith(('.xlsx', '.xls')):
+        return pd.read_excel(io.BytesIO(contenido), dtype=object)
+    df = pd.read_csv(io.BytesIO(contenido), dtype=str, keep_default_na=False)
+    if len(df.columns) == 1 and ';' in str(df.columns[0]):
+        # CSV de Excel en configuración regional española
+        df = pd.read_csv(io.BytesIO(contenido), dtype=str, keep_default_na=False, sep=';')
+    return df
+
+
+def normalizar_columnas(df):
+    """Renombrar las columnas a los campos del registro; falla si falta alguna obligatoria"""
+    por_nombre = {str(c).strip().lower(): c for c in df.columns}
+    columnas = {}
+    for campo, alias in ALIAS.items():
+        for nombre in alias:
+            if nombre in por_nombre:
+                columnas[campo] = por_nombre[nombre]
+                break
+    faltantes = [ALIAS[c][0].title() for c in OBLIGATORIOS if c not in columnas]
+    if faltantes:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(faltantes)}")
+    return pd.DataFrame({campo: df[columna] for campo, columna in columnas.items()})
+
+
+def _texto(serie):
+    return serie.astype(object).where(serie.notna(), '').astype(str).str.strip()
+
+
+def _opcional(serie):
+    """Celdas vacías de una columna opcional como 0"""
+    vacia = serie.isna() | serie.astype(str).str.strip().eq('')
+    return serie.where(~vacia, 0)
+
+
+def _fechas(serie):
+    """Fechas ISO (AAAA-MM-DD) o dd/mm/aaaa; celdas de fecha de Excel tal cual"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.normalize()
+    texto = _texto(serie)
+    fechas = pd.to_datetime(texto, format='%Y-%m-%d', errors='coerce')
+    fechas = fechas.fillna(pd.to_datetime(texto, format='%d/%m/%Y', errors='coerce'))
+    # Lo que no es texto (celdas de fecha de Excel) se convierte directamente
+    otras = ~serie.map(type).eq(str)
+    if otras.any():
+        fechas[otras] = pd.to_datetime(serie[otras], errors='coerce')
+    return fechas.dt.normalize()
+
+
+def _canonicos(serie, catalogo, *claves_previas):
+    """(valores del catálogo, encontrados): busca cada fila, con las columnas previas
+    como parte de la clave, comparando sin espacios sobrantes"""
+    encontrados = np.zeros(len(serie), dtype=bool)
+    if not catalogo:
+        return serie, encontrados
+    normalizado = pd.MultiIndex.from_arrays([
+        pd.Series([str(fila[i]).strip() for fila in catalogo], dtype=object) for i in range(len(catalogo[0]))
+    ])
+    unicos = ~normalizado.duplicated()
+    posiciones = normalizado[unicos].get_indexer(pd.MultiIndex.from_arrays([*claves_previas, serie]))
+    encontrados = posiciones >= 0
+    originales = np.array([fila[-1] for fila in catalogo], dtype=object)[unicos]
+    return serie.where(~encontrados, pd.Series(originales[posiciones], index=serie.index)), encontrados
+
+
+def _enteros(serie, minimo):
+    numeros = pd.to_numeric(serie, errors='coerce')
+    valido = numeros.notna() & (numeros >= minimo) & (numeros % 1 == 0)
+    return numeros, valido
+
+
+def validar(df, catalogo):
+    """(válidas, errores): válidas con las columnas del registro ya convertidas;
+    errores con la fila del archivo, los datos originales y el motivo"""
+    datos = normalizar_columnas(df)
+    if 'tickets' not in datos:
+        datos['tickets'] = 0
+    if 'soles' not in datos:
+        datos['soles'] = 0
+    tienda = _texto(datos['tienda'])
+    seller = _texto(datos['seller'])
+    rango = _texto(datos['rango_horario'])
+    fecha = _fechas(datos['date'])
+    clientes, clientes_ok = _enteros(datos['count'], 1)
+    tickets, tickets_ok = _enteros(_opcional(datos['tickets']), 0)
+    soles = pd.to_numeric(_opcional(datos['soles']), errors='coerce')
+    soles_ok = soles.notna() & (soles >= 0) & np.isfinite(soles)
+
+    # El catálogo se compara sin espacios sobrantes, pero se guarda el nombre tal como
+    # figura en Asesores.xlsx (el mismo que ofrece el formulario)
+    tienda, tienda_ok = _canonicos(tienda, [[t] for t in catalogo.por_tienda])
+    pares = [[t, v] for t, vendedores in catalogo.por_tienda.items() for v in vendedores]
+    seller, seller_ok = _canonicos(seller, pares, tienda)
+
+    chequeos = [
+        (tienda_ok, "tienda no existe en Asesores.xlsx"),
+        (~tienda_ok | seller_ok, "vendedor no pertenece a la tienda"),
+        (rango.isin(RANGOS_HORARIO), "rango horario inválido"),
+        (fecha.notna(), "fecha inválida"),
+        (clientes_ok, "clientes debe ser un entero mayor o igual a 1"),
+        (tickets_ok, "tickets debe ser un entero mayor o igual a 0"),
+        (soles_ok, "soles debe ser un número mayor o igual a 0"),
+    ]
+    motivos = pd.Series('', index=datos.index)
+    for valido, motivo in chequeos:
+        valido = np.asarray(valido, dtype=bool)
+        motivos = motivos.where(valido, motivos + np.where(motivos.eq(''), '', '; ') + motivo)
+    aceptadas = motivos.eq('')
+
+    validas = pd.DataFrame({
+        'tienda': tienda,
+        'seller': seller,
+        'rango_horario': rango,
+        'date': fecha.dt.strftime('%Y-%m-%d'),
+        'count': clientes,
+        'tickets': tickets,
+        'soles': soles,
+    })[aceptadas]
+    validas = validas.astype({'count': 'int64', 'tickets': 'int64', 'soles': 'float64'})
+
+    errores = df[~aceptadas].copy()
+    errores.insert(0, 'Fila', errores.index + PRIMERA_FILA)
+    errores['Error'] = motivos[~aceptadas]
+    return validas, errores
+
+
+def _fecha_texto(valor):
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(str(valor).strip(), formato).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    return None
+
+
+def _numero(valor, minimo, entero):
+    """El valor como int/float si cumple el mínimo (y es entero si se pide); si no, None"""
+    if valor is None or valor == '':
+        valor = 0
+    if isinstance(valor, bool):
+        return None
+    if isinstance(valor, str):
+        try:
+            valor = float(valor.strip())
+        except ValueError:
+            return None
+    if not isinstance(valor, (int, float)) or valor != valor or valor in (float('inf'), float('-inf')):
+        return None
+    if valor < minimo or (entero and valor % 1 != 0):
+        return None
+    return int(valor) if entero else float(valor)
+
+
+def validar_registro(datos, catalogo):
+    """(registro, errores): registro con los campos ya convertidos (None si hay
+    errores) y la lista de motivos, los mismos que da validar"""
+    if not isinstance(datos, dict):
+        return None, ["el registro debe ser un objeto JSON"]
+    por_nombre = {str(c).strip().lower(): v for c, v in datos.items()}
+    valores = {}
+    for campo, alias in ALIAS.items():
+        for nombre in alias:
+            if nombre in por_nombre:
+                valores[campo] = por_nombre[nombre]
+                break
+    faltantes = [ALIAS[c][0].title() for c in OBLIGATORIOS if valores.get(c) in (None, '')]
+    if faltantes:
+        return None, [f"Faltan campos obligatorios: {', '.join(faltantes)}"]
+
+    errores = []
+    tienda = catalogo.tiendas_normalizadas.get(str(valores['tienda']).strip())
+    seller = None
+    if tienda is None:
+        errores.append("tienda no existe en Asesores.xlsx")
+    else:
+        seller = catalogo.vendedores_normalizados.get((str(tienda).strip(), str(valores['seller']).strip()))
+        if seller is None:
+            errores.append("vendedor no pertenece a la tienda")
+    rango = str(valores['rango_horario']).strip()
+    if rango not in RANGOS_HORARIO:
+        errores.append("rango horario inválido")
+    fecha = _fecha_texto(valores['date'])
+    if fecha is None:
+        errores.append("fecha inválida")
+    clientes = _numero(valores['count'], 1, entero=True)
+    if clientes is None:
+        errores.append("clientes debe ser un entero mayor o igual a 1")
+    tickets = _numero(valores.get('tickets'), 0, entero=True)
+    if tickets is None:
+        errores.append("tickets debe ser un entero mayor o igual a 0")
+    soles = _numero(valores.get('soles'), 0, entero=False)
+    if soles is None:
+        errores.append("soles debe ser un número mayor o igual a 0")
+    if errores:
+        return None, errores
+    return {
+        'tienda': tienda,
+        'seller': seller,
+        'rango_horario': rango,
+        'date': fecha,
+        'count': clientes,
+        'tickets': tickets,
+        'soles': soles,
+    }, []
+
+
+def a_registros(validas):
+    """Registros con id y timestamp propios, en el orden del archivo"""
+    momento = datetime.now().isoformat()
+    campos = list(validas.columns)
+    # tolist() entrega tipos nativos de Python, como los del formulario
+    columnas = [validas[campo].tolist() for campo in campos]
+    return [dict(zip(campos, valores), timestamp=momento, id=nuevo_id()) for valores in zip(*columnas)]
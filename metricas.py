@@ -0,0 +1,190 @@
+"""Tramos de tiempo de las operaciones caras de la app.
+
+No depende de Streamlit. Cada tramo mide la duración, los registros que
+procesó y los bytes que leyó y escribió su hilo (en Linux, de
+/proc/self/task/<tid>/io; en otros sistemas solo los que indique quien lo
+abre):
+
+    with metricas.tramo('cargar_registros') as datos:
+        ...
+        datos['registros'] = len(tabla)
+
+Las muestras se guardan en una ventana móvil (VIALE_VENTANA_METRICAS
+segundos, y como mucho MAXIMO_MUESTRAS por tramo) de la que salen p50 y p95.
+Cada VIALE_INTERVALO_METRICAS segundos se reescribe el archivo
+VIALE_ARCHIVO_METRICAS en formato de texto de Prometheus, o en JSON si
+termina en .json. Con VIALE_ARCHIVO_METRICAS vacío no se escribe nada.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+VENTANA_METRICAS = float(os.environ.get("VIALE_VENTANA_METRICAS", "900"))
+INTERVALO_METRICAS = float(os.environ.get("VIALE_INTERVALO_METRICAS", "10"))
+ARCHIVO_METRICAS = os.environ.get(
+    "VIALE_ARCHIVO_METRICAS",
+    os.path.join(os.environ.get("VIALE_DIRECTORIO_DATOS", "./datos_persistentes"), "metricas.prom"))
+MAXIMO_MUESTRAS = 1000
+
+# Posiciones de cada muestra
+_MOMENTO, _SEGUNDOS, _REGISTROS, _LEIDOS, _ESCRITOS, _ERROR = range(6)
+
+
+def _io_hilo(contar_lectura=False):
+    """(bytes leídos, bytes escritos) acumulados del hilo actual; None si no se puede saber.
+    El kernel suma esta misma lectura después de generarla: con contar_lectura ya se incluye."""
+    try:
+        with open(f"/proc/self/task/{threading.get_native_id()}/io", 'rb') as f:
+            contenido = f.read()
+        campos = dict(linea.split(b':') for linea in contenido.splitlines()[:2])
+        return int(campos[b'rchar']) + (len(contenido) if contar_lectura else 0), int(campos[b'wchar'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _percentil(ordenados, fraccion):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, max(0, int(round(fraccion * len(ordenados))) - 1))]
+
+
+class Metricas:
+    """Muestras por tramo en una ventana móvil, más contadores desde el arranque"""
+
+    def __init__(self, ventana=VENTANA_METRICAS, ruta=ARCHIVO_METRICAS, intervalo=INTERVALO_METRICAS):
+        self.ventana = ventana
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self._muestras = {}
+        self._totales = {}
+        self._cerrojo = threading.Lock()
+        self._ultima_escritura = 0.0
+
+    @contextmanager
+    def tramo(self, nombre):
+        """Medir el bloque; quien lo abre puede poner 'registros', 'bytes_leidos' y
+        'bytes_escritos' en el dict que recibe (los bytes sustituyen a los del hilo)"""
+        datos = {}
+        io_antes = _io_hilo(contar_lectura=True)
+        inicio = time.perf_counter()
+        error = False
+        try:
+            yield datos
+        except BaseException:
+            error = True
+            raise
+        finally:
+            segundos = time.perf_counter() - inicio
+            io_despues = _io_hilo() if io_antes is not None else None
+            leidos, escritos = ((io_despues[0] - io_antes[0], io_despues[1] - io_antes[1])
+                                if io_despues is not None else (0, 0))
+            self.registrar(nombre, segundos, datos.get('registros'),
+                           datos.get('bytes_leidos', leidos), datos.get('bytes_escritos', escritos), error)
+
+    def registrar(self, nombre, segundos, registros=None, bytes_leidos=0, bytes_escritos=0, error=False):
+        ahora = time.time()
+        with self._cerrojo:
+            muestras = self._muestras.get(nombre)
+            if muestras is None:
+                muestras = self._muestras[nombre] = deque(maxlen=MAXIMO_MUESTRAS)
+                self._totales[nombre] = [0, 0.0, 0, 0, 0]
+            muestras.append((ahora, segundos, registros, bytes_leidos, bytes_escritos, error))
+            totales = self._totales[nombre]
+            totales[0] += 1
+            totales[1] += segundos
+            totales[2] += bytes_leidos
+            totales[3] += bytes_escritos
+            totales[4] += error
+            escribir = self.ruta and ahora - self._ultima_escritura >= self.intervalo
+            if escribir:
+                self._ultima_escritura = ahora
+        if escribir:
+            self.escribir()
+
+    def resumen(self):
+        """{tramo: p50/p95/máximo en ms, muestras, últimos registros y bytes} de la ventana"""
+        limite = time.time() - self.ventana
+        with self._cerrojo:
+            copias = {}
+            for nombre, muestras in self._muestras.items():
+                while muestras and muestras[0][_MOMENTO] < limite:
+                    muestras.popleft()
+                copias[nombre] = (list(muestras), list(self._totales[nombre]))
+        resumen = {}
+        for nombre, (recientes, totales) in copias.items():
+            duraciones = sorted(m[_SEGUNDOS] * 1000 for m in recientes)
+            ultima = recientes[-1] if recientes else None
+            resumen[nombre] = {
+                'muestras': len(recientes),
+                'p50_ms': round(_percentil(duraciones, 0.5), 3),
+                'p95_ms': round(_percentil(duraciones, 0.95), 3),
+                'max_ms': round(duraciones[-1], 3) if duraciones else 0.0,
+                'registros': ultima[_REGISTROS] if ultima else None,
+                'bytes_leidos': ultima[_LEIDOS] if ultima else 0,
+                'bytes_escritos': ultima[_ESCRITOS] if ultima else 0,
+                'errores': sum(m[_ERROR] for m in recientes),
+                'total_llamadas': totales[0],
+                'total_segundos': round(totales[1], 6),
+                'total_bytes_leidos': totales[2],
+                'total_bytes_escritos': totales[3],
+                'total_errores': totales[4],
+            }
+        return resumen
+
+    def texto_prometheus(self):
+        """Resumen en el formato de texto de exposición de Prometheus"""
+        resumen = self.resumen()
+        lineas = [
+            f"# HELP viale_tramo_segundos Duración de cada tramo (cuantiles de los últimos {self.ventana:.0f} s)",
+            "# TYPE viale_tramo_segundos summary",
+        ]
+        for nombre, datos in resumen.items():
+            etiqueta = f'tramo="{nombre}"'
+            lineas += [
+                f'viale_tramo_segundos{{{etiqueta},quantile="0.5"}} {datos["p50_ms"] / 1000:.6f}',
+                f'viale_tramo_segundos{{{etiqueta},quantile="0.95"}} {datos["p95_ms"] / 1000:.6f}',
+                f'viale_tramo_segundos_sum{{{etiqueta}}} {datos["total_segundos"]:.6f}',
+                f'viale_tramo_segundos_count{{{etiqueta}}} {datos["total_llamadas"]}',
+            ]
+        for metrica, tipo, ayuda, campo in (
+            ('viale_tramo_registros', 'gauge', "Registros procesados en la última llamada", 'registros'),
+            ('viale_tramo_bytes_leidos_total', 'counter', "Bytes leídos desde el arranque", 'total_bytes_leidos'),
+            ('viale_tramo_bytes_escritos_total', 'counter', "Bytes escritos desde el arranque", 'total_bytes_escritos'),
+            ('viale_tramo_errores_total', 'counter', "Llamadas que terminaron con excepción", 'total_errores'),
+        ):
+            lineas += [f"# HELP {metrica} {ayuda}", f"# TYPE {metrica} {tipo}"]
+            lineas += [f'{metrica}{{tramo="{nombre}"}} {datos[campo]}'
+                       for nombre, datos in resumen.items() if datos[campo] is not None]
+        return '\n'.join(lineas) + '\n'
+
+    def escribir(self, ruta=None):
+        """Reescribir el archivo de métricas de forma atómica (JSON si la ruta termina en .json)"""
+        ruta = ruta or self.ruta
+        if ruta.endswith('.json'):
+            contenido = json.dumps({'momento': time.time(), 'ventana_s': self.ventana, 'tramos': self.resumen()},
+                                   ensure_ascii=False, indent=2)
+        else:
+            contenido = self.texto_prometheus()
+        directorio = os.path.dirname(ruta) or '.'
+        temporal = None
+        try:
+            os.makedirs(directorio, exist_ok=True)
+            fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(contenido)
+            os.replace(temporal, ruta)
+        except OSError as e:
+            if temporal and os.path.exists(temporal):
+                os.remove(temporal)
+            print(f"No se pudieron escribir las métricas en {ruta}: {e}", file=sys.stderr)
+
+
+# Una sola instancia por proceso, compartida por todas las sesiones
+METRICAS = Metricas()
+tramo = METRICAS.tramo
@@ -0,0 +1,37 @@
+"""Esquema de un registro de clientes, compartido por todos los módulos."""
+import secrets
+import threading
+import time
+
+# Lista de rangos de horario
+RANGOS_HORARIO = [
+    "10 a.m - 11 a.m",
+    "11 a.m - 12 p.m",
+    "12 p.m - 1 p.m",
+    "1 p.m - 2 p.m",
+    "2 p.m - 3 p.m",
+    "3 p.m - 4 p.m",
+    "4 p.m - 5 p.m",
+    "5 p.m - 6 p.m",
+    "6 p.m - 7 p.m",
+    "7 p.m - 8 p.m",
+    "8 p.m - 9 p.m",
+    "9 p.m - 10 p.m"
+]
+
+# Columnas conocidas de un registro (en el orden del formulario, más su id)
+CAMPOS = ['tienda', 'seller', 'rango_horario', 'date', 'count', 'tickets', 'soles', 'timestamp', 'id']
+
+_cerrojo_id = threading.Lock()
+_ultimo_id = 0
+
+
+def nuevo_id():
+    """Id estable de un registro: milisegundos desde 1970 en los bits altos y 20 bits
+    aleatorios en los bajos, para no chocar con otros procesos. Dentro del proceso es
+    estrictamente creciente, así que ordenar por id respeta el orden de registro."""
+    global _ultimo_id
+    with _cerrojo_id:
+        candidato = (time.time_ns() // 1_000_000) << 20 | secrets.randbits(20)
+        _ultimo_id = max(candidato, _ultimo_id + 1)
+        return _ultimo_id
@@ -0,0 +1,307 @@
+"""Prueba de carga: muchas sesiones simuladas contra app.py sin navegador.
+
+Cada sesión abre un websocket con el servidor de Streamlit, igual que una
+pestaña del navegador. Elige una tienda (un rerun completo), guarda registros
+desde el formulario del sidebar (reruns de fragmento) y abre el modal de
+exportación. Todas las sesiones corren a la vez. Al final se informan los
+percentiles de latencia de cada tipo de rerun y las escrituras por segundo
+confirmadas. También se cuentan las actualizaciones perdidas: escrituras
+que la app confirmó pero que no están en el almacén.
+
+Por defecto lanza su propio servidor con un directorio de datos temporal:
+
+    python prueba_carga.py --sesiones 20 --escrituras 10 --backend jsonl
+
+Con --url se usa un servidor que ya está corriendo. Para contar las
+actualizaciones perdidas hay que indicar además su --directorio de datos.
+Cada registro de la prueba lleva en Clientes un marcador único
+(>= MARCADOR_BASE), así que conviene no usarla sobre datos reales.
+
+No usa streamlit.testing.AppTest. AppTest ejecuta el script en el mismo
+hilo que lo llama, una ejecución cada vez y sin servidor: no hay Runtime
+compartido, ni un hilo por sesión, ni cola de mensajes por websocket. Así
+no puede medir sesiones concurrentes, que es justo lo que se busca aquí.
+A cambio, la prueba habla el protocolo interno del frontend (BackMsg y
+ForwardMsg de streamlit.proto), que puede cambiar entre versiones. Por eso
+se niega a correr con una versión distinta de STREAMLIT_PROBADO salvo con
+--ignorar-version.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+MARCADOR_BASE = 10 ** 7
+# Versión (mayor.menor) de Streamlit con la que se comprobaron los mensajes de Sesion.rerun
+STREAMLIT_PROBADO = '1.65'
+ETIQUETA_TIENDA = "🏪 Selecciona la Tienda:"
+ETIQUETA_CLIENTES = "✅ Clientes:"
+ETIQUETA_GUARDAR = "💾 Guardar Registro"
+ETIQUETA_EXPORTAR = "📊 Generar Reporte Excel"
+TEXTO_GUARDADO = "Guardado permanentemente"
+TEXTO_MODAL = "Confirmación de Descarga"
+# script_finished: la app completa o un fragmento terminaron (2 = cortado por otro rerun)
+_TERMINADO = (0, 3)
+
+
+class Sesion:
+    """Una pestaña simulada: mantiene el estado de sus widgets como el frontend"""
+
+    def __init__(self, url, tiempo_maximo):
+        self.url = url
+        self.tiempo_maximo = tiempo_maximo
+        self.widgets = {}
+        self.estados = {}
+        self.ws = None
+
+    async def conectar(self):
+        import websockets
+
+        self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+
+    async def cerrar(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    def _estado(self, etiqueta):
+        from streamlit.proto import WidgetStates_pb2
+
+        estado = WidgetStates_pb2.WidgetState()
+        estado.id = self.widgets[etiqueta][0]
+        return estado
+
+    def fijar(self, etiqueta, campo, valor):
+        """Cambiar el valor de un widget; se envía en todos los reruns siguientes"""
+        estado = self._estado(etiqueta)
+        setattr(estado, campo, valor)
+        self.estados[estado.id] = estado
+
+    async def rerun(self, pulsar=None, fragmento=''):
+        """(milisegundos, textos mostrados, excepciones) de un rerun; pulsar es la etiqueta de un botón"""
+        from streamlit.proto import BackMsg_pb2, ForwardMsg_pb2
+
+        mensaje = BackMsg_pb2.BackMsg()
+        mensaje.rerun_script.query_string = ''
+        mensaje.rerun_script.page_script_hash = ''
+        if fragmento:
+            mensaje.rerun_script.fragment_id = fragmento
+        mensaje.rerun_script.widget_states.widgets.extend(self.estados.values())
+        if pulsar is not None:
+            boton = self._estado(pulsar)
+            boton.trigger_value = True
+            mensaje.rerun_script.widget_states.widgets.append(boton)
+        textos, excepciones = [], []
+        inicio = time.perf_counter()
+        await self.ws.send(mensaje.SerializeToString())
+        while True:
+            recibido = ForwardMsg_pb2.ForwardMsg()
+            recibido.ParseFromString(await asyncio.wait_for(self.ws.recv(), self.tiempo_maximo))
+            tipo = recibido.WhichOneof('type')
+            if tipo == 'delta' and recibido.delta.HasField('new_element'):
+                clase = recibido.delta.new_element.WhichOneof('type')
+                elemento = getattr(recibido.delta.new_element, clase)
+                if clase == 'exception':
+                    excepciones.append(elemento.message)
+                elif getattr(elemento, 'id', '') and hasattr(elemento, 'label'):
+                    self.widgets[elemento.label] = (elemento.id, recibido.delta.fragment_id,
+                                                    list(getattr(elemento, 'options', [])))
+                if hasattr(elemento, 'body'):
+                    textos.append(elemento.body)
+            elif tipo == 'script_finished' and recibido.script_finished in _TERMINADO:
+                return (time.perf_counter() - inicio) * 1000, textos, excepciones
+
+
+class Resultados:
+    def __init__(self):
+        self.latencias = {}
+        self.confirmados = []
+        self.modales = 0
+        self.excepciones = []
+        self.fallos = []
+
+    def anotar(self, accion, milisegundos, excepciones):
+        self.latencias.setdefault(accion, []).append(milisegundos)
+        self.excepciones.extend(excepciones)
+
+
+async def simular_sesion(numero, url, escrituras, pausa, tiempo_maximo, resultados, azar):
+    sesion = Sesion(url, tiempo_maximo)
+    try:
+        await sesion.conectar()
+        milisegundos, _, excepciones = await sesion.rerun()
+        resultados.anotar('carga_inicial', milisegundos, excepciones)
+
+        # Cada sesión en una tienda distinta (rerun completo: el selector está fuera de los fragmentos)
+        tiendas = sesion.widgets[ETIQUETA_TIENDA][2]
+        sesion.fijar(ETIQUETA_TIENDA, 'string_value', tiendas[numero % len(tiendas)])
+        milisegundos, _, excepciones = await sesion.rerun()
+        resultados.anotar('elegir_tienda', milisegundos, excepciones)
+
+        for i in range(escrituras):
+            await asyncio.sleep(azar.uniform(0, pausa))
+            marcador = MARCADOR_BASE + numero * 10 ** 4 + i
+            sesion.fijar(ETIQUETA_CLIENTES, 'int_value', marcador)
+            milisegundos, textos, excepciones = await sesion.rerun(ETIQUETA_GUARDAR, sesion.widgets[ETIQUETA_GUARDAR][1])
+            resultados.anotar('guardar', milisegundos, excepciones)
+            if any(TEXTO_GUARDADO in texto for texto in textos):
+                resultados.confirmados.append(marcador)
+
+        await asyncio.sleep(azar.uniform(0, pausa))
+        milisegundos, textos, excepciones = await sesion.rerun(ETIQUETA_EXPORTAR, sesion.widgets[ETIQUETA_EXPORTAR][1])
+        resultados.anotar('abrir_exportacion', milisegundos, excepciones)
+        resultados.modales += any(TEXTO_MODAL in texto for texto in textos)
+    except Exception as e:
+        resultados.fallos.append(f"sesión {numero}: {type(e).__name__}: {e}")
+    finally:
+        await sesion.cerrar()
+
+
+def contar_perdidos(backend, directorio, confirmados):
+    """(perdidos, duplicados): confirmados que no están en el almacén y los que están más de una vez"""
+    import almacenamiento
+
+    encontrados = {}
+    for registro in almacenamiento.crear_almacen(backend, directorio).cargar():
+        marcador = registro.get('count')
+        if isinstance(marcador, int) and marcador >= MARCADOR_BASE:
+            encontrados[marcador] = encontrados.get(marcador, 0) + 1
+    perdidos = sum(1 for marcador in confirmados if marcador not in encontrados)
+    duplicados = sum(veces - 1 for veces in encontrados.values() if veces > 1)
+    return perdidos, duplicados
+
+
+def comprobar_version():
+    """Salir si la versión instalada de Streamlit no es la comprobada"""
+    import streamlit
+
+    instalada = '.'.join(streamlit.__version__.split('.')[:2])
+    if instalada != STREAMLIT_PROBADO:
+        raise SystemExit(f"prueba_carga se comprobó con el protocolo de Streamlit {STREAMLIT_PROBADO} y la versión "
+                         f"instalada es {streamlit.__version__}: revise Sesion.rerun o use --ignorar-version")
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def lanzar_servidor(backend, directorio, puerto, espera=60):
+    """Proceso de `streamlit run app.py` con su propio directorio de datos, ya listo"""
+    carpeta = os.path.dirname(os.path.abspath(__file__))
+    entorno = dict(os.environ, VIALE_ALMACENAMIENTO=backend, VIALE_DIRECTORIO_DATOS=directorio)
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', os.path.join(carpeta, 'app.py'), '--server.port', str(puerto),
+         '--server.headless', 'true', '--browser.gatherUsageStats', 'false'],
+        cwd=carpeta, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    limite = time.time() + espera
+    while time.time() < limite:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{puerto}/_stcore/health", timeout=1):
+                return proceso
+        except OSError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError(f"El servidor no respondió en {espera} s")
+
+
+def _percentiles(valores):
+    return {
+        'muestras': len(valores),
+        'p50_ms': round(float(np.percentile(valores, 50)), 1),
+        'p95_ms': round(float(np.percentile(valores, 95)), 1),
+        'p99_ms': round(float(np.percentile(valores, 99)), 1),
+        'max_ms': round(max(valores), 1),
+    }
+
+
+async def ejecutar(url, sesiones, escrituras, pausa, tiempo_maximo, semilla=0):
+    resultados = Resultados()
+    azar = random.Random(semilla)
+    # Una primera sesión sola: importar módulos y cargar el almacén no cuenta como latencia
+    await simular_sesion(0, url, 0, 0, tiempo_maximo, Resultados(), azar)
+    inicio = time.perf_counter()
+    await asyncio.gather(*(simular_sesion(n, url, escrituras, pausa, tiempo_maximo, resultados, azar)
+                           for n in range(sesiones)))
+    return resultados, time.perf_counter() - inicio
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones simuladas de la app")
+    parser.add_argument('--sesiones', type=int, default=20)
+    parser.add_argument('--escrituras', type=int, default=10, help="registros que guarda cada sesión")
+    parser.add_argument('--pausa', type=float, default=0.5, help="pausa máxima al azar entre acciones (s)")
+    parser.add_argument('--backend', default='jsonl', help="backend del servidor que se lanza")
+    parser.add_argument('--url', help="servidor ya en marcha, p. ej. http://localhost:8501")
+    parser.add_argument('--directorio', help="directorio de datos del servidor de --url (para contar pérdidas)")
+    parser.add_argument('--tiempo-maximo', type=float, default=120, help="espera máxima por rerun (s)")
+    parser.add_argument('--salida', help="guardar los resultados en este JSON")
+    parser.add_argument('--ignorar-version', action='store_true',
+                        help=f"correr aunque Streamlit no sea la versión {STREAMLIT_PROBADO}")
+    opciones = parser.parse_args(argumentos)
+    if not opciones.ignorar_version:
+        comprobar_version()
+
+    temporal = proceso = None
+    if opciones.url:
+        base, directorio = opciones.url.rstrip('/'), opciones.directorio
+    else:
+        temporal = tempfile.TemporaryDirectory()
+        directorio = temporal.name
+        puerto = _puerto_libre()
+        proceso = lanzar_servidor(opciones.backend, directorio, puerto)
+        base = f"http://127.0.0.1:{puerto}"
+    url = base.replace('http', 'ws', 1) + '/_stcore/stream'
+    try:
+        resultados, segundos = asyncio.run(ejecutar(url, opciones.sesiones, opciones.escrituras,
+                                                    opciones.pausa, opciones.tiempo_maximo))
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait()
+
+    resumen = {
+        'sesiones': opciones.sesiones,
+        'escrituras_por_sesion': opciones.escrituras,
+        'backend': opciones.backend if not opciones.url else None,
+        'segundos': round(segundos, 2),
+        'latencias': {accion: _percentiles(valores) for accion, valores in resultados.latencias.items()},
+        'escrituras_confirmadas': len(resultados.confirmados),
+        'escrituras_por_segundo': round(len(resultados.confirmados) / segundos, 1),
+        'modales_abiertos': resultados.modales,
+        'excepciones': resultados.excepciones[:20],
+        'fallos': resultados.fallos[:20],
+    }
+    if directorio:
+        resumen['perdidos'], resumen['duplicados'] = contar_perdidos(
+            opciones.backend, directorio, resultados.confirmados)
+    if temporal is not None:
+        temporal.cleanup()
+
+    for accion, datos in resumen['latencias'].items():
+        print(f"{accion:18} n={datos['muestras']:<5} p50 {datos['p50_ms']:8.1f}  p95 {datos['p95_ms']:8.1f}  "
+              f"p99 {datos['p99_ms']:8.1f}  máx {datos['max_ms']:8.1f} ms")
+    print(f"Escrituras confirmadas: {resumen['escrituras_confirmadas']} "
+          f"({resumen['escrituras_por_segundo']}/s en {resumen['segundos']} s)")
+    print(f"Modales de exportación abiertos: {resumen['modales_abiertos']} de {opciones.sesiones}")
+    if 'perdidos' in resumen:
+        print(f"Actualizaciones perdidas: {resumen['perdidos']}   duplicadas: {resumen['duplicados']}")
+    for problema in resumen['fallos'] + resumen['excepciones']:
+        print(f"⚠️ {problema}")
+    if opciones.salida:
+        with open(opciones.salida, 'w', encoding='utf-8') as f:
+            json.dump(resumen, f, ensure_ascii=False, indent=2)
+    return 1 if resumen.get('perdidos') or resumen['fallos'] or resumen['excepciones'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
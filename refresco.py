@@ -0,0 +1,69 @@
+"""Refresco en segundo plano de la instantánea compartida.
+
+Un solo hilo por servidor comprueba cada VIALE_INTERVALO_REFRESCO segundos
+la firma del almacén, que cuesta un stat por archivo. Si alguien escribió
+desde fuera (el servicio de ingesta, otro proceso), llama una vez a
+almacen.instantanea(): esa llamada lee solo lo nuevo cuando puede y parcha
+los agregados y el rollup. La versión sube, y cada sesión la toma en su
+siguiente rerun sin repetir el trabajo ni tocar el disco.
+"""
+import os
+import sys
+import threading
+
+INTERVALO_REFRESCO = float(os.environ.get("VIALE_INTERVALO_REFRESCO", "1"))
+
+
+class Refrescador:
+    """Mantiene al día almacen.publicada desde un hilo propio"""
+
+    def __init__(self, almacen, intervalo=INTERVALO_REFRESCO):
+        self.almacen = almacen
+        self.intervalo = intervalo
+        self.refrescos = 0
+        self.error = None
+        self._version = None
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        """Comprobar una vez ahora y seguir comprobando en segundo plano"""
+        self.comprobar()
+        self._hilo = threading.Thread(target=self._vigilar, name='refrescar-almacen', daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+    @property
+    def activo(self):
+        return self._hilo is not None and self._hilo.is_alive() and self._version is not None
+
+    def _vigilar(self):
+        while not self._parar.wait(self.intervalo):
+            self.comprobar()
+
+    def comprobar(self):
+        """Instantánea vigente tras comprobar la firma; si falla la lectura se conserva la anterior"""
+        try:
+            instantanea = self.almacen.instantanea()
+        except Exception as e:
+            if str(e) != str(self.error):
+                print(f"No se pudo refrescar {self.almacen.ruta}: {e}", file=sys.stderr)
+            self.error = e
+            return self.almacen.publicada
+        self.error = None
+        if instantanea.version != self._version:
+            self._version = instantanea.version
+            self.refrescos += 1
+        return instantanea
+
+    def instantanea(self):
+        """Para las sesiones: la última instantánea publicada, sin tocar el disco mientras
+        el hilo esté vivo (las escrituras del propio proceso ya la publican al escribir)"""
+        if self.activo:
+            return self.almacen.publicada
+        return self.comprobar()
@@ -0,0 +1,249 @@
+"""Banco de pruebas: cómo se degrada la app al crecer el historial.
+
+Genera registros sintéticos (N tiendas, M vendedores por tienda, los 12
+rangos horarios y D días), los guarda en cada backend y mide las mismas
+operaciones que hace la app: la carga en frío (cargar_registros), guardar
+(add_record, por la cola de escritura), eliminar (delete_record), las
+estadísticas por tienda y generales, la página del historial y el reporte
+Excel. Los resultados se guardan en JSON junto con el commit, para comparar
+dos ejecuciones:
+
+    python rendimiento.py medir --registros 10000 100000 1000000 --salida antes.json
+    python rendimiento.py comparar antes.json despues.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import almacenamiento
+import exportacion
+from cola_escritura import ColaEscritura
+from columnar import TablaColumnar
+from datos_sinteticos import PRIMER_DIA, registros_sinteticos
+from modelo import RANGOS_HORARIO, nuevo_id
+
+CANTIDADES = [10000, 100000, 1000000]
+# Repeticiones por operación: las rápidas se repiten más para que la mediana sea estable
+REPETICIONES = {
+    'cargar_registros': 3,
+    'add_record': 50,
+    'delete_record': 50,
+    'get_stats_por_tienda': 50,
+    'get_stats_por_tienda_periodo': 50,
+    'get_stats_general': 50,
+    'historial': 50,
+    'exportar_excel': 1,
+}
+
+
+def _cronometrar(funcion, repeticiones):
+    """Milisegundos de cada llamada a funcion(i)"""
+    tiempos = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(i)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos
+
+
+def _resumen(tiempos):
+    return {
+        'mediana_ms': round(float(np.median(tiempos)), 3),
+        'p95_ms': round(float(np.percentile(tiempos, 95)), 3),
+        'min_ms': round(min(tiempos), 3),
+        'repeticiones': len(tiempos),
+    }
+
+
+def _tabla_tiendas(tiendas, vendedores_por_tienda):
+    """Catálogo sintético con las columnas de Asesores.xlsx"""
+    return pd.DataFrame([
+        {'Tienda': f"AL{t:03d}", 'Vendedor': f"VENDEDOR {t:03d}-{v}"}
+        for t in range(tiendas) for v in range(vendedores_por_tienda)
+    ])
+
+
+def _pagina_historial(almacen, tienda, desde, hasta):
+    """Lo que hace panel_historial: la página visible y su DataFrame"""
+    if almacen.consulta_por_tienda:
+        _, pagina = almacen.pagina_tienda(tienda, desde, hasta, None, 0, 50)
+    else:
+        _, pagina = almacen.instantanea().registros.pagina_historial(tienda, desde, hasta, None, 0, 50)
+    return pd.DataFrame([{
+        'Fecha': registro.get('date'),
+        'Vendedor': registro.get('seller', 'N/A'),
+        'Rango Horario': registro.get('rango_horario', 'N/A'),
+        'Clientes': registro.get('count', 0),
+        'Tickets': registro.get('tickets', 0),
+        'Soles (S/.)': registro.get('soles', 0),
+    } for _, registro in pagina])
+
+
+def medir_backend(backend, tabla, tiendas, vendedores_por_tienda, dias, directorio, excel=True):
+    """{operación: resumen de tiempos} para un backend con la tabla ya generada"""
+    azar = np.random.default_rng(1)
+    resultados = {}
+
+    almacen = almacenamiento.crear_almacen(backend, directorio)
+    inicio = time.perf_counter()
+    almacen.guardar(tabla)
+    resultados['guardar_inicial_s'] = round(time.perf_counter() - inicio, 3)
+
+    # Carga en frío: un almacén nuevo cada vez, como al arrancar el servidor
+    resultados['cargar_registros'] = _resumen(_cronometrar(
+        lambda i: almacenamiento.crear_almacen(backend, directorio).instantanea(),
+        REPETICIONES['cargar_registros']))
+
+    almacen = almacenamiento.crear_almacen(backend, directorio)
+    almacen.instantanea()
+    cola = ColaEscritura(almacen)
+    ultimo_dia = PRIMER_DIA + timedelta(days=dias - 1)
+    nuevos = []
+
+    def agregar(i):
+        registro = {
+            'tienda': f"AL{i % tiendas:03d}",
+            'seller': f"VENDEDOR {i % tiendas:03d}-0",
+            'rango_horario': RANGOS_HORARIO[i % len(RANGOS_HORARIO)],
+            'date': ultimo_dia.isoformat(),
+            'count': 5, 'tickets': 2, 'soles': 120.5,
+            'timestamp': datetime.now().isoformat(),
+            'id': nuevo_id(),
+        }
+        cola.agregar(registro)
+        nuevos.append(registro)
+
+    resultados['add_record'] = _resumen(_cronometrar(agregar, REPETICIONES['add_record']))
+    cola.cerrar()
+    resultados['delete_record'] = _resumen(_cronometrar(
+        lambda i: almacen.eliminar(nuevos[i]['id'], nuevos[i]['date']), REPETICIONES['delete_record']))
+
+    def tienda_al_azar():
+        return f"AL{int(azar.integers(tiendas)):03d}"
+
+    desde = ultimo_dia - timedelta(days=29)
+    resultados['get_stats_por_tienda'] = _resumen(_cronometrar(
+        lambda i: almacen.instantanea().agregados.stats_tienda(tienda_al_azar()),
+        REPETICIONES['get_stats_por_tienda']))
+    resultados['get_stats_por_tienda_periodo'] = _resumen(_cronometrar(
+        lambda i: almacen.instantanea().agregados.stats_tienda(tienda_al_azar(), desde, ultimo_dia),
+        REPETICIONES['get_stats_por_tienda_periodo']))
+    resultados['get_stats_general'] = _resumen(_cronometrar(
+        lambda i: almacen.instantanea().agregados.stats_general(), REPETICIONES['get_stats_general']))
+    resultados['historial'] = _resumen(_cronometrar(
+        lambda i: _pagina_historial(almacen, tienda_al_azar(), desde, ultimo_dia), REPETICIONES['historial']))
+
+    if not excel:
+        return resultados
+    df_tiendas = _tabla_tiendas(tiendas, vendedores_por_tienda)
+    resultados['exportar_excel'] = _resumen(_cronometrar(
+        lambda i: exportacion.generar_excel(almacen.tabla_completa(),
+                                            almacen.instantanea().agregados.stats_general(), df_tiendas),
+        REPETICIONES['exportar_excel']))
+    return resultados
+
+
+def commit_actual():
+    """Hash corto del commit del directorio del módulo; None fuera de un repositorio git"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def medir(cantidades=CANTIDADES, backends=None, tiendas=200, vendedores_por_tienda=8, dias=730, excel=True):
+    """Resultados de todas las mediciones, listos para guardar en JSON"""
+    backends = backends or [almacenamiento.BACKEND_POR_DEFECTO]
+    resultados = {}
+    for cantidad in cantidades:
+        inicio = time.perf_counter()
+        tabla = TablaColumnar.desde_registros(
+            registros_sinteticos(cantidad, tiendas, vendedores_por_tienda, dias))
+        generacion = round(time.perf_counter() - inicio, 3)
+        for backend in backends:
+            with tempfile.TemporaryDirectory() as directorio:
+                medidas = medir_backend(backend, tabla, tiendas, vendedores_por_tienda, dias, directorio, excel)
+            medidas['generar_s'] = generacion
+            resultados.setdefault(backend, {})[str(cantidad)] = medidas
+            print(f"{backend:10} {cantidad:>9}  " + "  ".join(
+                f"{operacion} {medida['mediana_ms']:.1f}" for operacion, medida in medidas.items()
+                if isinstance(medida, dict)), file=sys.stderr)
+    return {
+        'commit': commit_actual(),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'parametros': {'tiendas': tiendas, 'vendedores_por_tienda': vendedores_por_tienda, 'dias': dias,
+                       'rangos_horario': len(RANGOS_HORARIO), 'repeticiones': dict(REPETICIONES)},
+        'resultados': resultados,
+    }
+
+
+def comparar(antes, despues, umbral=0.2):
+    """[(backend, cantidad, operación, ms antes, ms después, razón)] de las medianas
+    presentes en ambos; las razones por encima de 1 + umbral son regresiones"""
+    filas = []
+    for backend, por_cantidad in despues['resultados'].items():
+        for cantidad, medidas in por_cantidad.items():
+            previas = antes['resultados'].get(backend, {}).get(cantidad, {})
+            for operacion, medida in medidas.items():
+                previa = previas.get(operacion)
+                if not isinstance(medida, dict) or not isinstance(previa, dict) or not previa['mediana_ms']:
+                    continue
+                razon = medida['mediana_ms'] / previa['mediana_ms']
+                filas.append((backend, cantidad, operacion, previa['mediana_ms'], medida['mediana_ms'], razon))
+    return filas
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Rendimiento de la app según el tamaño del historial")
+    ordenes = parser.add_subparsers(dest='orden', required=True)
+    medicion = ordenes.add_parser('medir', help="generar datos, medir y guardar los resultados en JSON")
+    medicion.add_argument('--registros', type=int, nargs='+', default=CANTIDADES)
+    medicion.add_argument('--backend', action='append', help="backend a medir (repetible; por defecto jsonl)")
+    medicion.add_argument('--tiendas', type=int, default=200)
+    medicion.add_argument('--vendedores', type=int, default=8, help="vendedores por tienda")
+    medicion.add_argument('--dias', type=int, default=730)
+    medicion.add_argument('--sin-excel', action='store_true', help="no medir el reporte Excel")
+    medicion.add_argument('--salida', help="archivo JSON (por defecto rendimiento_<commit>.json)")
+    comparacion = ordenes.add_parser('comparar', help="comparar dos archivos de resultados")
+    comparacion.add_argument('antes')
+    comparacion.add_argument('despues')
+    comparacion.add_argument('--umbral', type=float, default=0.2, help="aumento tolerado (0.2 = 20 %%)")
+    opciones = parser.parse_args(argumentos)
+
+    if opciones.orden == 'medir':
+        resultados = medir(opciones.registros, opciones.backend, opciones.tiendas, opciones.vendedores,
+                           opciones.dias, not opciones.sin_excel)
+        salida = opciones.salida or f"rendimiento_{resultados['commit'] or 'sin_commit'}.json"
+        with open(salida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+        print(f"Resultados guardados en {salida}")
+        return 0
+
+    with open(opciones.antes, 'r', encoding='utf-8') as f:
+        antes = json.load(f)
+    with open(opciones.despues, 'r', encoding='utf-8') as f:
+        despues = json.load(f)
+    regresiones = 0
+    for backend, cantidad, operacion, previa, actual, razon in comparar(antes, despues, opciones.umbral):
+        marca = '  ⚠️' if razon > 1 + opciones.umbral else ''
+        regresiones += bool(marca)
+        print(f"{backend:10} {cantidad:>9} {operacion:30} {previa:10.2f} → {actual:10.2f} ms  x{razon:.2f}{marca}")
+    print(f"{regresiones} regresiones por encima del {opciones.umbral:.0%}")
+    # Código de salida distinto de cero para usarlo en integración continua
+    return 1 if regresiones else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Reportes por tienda: un libro Excel por tienda, empaquetados en un zip.
+
+Cada libro lleva los registros de la tienda (de la fecha más reciente a la
+más antigua), sus estadísticas (las de get_stats_por_tienda) y el resumen
+por vendedor. openpyxl escribe un libro por núcleo: el proceso principal
+solo prepara los datos de cada tienda, reparte los libros entre
+VIALE_PROCESOS_REPORTES procesos (por defecto, uno por CPU) y los va
+añadiendo al zip a medida que terminan. Nunca hay más de dos libros por
+proceso en vuelo, así que la memoria no crece con el número de tiendas.
+
+Para los trabajos nocturnos, sobre el almacén configurado
+(VIALE_ALMACENAMIENTO y VIALE_DIRECTORIO_DATOS):
+
+    python reportes_tienda.py --salida reportes_tiendas.zip
+    python reportes_tienda.py --salida parcial.zip --tiendas AL001 AL002 --procesos 4
+
+La app lanza este mismo comando con generar_zip_aparte: bajo Streamlit el
+módulo principal es app.py, y cada proceso del pool lo volvería a ejecutar
+entero al arrancar.
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import almacenamiento
+import exportacion
+from agregados import REGISTROS
+
+PROCESOS_REPORTES = int(os.environ.get("VIALE_PROCESOS_REPORTES", "0")) or os.cpu_count() or 1
+# Libros pendientes por proceso: basta para que ninguno espere, sin acumular datos en la cola
+EN_VUELO_POR_PROCESO = 2
+
+
+def nombre_libro(tienda):
+    """Nombre del libro dentro del zip (sin separadores de ruta ni caracteres raros)"""
+    return re.sub(r'[^\w.-]+', '_', tienda).strip('._') or 'tienda'
+
+
+def tiendas_con_registros(agregados):
+    return sorted(t for t, acumulado in agregados.por_tienda.items()
+                  if isinstance(t, str) and acumulado[REGISTROS] > 0)
+
+
+def _trabajo(tabla, agregados, tienda):
+    """Lo que necesita un proceso para escribir el libro de la tienda (solo datos, sin la tabla)"""
+    registros = tabla.filas(tabla.indices_historial(tienda))
+    return tienda, registros, agregados.stats_tienda(tienda), dict(agregados.totales_vendedor(tienda))
+
+
+def _libro(tienda, registros, stats_tienda, vendedores):
+    return tienda, len(registros), exportacion.generar_libro_tienda(registros, stats_tienda, vendedores)
+
+
+def generar_zip(tabla, agregados, destino, tiendas=None, procesos=PROCESOS_REPORTES, al_avanzar=None):
+    """Escribir en destino (ruta o archivo binario) el zip con un libro por tienda.
+
+    Sin tiendas, todas las que tienen registros. al_avanzar(hechos, total, tienda) se llama
+    cada vez que un libro entra en el zip. Devuelve {tienda: registros del libro}.
+    """
+    tiendas = tiendas_con_registros(agregados) if tiendas is None else list(tiendas)
+    escritos = {}
+    nombres = set()
+
+    def anadir(archivo, tienda, cantidad, contenido):
+        nombre = base = nombre_libro(tienda)
+        while nombre in nombres:
+            # Dos tiendas que se limpian al mismo nombre no se pisan
+            nombre = f"{base}_{len(nombres)}"
+        nombres.add(nombre)
+        # Los xlsx ya son zip comprimidos: se guardan tal cual
+        archivo.writestr(f"{nombre}.xlsx", contenido, compress_type=zipfile.ZIP_STORED)
+        escritos[tienda] = cantidad
+        if al_avanzar is not None:
+            al_avanzar(len(escritos), len(tiendas), tienda)
+
+    with zipfile.ZipFile(destino, 'w') as archivo:
+        if procesos <= 1 or len(tiendas) <= 1:
+            for tienda in tiendas:
+                anadir(archivo, *_libro(*_trabajo(tabla, agregados, tienda)))
+            return escritos
+        # spawn y no fork: el proceso de Streamlit tiene hilos y cerrojos que no deben copiarse
+        with ProcessPoolExecutor(min(procesos, len(tiendas)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            pendientes = iter(tiendas)
+            en_vuelo = set()
+            while True:
+                while len(en_vuelo) < procesos * EN_VUELO_POR_PROCESO:
+                    tienda = next(pendientes, None)
+                    if tienda is None:
+                        break
+                    en_vuelo.add(pool.submit(_libro, *_trabajo(tabla, agregados, tienda)))
+                if not en_vuelo:
+                    break
+                hechos, en_vuelo = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    anadir(archivo, *futuro.result())
+    return escritos
+
+
+def generar_zip_aparte(salida, tiendas=None, procesos=PROCESOS_REPORTES, al_avanzar=None):
+    """Ejecutar la línea de comandos en otro proceso y seguir su avance; devuelve su resumen"""
+    comando = [sys.executable, os.path.abspath(__file__), '--salida', salida, '--procesos', str(procesos)]
+    if tiendas:
+        comando += ['--tiendas', *tiendas]
+    try:
+        proceso = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except OSError as e:
+        raise RuntimeError(f"no se pudo lanzar reportes_tienda: {e}") from e
+    with proceso:
+        try:
+            errores = []
+            for linea in proceso.stderr:
+                avance = re.match(r'\[(\d+)/(\d+)\] (.*)', linea)
+                if avance and al_avanzar is not None:
+                    al_avanzar(int(avance[1]), int(avance[2]), avance[3])
+                elif not avance:
+                    errores.append(linea)
+            resumen = proceso.stdout.read().strip()
+        except BaseException:
+            # Si se corta la espera (un rerun de la app, un error en al_avanzar) el hijo no sigue
+            # escribiendo por su cuenta ni deja su temporal
+            proceso.kill()
+            proceso.wait()
+            if os.path.exists(salida + '.tmp'):
+                os.remove(salida + '.tmp')
+            raise
+    if proceso.returncode != 0:
+        if os.path.exists(salida + '.tmp'):
+            os.remove(salida + '.tmp')
+        raise RuntimeError(''.join(errores[-20:]).strip() or f"reportes_tienda terminó con código {proceso.returncode}")
+    return resumen
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Un libro Excel por tienda, empaquetados en un zip")
+    parser.add_argument('--salida', default='reportes_tiendas.zip', help="ruta del zip")
+    parser.add_argument('--tiendas', nargs='+', help="solo estas tiendas (por defecto, todas las que tienen registros)")
+    parser.add_argument('--procesos', type=int, default=PROCESOS_REPORTES,
+                        help="procesos que escriben libros (1 = en serie)")
+    parser.add_argument('--backend', help="backend de almacenamiento (por defecto, VIALE_ALMACENAMIENTO)")
+    parser.add_argument('--directorio', help="directorio de datos (por defecto, VIALE_DIRECTORIO_DATOS)")
+    opciones = parser.parse_args(argumentos)
+
+    inicio = time.perf_counter()
+    almacen = almacenamiento.crear_almacen(opciones.backend, opciones.directorio)
+    agregados = almacen.instantanea().agregados
+    tabla = almacen.tabla_completa()
+    desconocidas = [t for t in opciones.tiendas or () if t not in agregados.por_tienda]
+    if desconocidas:
+        print(f"Tiendas sin registros (se generan vacías): {', '.join(desconocidas)}", file=sys.stderr)
+
+    def al_avanzar(hechos, total, tienda):
+        print(f"[{hechos}/{total}] {tienda}", file=sys.stderr)
+
+    # Se escribe a un temporal: un trabajo interrumpido no deja un zip a medias con el nombre final
+    temporal = opciones.salida + '.tmp'
+    try:
+        escritos = generar_zip(tabla, agregados, temporal, opciones.tiendas, opciones.procesos, al_avanzar)
+        os.replace(temporal, opciones.salida)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    print(f"{len(escritos)} libros, {sum(escritos.values())} registros en {opciones.salida} "
+          f"({time.perf_counter() - inicio:.1f} s, {opciones.procesos} procesos)")
+
+
+if __name__ == '__main__':
+    main()
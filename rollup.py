@@ -0,0 +1,278 @@
+"""Rollup diario: sumas por tienda × fecha × rango horario × vendedor.
+
+Vive dentro de Agregados, así que se mantiene en cada escritura igual que
+el resto de acumulados. Las claves se empaquetan en un int64 con la tienda
+en los bits altos y la fecha a continuación, y se guardan ordenadas en un
+arreglo NumPy: las filas de una tienda entre dos fechas son un tramo
+contiguo que se localiza con searchsorted, sin recorrer la historia.
+
+Las escrituras sueltas no reordenan los arreglos: se acumulan en una lista
+de pendientes que se consolida cada MAXIMO_PENDIENTES entradas (o al
+consultar). Cada copia comparte los arreglos con la anterior.
+"""
+import threading
+from datetime import date
+
+import numpy as np
+
+from modelo import RANGOS_HORARIO
+
+# Posiciones dentro de cada acumulado, las mismas que en agregados
+REGISTROS, CLIENTES, TICKETS, SOLES = range(4)
+MAXIMO_PENDIENTES = 2048
+
+# Bits de cada parte de la clave (el código 0 significa "sin valor"). Se
+# definen solo aquí; BITS_FECHA es público porque clasificacion arma sus claves
+# (entidad << BITS_FECHA | fecha) con los mismos bits
+_BITS_VENDEDOR = 21
+_BITS_RANGO = 6
+BITS_FECHA = 20
+_BITS_TIENDA = 16
+# 63 bits como máximo: la clave es un int64 con signo y debe quedar positiva
+assert _BITS_VENDEDOR + _BITS_RANGO + BITS_FECHA + _BITS_TIENDA <= 63, "La clave del rollup no cabe en un int64"
+_DESPLAZA_RANGO = _BITS_VENDEDOR
+_DESPLAZA_FECHA = _DESPLAZA_RANGO + _BITS_RANGO
+_DESPLAZA_TIENDA = _DESPLAZA_FECHA + BITS_FECHA
+_MASCARA_VENDEDOR = (1 << _BITS_VENDEDOR) - 1
+_MASCARA_RANGO = (1 << _BITS_RANGO) - 1
+_MASCARA_FECHA = (1 << BITS_FECHA) - 1
+_MASCARA_TIENDA = (1 << _BITS_TIENDA) - 1
+# Clave mayor que cualquier otra (límite superior de la última tienda)
+_CLAVE_MAXIMA = np.iinfo(np.int64).max
+
+
+class DesbordeRollup(ValueError):
+    """Un código no cabe en los bits de su parte de la clave del rollup"""
+
+
+class _Codigos:
+    """Cadenas ↔ códigos desde 1, compartidos por todos los rollups del proceso"""
+
+    def __init__(self, iniciales=()):
+        self.valores = [None]
+        self.codigos = {}
+        self._cerrojo = threading.Lock()
+        for valor in iniciales:
+            self.codificar(valor)
+
+    def codificar(self, valor):
+        codigo = self.codigos.get(valor)
+        if codigo is None:
+            with self._cerrojo:
+                codigo = self.codigos.get(valor)
+                if codigo is None:
+                    codigo = len(self.valores)
+                    self.valores.append(valor)
+                    self.codigos[valor] = codigo
+        return codigo
+
+
+TIENDAS = _Codigos()
+VENDEDORES = _Codigos(['Desconocido'])
+RANGOS = _Codigos(RANGOS_HORARIO)
+
+
+def _ordinal(valor):
+    if type(valor) is str and len(valor) == 10:
+        try:
+            ordinal = date.fromisoformat(valor).toordinal()
+        except ValueError:
+            return 0
+        # Después del año 2870 no cabe en la clave: se trata como fecha no válida
+        return ordinal if ordinal <= _MASCARA_FECHA else 0
+    return 0
+
+
+def _empaquetar(tienda, fecha, rango, vendedor):
+    return (tienda << _DESPLAZA_TIENDA) | (fecha << _DESPLAZA_FECHA) | (rango << _DESPLAZA_RANGO) | vendedor
+
+
+def empaquetar(tienda, fecha, rango, vendedor):
+    """Clave (o arreglo de claves) a partir de los códigos de cada parte.
+
+    Un código que no cabe en su parte invadiría la siguiente (más de 63
+    rangos horarios distintos acabarían sumados en otra fecha), así que se
+    rechaza con DesbordeRollup.
+    """
+    for codigos, mascara, mensaje in ((tienda, _MASCARA_TIENDA, "más de {} tiendas distintas"),
+                                      (fecha, _MASCARA_FECHA, "fechas con ordinal mayor que {}"),
+                                      (rango, _MASCARA_RANGO, "más de {} rangos horarios distintos"),
+                                      (vendedor, _MASCARA_VENDEDOR, "más de {} vendedores distintos")):
+        if np.any(codigos > mascara):
+            raise DesbordeRollup("La clave del rollup no admite " + mensaje.format(mascara))
+    return _empaquetar(tienda, fecha, rango, vendedor)
+
+
+def clave_registro(registro):
+    """Clave del rollup para un registro, con los mismos valores por defecto que Agregados"""
+    tienda = registro.get('tienda')
+    rango = registro.get('rango_horario')
+    return empaquetar(
+        TIENDAS.codificar(tienda) if type(tienda) is str else 0,
+        _ordinal(registro.get('date')),
+        RANGOS.codificar(rango) if type(rango) is str else 0,
+        VENDEDORES.codificar(str(registro.get('seller', 'Desconocido'))),
+    )
+
+
+def _combinar(claves, sumas, nuevas, valores):
+    """(claves, sumas) con los valores de nuevas (pueden repetirse) sumados;
+    se quitan las claves que se quedan sin registros"""
+    if not len(nuevas):
+        return claves, sumas
+    unicas, inversos = np.unique(nuevas, return_inverse=True)
+    delta = np.zeros((len(unicas), 4), dtype=np.int64)
+    np.add.at(delta, inversos, valores)
+    posiciones = np.searchsorted(claves, unicas)
+    existentes = posiciones < len(claves)
+    existentes[existentes] = claves[posiciones[existentes]] == unicas[existentes]
+    sumas = sumas.copy()
+    sumas[posiciones[existentes]] += delta[existentes]
+    claves = np.insert(claves, posiciones[~existentes], unicas[~existentes])
+    sumas = np.insert(sumas, posiciones[~existentes], delta[~existentes], axis=0)
+    vacias = sumas[:, REGISTROS] <= 0
+    if vacias.any():
+        claves, sumas = claves[~vacias], sumas[~vacias]
+    return claves, sumas
+
+
+def _consolidar(claves, sumas, pendientes):
+    """(claves, sumas) con la lista de (clave, valores) pendientes sumada"""
+    if not pendientes:
+        return claves, sumas
+    nuevas = np.fromiter((p[0] for p in pendientes), dtype=np.int64, count=len(pendientes))
+    valores = np.array([p[1] for p in pendientes], dtype=np.int64).reshape(-1, 4)
+    return _combinar(claves, sumas, nuevas, valores)
+
+
+class Rollup:
+    """Sumas [registros, clientes, tickets, céntimos] por clave empaquetada"""
+
+    def __init__(self, claves=None, sumas=None, pendientes=()):
+        claves = np.zeros(0, dtype=np.int64) if claves is None else claves
+        sumas = np.zeros((0, 4), dtype=np.int64) if sumas is None else sumas
+        # Una sola tupla: las lecturas concurrentes ven siempre un estado coherente
+        self._estado = (claves, sumas, list(pendientes))
+
+    @classmethod
+    def desde_codigos(cls, tiendas, fechas, rangos, vendedores, valores):
+        """Rollup de columnas ya codificadas (códigos globales y ordinales; 0 = sin valor)"""
+        # Igual que _ordinal: la fecha que no cabe en la clave cuenta como no válida
+        fechas = np.where(fechas > _MASCARA_FECHA, 0, fechas)
+        claves = empaquetar(tiendas.astype(np.int64), fechas.astype(np.int64),
+                            rangos.astype(np.int64), vendedores.astype(np.int64))
+        unicas, inversos = np.unique(claves, return_inverse=True)
+        sumas = np.stack([np.bincount(inversos, weights=v, minlength=len(unicas)) for v in valores], axis=1)
+        return cls(unicas, np.rint(sumas).astype(np.int64))
+
+    # Escritura
+
+    def agregar(self, registro, valores, signo=1):
+        """Sumar en sitio (solo mientras se construye, antes de publicarlo)"""
+        claves, sumas, pendientes = self._estado
+        pendientes.append((clave_registro(registro), [signo] + [signo * v for v in valores]))
+        if len(pendientes) >= MAXIMO_PENDIENTES:
+            self._estado = (*_consolidar(claves, sumas, pendientes), [])
+
+    def con_registro(self, registro, valores, signo=1):
+        """Copia con el registro sumado (o restado); comparte los arreglos con esta"""
+        copia = Rollup(*self._estado)
+        copia.agregar(registro, valores, signo)
+        return copia
+
+    def _tablas(self):
+        """(claves, sumas) consolidadas; el resultado se guarda en el propio rollup"""
+        claves, sumas, pendientes = self._estado
+        if pendientes:
+            claves, sumas = _consolidar(claves, sumas, pendientes)
+            # Otra lectura concurrente calcularía lo mismo: da igual quién asigna
+            self._estado = (claves, sumas, [])
+        return claves, sumas
+
+    def fusionar(self, otro):
+        """Sumar en sitio otro rollup (p. ej. el de otro segmento)"""
+        self._estado = (*self.con_rollup(otro)._estado[:2], [])
+        return self
+
+    def con_rollup(self, otro):
+        """Copia con otro rollup sumado (un lote)"""
+        return Rollup(*_combinar(*self._tablas(), *otro._tablas()))
+
+    def __len__(self):
+        return len(self._tablas()[0])
+
+    # Consultas
+
+    def columnas(self):
+        """(tiendas, fechas, rangos, vendedores, sumas) de todas las filas, con los
+        códigos del proceso (TIENDAS, RANGOS, VENDEDORES) y la fecha como ordinal"""
+        claves, sumas = self._tablas()
+        return (claves >> _DESPLAZA_TIENDA, (claves >> _DESPLAZA_FECHA) & _MASCARA_FECHA,
+                (claves >> _DESPLAZA_RANGO) & _MASCARA_RANGO, claves & _MASCARA_VENDEDOR, sumas)
+
+    def tramo(self, tienda, desde=None, hasta=None):
+        """(fechas, rangos, vendedores, sumas) de una tienda entre dos fechas (inclusive).
+        Sin límites incluye también las filas sin fecha válida."""
+        claves, sumas = self._tablas()
+        codigo = TIENDAS.codigos.get(tienda) if isinstance(tienda, str) else (0 if tienda is None else None)
+        if codigo is None:
+            vacio = np.zeros(0, dtype=np.int64)
+            return vacio, vacio, vacio, np.zeros((0, 4), dtype=np.int64)
+        # Límites de búsqueda, no claves: una fecha que no cabe se recorta al final de la tienda
+        inicio = _empaquetar(codigo, min(desde.toordinal(), _MASCARA_FECHA) if desde is not None else 0, 0, 0)
+        if hasta is not None and hasta.toordinal() < _MASCARA_FECHA:
+            fin = _empaquetar(codigo, hasta.toordinal() + 1, 0, 0)
+        else:
+            fin = min(_empaquetar(codigo + 1, 0, 0, 0), _CLAVE_MAXIMA)
+        a, b = np.searchsorted(claves, [inicio, fin])
+        tramo = claves[a:b]
+        return ((tramo >> _DESPLAZA_FECHA) & _MASCARA_FECHA, (tramo >> _DESPLAZA_RANGO) & _MASCARA_RANGO,
+                tramo & _MASCARA_VENDEDOR, sumas[a:b])
+
+    @staticmethod
+    def _agrupar(codigos, sumas, nombre):
+        """{nombre(código): acumulado} en orden de código"""
+        unicos, inversos = np.unique(codigos, return_inverse=True)
+        totales = np.zeros((len(unicos), 4), dtype=np.int64)
+        np.add.at(totales, inversos, sumas)
+        return {nombre(int(c)): fila for c, fila in zip(unicos.tolist(), totales.tolist())}
+
+    def resumen(self, tienda, desde=None, hasta=None):
+        """Total y acumulados por vendedor, fecha y rango horario de una tienda en el periodo"""
+        fechas, rangos, vendedores, sumas = self.tramo(tienda, desde, hasta)
+        return {
+            'total': sumas.sum(axis=0).tolist() if len(sumas) else [0, 0, 0, 0],
+            'por_vendedor': self._agrupar(vendedores, sumas, VENDEDORES.valores.__getitem__),
+            'por_fecha': self._agrupar(fechas, sumas, lambda o: date.fromordinal(o).isoformat() if o else ''),
+            'por_horario': self._agrupar(rangos, sumas, lambda c: RANGOS.valores[c] if c else ''),
+        }
+
+    def mapa_calor(self, tienda, desde=None, hasta=None, posicion=CLIENTES):
+        """Matriz 7 × len(RANGOS_HORARIO): día de la semana (lunes = 0) por rango horario"""
+        fechas, rangos, _, sumas = self.tramo(tienda, desde, hasta)
+        validas = (fechas > 0) & (rangos >= 1) & (rangos <= len(RANGOS_HORARIO))
+        dias = (fechas[validas] - 1) % 7
+        celdas = dias * len(RANGOS_HORARIO) + (rangos[validas] - 1)
+        matriz = np.bincount(celdas, weights=sumas[validas, posicion], minlength=7 * len(RANGOS_HORARIO))
+        return np.rint(matriz).astype(np.int64).reshape(7, len(RANGOS_HORARIO))
+
+    # Pickle: los códigos son del proceso, así que se guardan las cadenas
+
+    def __getstate__(self):
+        claves, sumas = self._tablas()
+        return {'claves': claves, 'sumas': sumas, 'tiendas': list(TIENDAS.valores),
+                'vendedores': list(VENDEDORES.valores), 'rangos': list(RANGOS.valores)}
+
+    def __setstate__(self, estado):
+        claves = estado['claves']
+
+        def recodificar(partes, codigos, valores):
+            mapa = np.array([0] + [codigos.codificar(v) for v in valores[1:]], dtype=np.int64)
+            return mapa[partes]
+
+        tiendas = recodificar(claves >> _DESPLAZA_TIENDA, TIENDAS, estado['tiendas'])
+        rangos = recodificar((claves >> _DESPLAZA_RANGO) & _MASCARA_RANGO, RANGOS, estado['rangos'])
+        vendedores = recodificar(claves & _MASCARA_VENDEDOR, VENDEDORES, estado['vendedores'])
+        claves = empaquetar(tiendas, (claves >> _DESPLAZA_FECHA) & _MASCARA_FECHA, rangos, vendedores)
+        orden = np.argsort(claves, kind='stable')
+        self._estado = (claves[orden], estado['sumas'][orden], [])
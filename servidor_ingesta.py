@@ -0,0 +1,322 @@
+"""Servicio HTTP de ingesta sin interfaz (solo biblioteca estándar).
+
+Los terminales de tienda envían sus conteos como JSON y se guardan en el
+mismo almacén que lee la app de Streamlit (mismas VIALE_ALMACENAMIENTO y
+VIALE_DIRECTORIO_DATOS). La app detecta el cambio por la firma del almacén;
+en modo journal solo lee las líneas nuevas. Los dos procesos escriben a la
+vez: el almacén coordina escrituras y compactaciones con flock sobre su
+archivo .lock (sin fcntl, como en Windows, debe haber un solo escritor).
+
+    python servidor_ingesta.py --puerto 8502
+
+Endpoints:
+    POST   /registros              un registro (campos del formulario o del reporte)
+    POST   /registros/lote         lista de registros, guardados en una sola escritura
+    DELETE /registros/<id>         eliminar por id (?fecha=AAAA-MM-DD ayuda a los segmentos)
+    GET    /salud                  versión y total de registros
+    GET    /exportacion.csv        registros en CSV, transmitidos por bloques
+    GET    /exportacion.parquet    lo mismo en Parquet (requiere pyarrow)
+                                   (?tienda=AL001&desde=AAAA-MM-DD&hasta=AAAA-MM-DD, todos opcionales)
+
+Si VIALE_TOKEN_INGESTA está definido, se exige "Authorization: Bearer <token>".
+Sin token el servicio solo escucha en la interfaz local (127.0.0.1, ::1) y
+las exportaciones, que entregan todo el historial de ventas, responden 403.
+"""
+import argparse
+import hmac
+import ipaddress
+import json
+import os
+import sys
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import almacenamiento
+import exportacion
+from agregados import REGISTROS
+from catalogo import VigiaCatalogo
+from cola_escritura import ColaEscritura
+from importacion import validar_registro
+from modelo import nuevo_id
+
+TOKEN = os.environ.get("VIALE_TOKEN_INGESTA", "")
+# Cuerpo máximo aceptado (un lote de decenas de miles de registros cabe de sobra)
+MAXIMO_CUERPO = 32 * 1024 * 1024
+
+FORMATOS_EXPORTACION = {
+    'exportacion.csv': (exportacion.generar_csv, 'text/csv; charset=utf-8'),
+    'exportacion.parquet': (exportacion.generar_parquet, 'application/vnd.apache.parquet'),
+}
+
+
+class ErrorPeticion(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+class ServicioIngesta:
+    """Validación y escritura, sin nada de HTTP (lo usa el manejador)"""
+
+    def __init__(self, almacen, vigia_catalogo):
+        self.almacen = almacen
+        self.vigia_catalogo = vigia_catalogo
+        # Los registros sueltos de terminales simultáneos se guardan en lotes
+        self.cola = ColaEscritura(almacen)
+
+    def _preparar(self, datos, catalogo):
+        registro, errores = validar_registro(datos, catalogo)
+        if registro is not None:
+            registro['timestamp'] = datetime.now().isoformat()
+            registro['id'] = nuevo_id()
+        return registro, errores
+
+    def agregar(self, datos):
+        registro, errores = self._preparar(datos, self.vigia_catalogo.obtener())
+        if registro is None:
+            raise ErrorPeticion(422, '; '.join(errores))
+        self.cola.agregar(registro)
+        return {'id': registro['id']}
+
+    def agregar_lote(self, lista):
+        """Guarda las entradas válidas y devuelve el motivo de cada rechazada
+        (posición dentro de la lista), como la importación masiva"""
+        if not isinstance(lista, list):
+            raise ErrorPeticion(400, "se esperaba una lista de registros")
+        catalogo = self.vigia_catalogo.obtener()
+        registros, rechazados = [], []
+        for posicion, datos in enumerate(lista):
+            registro, errores = self._preparar(datos, catalogo)
+            if registro is None:
+                rechazados.append({'posicion': posicion, 'error': '; '.join(errores)})
+            else:
+                registros.append(registro)
+        self.almacen.agregar_lote(registros)
+        return {'ids': [r['id'] for r in registros], 'rechazados': rechazados}
+
+    def eliminar(self, clave, fecha=None):
+        eliminado = self.almacen.eliminar(clave, fecha)
+        if eliminado is None:
+            raise ErrorPeticion(404, f"no existe el registro {clave}")
+        return {'id': clave}
+
+    def exportar(self, nombre, consulta):
+        """(tipo de contenido, iterador de bytes) de la exportación filtrada"""
+        generar, tipo = FORMATOS_EXPORTACION[nombre]
+        if generar is exportacion.generar_parquet and not exportacion.PARQUET_DISPONIBLE:
+            raise ErrorPeticion(501, "la exportación a Parquet requiere pyarrow")
+        tienda = consulta.get('tienda', [None])[0] or None
+        desde, hasta = (self._fecha(consulta, campo) for campo in ('desde', 'hasta'))
+        tabla = self.almacen.tabla_completa()
+        return tipo, generar(tabla, exportacion.indices_exportacion(tabla, tienda, desde, hasta))
+
+    @staticmethod
+    def _fecha(consulta, campo):
+        texto = consulta.get(campo, [None])[0]
+        if not texto:
+            return None
+        try:
+            return date.fromisoformat(texto)
+        except ValueError:
+            raise ErrorPeticion(400, f"{campo} debe tener el formato AAAA-MM-DD")
+
+    def salud(self):
+        instantanea = self.almacen.instantanea()
+        return {'backend': self.almacen.nombre, 'version': instantanea.version,
+                'registros': instantanea.agregados.total[REGISTROS]}
+
+
+class ManejadorIngesta(BaseHTTPRequestHandler):
+    # Conexiones persistentes: un terminal puede enviar muchas peticiones seguidas
+    protocol_version = 'HTTP/1.1'
+    # Encabezados y cuerpo salen en escrituras separadas: sin Nagle no esperan al ACK retardado
+    disable_nagle_algorithm = True
+    server_version = 'VialeIngesta/1.0'
+
+    @property
+    def servicio(self):
+        return self.server.servicio
+
+    def _responder(self, estado, cuerpo):
+        datos = json.dumps(cuerpo, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(estado)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(datos)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _leer_json(self):
+        try:
+            largo = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            raise ErrorPeticion(400, "Content-Length inválido")
+        if largo > MAXIMO_CUERPO:
+            raise ErrorPeticion(413, "cuerpo demasiado grande")
+        try:
+            return json.loads(self.rfile.read(largo) or b'null')
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise ErrorPeticion(400, "el cuerpo no es JSON válido")
+
+    def _autorizado(self):
+        if not self.server.token:
+            return True
+        recibido = self.headers.get('Authorization', '')
+        return hmac.compare_digest(recibido.encode('utf-8'), f"Bearer {self.server.token}".encode('utf-8'))
+
+    def _atender(self, accion):
+        try:
+            if not self._autorizado():
+                raise ErrorPeticion(401, "token inválido")
+            self._responder(200, dict(ok=True, **accion()))
+        except ErrorPeticion as e:
+            self._responder_error(e.estado, str(e))
+        except Exception as e:
+            # Error del almacén o del catálogo: el terminal debe reintentar
+            self.log_error("Error al atender %s %s: %s", self.command, self.path, e)
+            self._responder_error(500, str(e))
+
+    def _transmitir(self, accion):
+        """Respuesta con Transfer-Encoding: chunked, un fragmento por cada bloque generado"""
+        try:
+            if not self._autorizado():
+                raise ErrorPeticion(401, "token inválido")
+            tipo, partes = accion()
+        except ErrorPeticion as e:
+            return self._responder_error(e.estado, str(e))
+        except Exception as e:
+            self.log_error("Error al atender %s %s: %s", self.command, self.path, e)
+            return self._responder_error(500, str(e))
+        self.send_response(200)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for parte in partes:
+                if parte:
+                    self.wfile.write(f"{len(parte):X}\r\n".encode('ascii') + parte + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except Exception as e:
+            # Ya se enviaron los encabezados: sin el fragmento final el cliente ve la respuesta incompleta
+            self.log_error("Exportación interrumpida %s: %s", self.path, e)
+            self.close_connection = True
+
+    def _responder_error(self, estado, mensaje):
+        # El cuerpo pudo quedar sin leer: la conexión no se reutiliza
+        self.close_connection = True
+        self._responder(estado, {'ok': False, 'error': mensaje})
+
+    def _ruta(self):
+        partes = urlsplit(self.path)
+        return [p for p in partes.path.split('/') if p], parse_qs(partes.query)
+
+    def do_GET(self):
+        ruta, consulta = self._ruta()
+        if ruta == ['salud']:
+            self._atender(self.servicio.salud)
+        elif len(ruta) == 1 and ruta[0] in FORMATOS_EXPORTACION:
+            self._transmitir(lambda: self._exportar(ruta[0], consulta))
+        else:
+            self._atender(self._no_encontrado)
+
+    def do_POST(self):
+        ruta, _ = self._ruta()
+        if ruta == ['registros']:
+            self._atender(lambda: self.servicio.agregar(self._leer_json()))
+        elif ruta == ['registros', 'lote']:
+            self._atender(lambda: self.servicio.agregar_lote(self._leer_json()))
+        else:
+            self._atender(self._no_encontrado)
+
+    def do_DELETE(self):
+        ruta, consulta = self._ruta()
+        if len(ruta) == 2 and ruta[0] == 'registros':
+            self._atender(lambda: self.servicio.eliminar(self._clave(ruta[1]), consulta.get('fecha', [None])[0]))
+        else:
+            self._atender(self._no_encontrado)
+
+    @staticmethod
+    def _clave(texto):
+        # Los ids son enteros; cualquier otra cosa no puede existir
+        try:
+            return int(texto)
+        except ValueError:
+            raise ErrorPeticion(404, f"no existe el registro {texto}")
+
+    def _exportar(self, nombre, consulta):
+        # En la app la misma exportación está tras la contraseña de administrador
+        if not self.server.token:
+            raise ErrorPeticion(403, "la exportación requiere definir VIALE_TOKEN_INGESTA")
+        return self.servicio.exportar(nombre, consulta)
+
+    def _no_encontrado(self):
+        raise ErrorPeticion(404, f"ruta desconocida: {self.command} {self.path}")
+
+    def log_message(self, formato, *args):
+        if self.server.detallado:
+            super().log_message(formato, *args)
+
+    def log_error(self, formato, *args):
+        # Los errores se registran siempre
+        super().log_message(formato, *args)
+
+
+def es_local(host):
+    """¿host solo es accesible desde esta máquina?"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def crear_servidor(host='127.0.0.1', puerto=8502, almacen=None, vigia_catalogo=None, token=TOKEN,
+                   detallado=False):
+    """Servidor listo para serve_forever(); cada petición se atiende en su hilo.
+    Sin token solo se admite una interfaz local (ValueError si no)"""
+    if not token and not es_local(host):
+        raise ValueError(f"Para escuchar en {host} hay que definir VIALE_TOKEN_INGESTA: "
+                         "sin token cualquiera en la red podría escribir registros")
+    if almacen is None:
+        almacen = almacenamiento.crear_almacen()
+        # Igual que al arrancar la app: formatos anteriores e ids faltantes
+        almacen.migrar()
+        almacen.asignar_ids()
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorIngesta)
+    servidor.daemon_threads = True
+    servidor.servicio = ServicioIngesta(almacen, vigia_catalogo or VigiaCatalogo())
+    servidor.token = token
+    servidor.detallado = detallado
+    return servidor
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP de ingesta de conteos Viale")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8502)
+    parser.add_argument('--detallado', action='store_true', help="registrar cada petición")
+    opciones = parser.parse_args(argumentos)
+    try:
+        servidor = crear_servidor(opciones.host, opciones.puerto, detallado=opciones.detallado)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Ingesta Viale ({servidor.servicio.almacen.nombre}) en http://{opciones.host}:{opciones.puerto}",
+          file=sys.stderr)
+    almacen = servidor.servicio.almacen
+    if almacen.bloqueo_entre_procesos and almacenamiento.fcntl is None:
+        print("Aviso: sin fcntl no hay bloqueo entre procesos; no escriba desde la app mientras corre "
+              "este servicio (o use VIALE_ALMACENAMIENTO=sqlite)", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servidor.servicio.cola.cerrar()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Lecturas del almacén mientras otro proceso escribe (el servicio de ingesta)"""
+import pytest
+
+import almacenamiento
+from datos_sinteticos import registros_sinteticos
+from modelo import nuevo_id
+
+
+def _almacenes(backend, directorio, cantidad=1000):
+    lector = almacenamiento.crear_almacen(backend, directorio)
+    # Otra instancia sobre los mismos archivos hace de segundo proceso
+    escritor = almacenamiento.crear_almacen(backend, directorio)
+    registros = list(registros_sinteticos(cantidad, tiendas=3))
+    escritor.guardar(registros)
+    return lector, escritor, registros
+
+
+def test_journal_anexado_durante_lectura_completa(tmp_path):
+    lector, escritor, registros = _almacenes('jsonl', str(tmp_path))
+    original = lector.iterar
+
+    def iterar(*argumentos):
+        for numero, registro in enumerate(original(*argumentos)):
+            if numero == 10:
+                escritor.agregar(dict(registros[0], id=nuevo_id()))
+            yield registro
+
+    lector.iterar = iterar
+    assert len(lector.instantanea().registros) == 1000
+    lector.iterar = original
+    instantanea = lector.instantanea()
+    assert len(instantanea.registros) == 1001
+    assert instantanea.agregados.total[0] == 1001
+
+
+@pytest.mark.parametrize('backend', ['jsonl', 'binario'])
+def test_cola_no_duplica_registros_ya_leidos(tmp_path, backend):
+    # Una lectura completa que se adelantó a su firma ya trae parte de la cola
+    lector, escritor, registros = _almacenes(backend, str(tmp_path))
+    firma = lector.firma()
+    repetido = dict(registros[0], id=nuevo_id())
+    anulado = dict(registros[1], id=nuevo_id())
+    escritor.agregar(repetido)
+    escritor.agregar(anulado)
+    tabla = lector._leer_tabla()
+    escritor.eliminar(anulado['id'])
+    escritor.agregar(dict(registros[2], id=nuevo_id()))
+    lector._publicar(tabla, almacenamiento.construir_agregados(tabla), firma)
+    instantanea = lector.instantanea()
+    assert len(instantanea.registros) == 1002
+    assert instantanea.agregados.total[0] == 1002
+    assert instantanea.registros.posicion_id(anulado['id']) is None
@@ -0,0 +1,30 @@
+"""Fallos de generar_zip_aparte: ni excepciones sueltas ni temporales olvidados"""
+import os
+
+import pytest
+
+import almacenamiento
+import reportes_tienda
+from datos_sinteticos import registros_sinteticos
+
+
+def test_lanzamiento_fallido_es_runtime_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(reportes_tienda.sys, 'executable', str(tmp_path / 'no-existe'))
+    with pytest.raises(RuntimeError):
+        reportes_tienda.generar_zip_aparte(str(tmp_path / 'reportes.zip'))
+
+
+def test_espera_cortada_no_deja_temporal(tmp_path, monkeypatch):
+    directorio = tmp_path / 'datos'
+    almacenamiento.crear_almacen('jsonl', str(directorio)).guardar(list(registros_sinteticos(300, tiendas=4)))
+    monkeypatch.setenv('VIALE_ALMACENAMIENTO', 'jsonl')
+    monkeypatch.setenv('VIALE_DIRECTORIO_DATOS', str(directorio))
+    salida = tmp_path / 'reportes.zip'
+
+    def al_avanzar(hechos, total, tienda):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        reportes_tienda.generar_zip_aparte(str(salida), procesos=1, al_avanzar=al_avanzar)
+    assert not os.path.exists(str(salida) + '.tmp')
+    assert not salida.exists()
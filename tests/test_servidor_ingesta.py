@@ -0,0 +1,60 @@
+"""Autenticación del servicio de ingesta"""
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import almacenamiento
+import servidor_ingesta
+
+
+@pytest.fixture
+def servir(tmp_path):
+    servidores = []
+
+    def servir(token):
+        almacen = almacenamiento.crear_almacen('jsonl', str(tmp_path))
+        servidor = servidor_ingesta.crear_servidor('127.0.0.1', 0, almacen=almacen, token=token)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        servidores.append(servidor)
+        return f"http://127.0.0.1:{servidor.server_address[1]}"
+
+    yield servir
+    for servidor in servidores:
+        servidor.shutdown()
+        servidor.server_close()
+        servidor.servicio.cola.cerrar()
+
+
+def _estado(url, token=None):
+    peticion = urllib.request.Request(url)
+    if token is not None:
+        peticion.add_header('Authorization', f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(peticion) as respuesta:
+            respuesta.read()
+            return respuesta.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_exportacion_sin_token_configurado_es_403(servir):
+    base = servir('')
+    assert _estado(base + '/exportacion.csv') == 403
+    assert _estado(base + '/salud') == 200
+
+
+def test_exportacion_exige_el_token(servir):
+    base = servir('secreto')
+    assert _estado(base + '/exportacion.csv') == 401
+    assert _estado(base + '/exportacion.csv', 'otro') == 401
+    assert _estado(base + '/exportacion.csv', 'secreto') == 200
+
+
+def test_sin_token_solo_interfaz_local(tmp_path):
+    almacen = almacenamiento.crear_almacen('jsonl', str(tmp_path))
+    with pytest.raises(ValueError):
+        servidor_ingesta.crear_servidor('0.0.0.0', 0, almacen=almacen, token='')
+    assert servidor_ingesta.es_local('localhost') and servidor_ingesta.es_local('::1')
+    assert not servidor_ingesta.es_local('192.168.1.10')